@@ -9,6 +9,7 @@ from flask import Blueprint, Flask
 from flask_restx import Api
 
 from app.commands import cache
+from app.common import instrumentation
 from app.endpoints import calculation_module, datasets, wms
 from app.healthz import healthz
 
@@ -44,17 +45,36 @@ def create_app(environment="production", testing=False, on_startup=False):
     app.config["TESTING"] = testing
     app.config["MAX_CONTENT_LENGTH"] = 200 * 1024 * 1024
     app.config["MAX_PROJECTION_LENGTH"] = 1024
+    app.config["METADATA_CACHE_SIZE"] = 64
+    app.config["PARAMETERS_CACHE_TTL"] = 300
     app.config["RASTER_CACHE_DIR"] = None
+    app.config["GEOJSON_DOWNLOAD_JOBS"] = 4
+    app.config["RASTER_DOWNLOAD_JOBS"] = 8
+    app.config["RASTER_DOWNLOAD_RETRIES"] = 3
+    app.config["RASTER_DOWNLOAD_BACKOFF"] = 1.0
+    app.config["RASTER_OVERVIEW_FACTOR"] = 8
     app.config["WMS_CACHE_DIR"] = "wms_cache"
     app.config["CM_OUTPUTS_DIR"] = "cm_outputs"
     app.config["FILTER_DATASETS"] = False
+    app.config["INSTRUMENTATION"] = False
+    app.config["PROFILING_SAMPLE_RATE"] = 0.0
+    app.config["PROFILING_THRESHOLD"] = 1.0
+    app.config["PROFILING_DIR"] = "profiles"
     app.config["RASTER_PROJECTION_SYSTEM"] = "EPSG:3035"
     app.config["VECTOR_PROJECTION_SYSTEM"] = "EPSG:4326"
+    # Public URL of the WMS endpoint, used in the GetCapabilities document (if
+    # None, the URL of each request is used, and the document isn't cached). Set
+    # in docker-compose.yml, see the README
+    app.config["WMS_BASE_URL"] = None
     app.config["WMS"] = {}
     app.config["WMS"]["ALLOWED_PROJECTIONS"] = ["EPSG:3857"]
     app.config["WMS"]["MAX_SIZE"] = 2048 ** 2
     app.config["WMS"]["GETMAP"] = {}
     app.config["WMS"]["GETMAP"]["ALLOWED_OUTPUTS"] = ["image/png", "image/jpg"]
+    app.config["WMS"]["GETMAP"]["CACHE"] = True
+    app.config["WMS"]["GETMAP"]["CACHE_MEMORY_SIZE"] = 128
+    app.config["WMS"]["GETMAP"]["MAPS_POOL_SIZE"] = 64
+    app.config["WMS"]["GETMAP"]["RENDER_THREADS"] = 4
 
     for k, v in app.config.items():
         app.config[k] = os.environ.get(k, v)
@@ -69,6 +89,8 @@ def create_app(environment="production", testing=False, on_startup=False):
     app.register_blueprint(api_bp)
     app.register_blueprint(healthz)
 
+    instrumentation.init_app(app)
+
     app.cli.add_command(cache.update_all_datasets)
     app.cli.add_command(cache.update_dataset)
     app.cli.add_command(cache.update_areas)
@@ -1,8 +1,13 @@
 import itertools
 import json
+import logging
+import os
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from tempfile import NamedTemporaryFile
 
 import click
+import requests
 from flask import current_app
 from flask.cli import with_appcontext
 
@@ -10,19 +15,54 @@ from app.common import client
 from app.common import datasets as datasets_fcts
 from app.common import path
 from app.common.projection import epsg_string_to_proj4
-from app.models import geofile, storage
+from app.models import geofile
+from app.models import parameters as parameters_cache
+from app.models import storage, tiles
+from app.models.wms import capabilities
 
 
 @click.command("update-all-datasets")
+@click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    help="Number of processes used to download the layers in parallel",
+)
 @with_appcontext
-def update_all_datasets():
+def update_all_datasets(jobs):
+    # The parameters of the datasets might have changed since they were cached
+    parameters_cache.invalidate_all()
+
     datasets = client.get_dataset_list(disable_filtering=True)
     if len(datasets) == 0:
         current_app.logger.info("No dataset found")
         return
 
-    for dataset in datasets:
-        process_dataset(dataset, ignore_intersecting=True)
+    time_started = time.time()
+
+    if jobs > 1:
+        summary = process_datasets_in_parallel(datasets, jobs)
+    else:
+        summary = {}
+        for dataset in datasets:
+            summary[dataset["ds_id"]] = process_dataset(
+                dataset, ignore_intersecting=True
+            )
+
+    capabilities.refresh()
+
+    failed = [ds_id for ds_id, success in summary.items() if not success]
+
+    result = "\n"
+    result += f"{len(summary) - len(failed)}/{len(summary)} datasets processed in"
+    result += f" {int(time.time() - time_started)} seconds\n"
+
+    if len(failed) > 0:
+        result += "Failed datasets:\n"
+        for ds_id in failed:
+            result += f"- {ds_id}\n"
+
+    current_app.logger.info(result)
 
 
 @click.command("update-dataset")
@@ -34,6 +74,9 @@ def update_all_datasets():
 @click.option("-l", "--rowlimit", default=1000)
 @with_appcontext
 def update_dataset(ds_id, all, center, dimension, prettyprint, rowlimit):
+    # The parameters of the dataset might have changed since they were cached
+    parameters_cache.invalidate(int(ds_id))
+
     datasets = client.get_dataset_list(disable_filtering=True)
     datasets = [x for x in datasets if x["ds_id"] == int(ds_id)]
 
@@ -66,6 +109,8 @@ def update_dataset(ds_id, all, center, dimension, prettyprint, rowlimit):
             pretty_print=prettyprint,
             # row_limit=rowlimit,
         )
+
+        capabilities.refresh()
     else:
         current_app.logger.info("Dataset not found")
 
@@ -214,12 +259,47 @@ def get_legend(ds_id, variable, time_period, prettyprint):
 def process_dataset(
     dataset, ignore_intersecting=False, target_area=None, pretty_print=False
 ):
+    """Download all the layers of a dataset, one after the other. Return True on
+    success.
+    """
+    type = path.RASTER if dataset["is_raster"] else path.VECTOR
+
+    layers = list_dataset_layers(dataset)
+    if layers is None:
+        return False
+
+    results = {}
+
+    for variable, time_period in layers:
+        success, valid_variables = process_layer(
+            type,
+            dataset["ds_id"],
+            variable=variable,
+            time_period=time_period,
+            ignore_intersecting=ignore_intersecting,
+            target_area=target_area,
+            pretty_print=pretty_print,
+        )
+
+        results[(variable, time_period)] = (success, valid_variables)
+
+        if not success:
+            break
+
+    return finish_dataset(dataset, layers, results)
+
+
+def list_dataset_layers(dataset):
+    """Return the layers of a dataset, as a list of (variable, time_period) tuples
+    (each one may be None), or None if the parameters of the dataset couldn't be
+    retrieved
+    """
     type = path.RASTER if dataset["is_raster"] else path.VECTOR
 
     # Retrieve the variables of the dataset
     parameters = client.get_parameters(dataset["ds_id"])
     if parameters is None:
-        return
+        return None
 
     datasets_fcts.process_parameters(parameters)
 
@@ -228,51 +308,40 @@ def process_dataset(
         parameters["variables"] = []
 
     # Iterate over all combinations of variables and time_periods
-    if (len(parameters["variables"]) > 0) and (len(parameters["time_periods"]) > 0):
-        for variable, time_period in itertools.product(
-            parameters["variables"], parameters["time_periods"]
-        ):
-            success, _ = process_layer(
-                type,
-                dataset["ds_id"],
-                variable=variable,
-                time_period=time_period,
-                ignore_intersecting=ignore_intersecting,
-                target_area=target_area,
-                pretty_print=pretty_print,
-            )
+    variables = parameters["variables"]
+    if len(variables) == 0:
+        variables = [None]
 
-            if not success:
-                break
-
-    elif len(parameters["variables"]) > 0:
-        for variable in parameters["variables"]:
-            success, _ = process_layer(
-                type,
-                dataset["ds_id"],
-                variable=variable,
-                ignore_intersecting=ignore_intersecting,
-                target_area=target_area,
-                pretty_print=pretty_print,
-            )
+    time_periods = parameters["time_periods"]
+    if len(time_periods) == 0:
+        time_periods = [None]
 
-            if not success:
-                break
-    elif len(parameters["time_periods"]) > 0:
+    return list(itertools.product(variables, time_periods))
+
+
+def finish_dataset(dataset, layers, results):
+    """Save the files describing the whole dataset, once its layers were processed.
+    The results are (success, valid_variables) tuples indexed by the
+    (variable, time_period) of the layers. Return True if all the layers were
+    successfully processed.
+    """
+    type = path.RASTER if dataset["is_raster"] else path.VECTOR
+
+    success = all((layer in results) and results[layer][0] for layer in layers)
+
+    # For vector datasets with time periods, save the valid combinations
+    if type == path.VECTOR:
         valid_combinations = {}
 
-        for time_period in parameters["time_periods"]:
-            success, valid_variables = process_layer(
-                type,
-                dataset["ds_id"],
-                time_period=time_period,
-                ignore_intersecting=ignore_intersecting,
-                target_area=target_area,
-                pretty_print=pretty_print,
-            )
+        for layer in layers:
+            if layer not in results:
+                continue
+
+            (_, time_period) = layer
+            (layer_success, valid_variables) = results[layer]
 
-            if not success:
-                break
+            if (time_period is None) or not (layer_success):
+                continue
 
             if valid_variables is not None:
                 if time_period not in valid_combinations:
@@ -280,7 +349,7 @@ def process_dataset(
 
                 valid_combinations[time_period].extend(valid_variables)
 
-        if (type == path.VECTOR) and (len(valid_combinations) > 0):
+        if len(valid_combinations) > 0:
             layer_name = path.make_unique_layer_name(type, dataset["ds_id"])
             storage_instance = storage.create(layer_name)
             with open(
@@ -288,14 +357,6 @@ def process_dataset(
                 "w",
             ) as f:
                 json.dump(valid_combinations, f)
-    else:
-        success, _ = process_layer(
-            type,
-            dataset["ds_id"],
-            ignore_intersecting=ignore_intersecting,
-            target_area=target_area,
-            pretty_print=pretty_print,
-        )
 
     # For raster datasets, save the projection in a file
     if success and (type == path.RASTER):
@@ -306,6 +367,90 @@ def process_dataset(
             epsg_string_to_proj4(current_app.config["RASTER_PROJECTION_SYSTEM"]),
         )
 
+    return success
+
+
+def process_datasets_in_parallel(datasets, jobs):
+    """Download the layers of several datasets using a pool of processes. Return a
+    dictionary indicating if each dataset was successfully processed.
+    """
+    summary = {}
+    layers_of_datasets = {}
+    futures = {}
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as executor:
+        for dataset in datasets:
+            layers = list_dataset_layers(dataset)
+            if layers is None:
+                current_app.logger.info(
+                    f"Failed to retrieve the parameters of dataset <{dataset['ds_id']}>"
+                )
+                summary[dataset["ds_id"]] = False
+                continue
+
+            layers_of_datasets[dataset["ds_id"]] = (dataset, layers)
+
+            type = path.RASTER if dataset["is_raster"] else path.VECTOR
+
+            for variable, time_period in layers:
+                future = executor.submit(
+                    _process_layer_in_worker,
+                    type,
+                    dataset["ds_id"],
+                    variable,
+                    time_period,
+                )
+                futures[future] = (dataset["ds_id"], variable, time_period)
+
+        results = {ds_id: {} for ds_id in layers_of_datasets.keys()}
+
+        for index, future in enumerate(as_completed(futures)):
+            ds_id, variable, time_period = futures[future]
+
+            try:
+                result = future.result()
+            except Exception as ex:
+                logging.error(
+                    f"Failed to process a layer of dataset <{ds_id}>: {repr(ex)}"
+                )
+                result = (False, None)
+
+            results[ds_id][(variable, time_period)] = result
+
+            status = "done" if result[0] else "failed"
+            current_app.logger.info(
+                f"[{index + 1}/{len(futures)}] dataset <{ds_id}>, variable"
+                f" <{variable}>, time period <{time_period}>: {status}"
+            )
+
+    for ds_id, (dataset, layers) in layers_of_datasets.items():
+        summary[ds_id] = finish_dataset(dataset, layers, results[ds_id])
+
+    return summary
+
+
+# Application used by the processes of the pool
+_worker_app = None
+
+
+def _init_worker():
+    global _worker_app
+
+    from app import create_app
+
+    _worker_app = create_app()
+
+
+def _process_layer_in_worker(type, id, variable, time_period):
+    with _worker_app.app_context():
+        return process_layer(
+            type,
+            id,
+            variable=variable,
+            time_period=time_period,
+            ignore_intersecting=True,
+        )
+
 
 def process_layer(
     type,
@@ -323,76 +468,255 @@ def process_layer(
     time_started = time.time()
 
     if type == path.VECTOR:
-        current_app.logger.info(f"Download geojson <{layer_name}>...")
-
-        data = client.get_geojson(
+        return process_vector_layer(
             layer_name,
             ignore_intersecting=ignore_intersecting,
             target_area=target_area,
             pretty_print=pretty_print,
         )
 
-        if data is None:
-            current_app.logger.info("... failed to retrieve the geojson")
-            return (False, None)
+    current_app.logger.info(f"Download raster files list of <{layer_name}>...")
+
+    data = client.get_rasters(
+        layer_name,
+        ignore_intersecting=ignore_intersecting,
+        target_area=target_area,
+        pretty_print=pretty_print,
+    )
 
-        if (data["features"] is None) or (len(data["features"]) == 0):
-            current_app.logger.info("... no feature found in the geojson")
-            return (False, None)
+    if data is None:
+        current_app.logger.info("... failed to retrieve the list of raster files")
+        return (False, None)
+
+    if len(data) == 0:
+        current_app.logger.info("... no raster file found")
+        return (False, None)
+
+    time_fetched = time.time()
+
+    current_app.logger.info(
+        f"... fetch done in {int(time_fetched - time_started)} seconds"
+    )
+
+    success = True
+
+    # Don't download raster files if we have directly access to them. The raster
+    # files already downloaded are kept, to only fetch the missing or modified ones
+    if current_app.config["RASTER_CACHE_DIR"] is None:
+        success = download_raster_files(layer_name, id, data)
     else:
-        current_app.logger.info(f"Download raster files list of <{layer_name}>...")
+        geofile.delete_all_features(layer_name)
+
+    current_app.logger.info("... save geometries")
+    geofile.save_raster_geometries(layer_name, data)
+
+    current_app.logger.info("... build overview")
+    geofile.save_raster_overview(layer_name)
+
+    # The tiles rendered while the layer was being written are outdated
+    tiles.invalidate(layer_name)
+
+    time_saved = time.time()
+    current_app.logger.info(
+        f"... save done in {int(time_saved - time_fetched)} seconds."
+    )
+
+    return (success, None)
+
+
+def process_vector_layer(
+    layer_name, ignore_intersecting=False, target_area=None, pretty_print=False
+):
+    """Download the features of a vector layer, saving them while they are
+    retrieved. The previous version of the layer is only replaced once all the
+    features were saved.
+    """
+    current_app.logger.info(f"Download geojson <{layer_name}>...")
+
+    time_started = time.time()
 
-        data = client.get_rasters(
+    try:
+        features = client.iter_geojson_features(
             layer_name,
             ignore_intersecting=ignore_intersecting,
             target_area=target_area,
             pretty_print=pretty_print,
+            jobs=max(int(current_app.config["GEOJSON_DOWNLOAD_JOBS"]), 1),
         )
 
-        if data is None:
-            current_app.logger.info("... failed to retrieve the list of raster files")
-            return (False, None)
-
-        if len(data) == 0:
-            current_app.logger.info("... no raster file found")
-            return (False, None)
+        first_feature = next(features)
+    except StopIteration:
+        current_app.logger.info("... no feature found in the geojson")
+        return (False, None)
+    except Exception:
+        current_app.logger.info("... failed to retrieve the geojson")
+        return (False, None)
+
+    try:
+        valid_variables = geofile.save_vector_features(
+            layer_name, itertools.chain([first_feature], features), replace=True
+        )
+    except Exception:
+        current_app.logger.info("... failed to retrieve the geojson")
+        return (False, None)
 
-    time_fetched = time.time()
+    # The tiles rendered while the layer was being written are outdated
+    tiles.invalidate(layer_name)
 
     current_app.logger.info(
-        f"... fetch done in {int(time_fetched - time_started)} seconds"
+        f"... fetch and save done in {int(time.time() - time_started)} seconds"
     )
 
-    geofile.delete_all_features(layer_name)
+    return (True, valid_variables)
+
+
+def download_raster_files(layer_name, dataset_id, features):
+    """Download the raster files of a layer, using several threads.
+
+    A manifest of the downloaded files is kept in the folder of the layer, so an
+    interrupted download can be resumed: the files already on disk are only
+    fetched again if they were modified on the server. The files of the layer
+    that aren't in the list anymore are deleted.
+
+    Return True if all the files were successfully downloaded.
+    """
+    storage_instance = storage.create(layer_name)
+
+    jobs = max(int(current_app.config["RASTER_DOWNLOAD_JOBS"]), 1)
+    retries = max(int(current_app.config["RASTER_DOWNLOAD_RETRIES"]), 0)
+    backoff = float(current_app.config["RASTER_DOWNLOAD_BACKOFF"])
+
+    tmp_dir = storage_instance.get_tmp_dir()
+    manifest_file = storage_instance.get_download_manifest_file(layer_name)
+
+    os.makedirs(tmp_dir, exist_ok=True)
+    os.makedirs(storage_instance.get_dir(layer_name, cache=True), exist_ok=True)
+
+    try:
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+
+    feature_ids = [feature["fid"] for feature in features]
+
+    for feature_id in set(manifest.keys()) - set(feature_ids):
+        try:
+            os.remove(storage_instance.get_file_path(layer_name, feature_id))
+        except FileNotFoundError:
+            pass
+
+        del manifest[feature_id]
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=jobs)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
 
-    valid_variables = None
     success = True
 
-    if type == path.VECTOR:
-        valid_variables = geofile.save_vector_geojson(layer_name, data)
-    else:
-        # Don't download raster files if we have directly access to them
-        if current_app.config["RASTER_CACHE_DIR"] is None:
-            for feature in data:
-                feature_id = feature["fid"]
-                current_app.logger.info(f"... download raster file <{feature_id}>")
-                raster_content = client.get_raster_file(id, feature_id)
-
-                if raster_content is not None:
-                    geofile.save_raster_file(layer_name, feature_id, raster_content)
-                else:
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {}
+
+            for feature_id in feature_ids:
+                filename = storage_instance.get_file_path(layer_name, feature_id)
+
+                # Only reuse the files that were completely downloaded
+                validators = manifest.get(feature_id)
+                if (validators is not None) and (
+                    not (os.path.exists(filename))
+                    or (os.path.getsize(filename) != validators["size"])
+                ):
+                    validators = None
+
+                future = executor.submit(
+                    _download_raster_file,
+                    session,
+                    dataset_id,
+                    feature_id,
+                    filename,
+                    tmp_dir,
+                    validators,
+                    retries,
+                    backoff,
+                )
+
+                futures[future] = feature_id
+
+            for index, future in enumerate(as_completed(futures)):
+                feature_id = futures[future]
+                entry = future.result()
+
+                if entry is None:
+                    current_app.logger.info(
+                        f"... failed to download raster file <{feature_id}>"
+                    )
+                    manifest.pop(feature_id, None)
                     success = False
-                    break
+                    continue
 
-        current_app.logger.info("... save geometries")
-        geofile.save_raster_geometries(layer_name, data)
+                current_app.logger.info(
+                    f"... download raster file <{feature_id}> ({index + 1}/"
+                    f"{len(futures)})"
+                )
+                manifest[feature_id] = entry
 
-    time_saved = time.time()
-    current_app.logger.info(
-        f"... save done in {int(time_saved - time_fetched)} seconds."
-    )
+                if (index + 1) % 50 == 0:
+                    _save_download_manifest(manifest_file, tmp_dir, manifest)
+    finally:
+        _save_download_manifest(manifest_file, tmp_dir, manifest)
+        session.close()
+
+    return success
+
+
+def _download_raster_file(
+    session, dataset_id, feature_id, filename, tmp_dir, validators, retries, backoff
+):
+    """Download a raster file (retrying with an exponential backoff on failure),
+    and return its entry in the download manifest, or None on failure. Called from
+    the threads of the pool, so it doesn't use the application context.
+    """
+    for attempt in range(retries + 1):
+        with NamedTemporaryFile(dir=tmp_dir, delete=False) as f:
+            tmp_filename = f.name
+
+        try:
+            modified, new_validators = client.download_raster_file(
+                session, dataset_id, feature_id, tmp_filename, validators=validators
+            )
+
+            if modified:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                os.replace(tmp_filename, filename)
+            else:
+                os.remove(tmp_filename)
+
+            entry = dict(new_validators)
+            entry["size"] = os.path.getsize(filename)
+            return entry
+
+        except Exception as ex:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+            logging.error(
+                f"Failed to retrieve the raster file <{feature_id}> of dataset"
+                f" <{dataset_id}> (attempt {attempt + 1}/{retries + 1}): {repr(ex)}"
+            )
+
+            if attempt < retries:
+                time.sleep(backoff * 2 ** attempt)
+
+    return None
+
+
+def _save_download_manifest(manifest_file, tmp_dir, manifest):
+    with NamedTemporaryFile("w", dir=tmp_dir, delete=False) as f:
+        json.dump(manifest, f)
 
-    return (success, valid_variables)
+    os.replace(f.name, manifest_file)
 
 
 def process_area(id):
@@ -412,6 +736,7 @@ def process_area(id):
     )
 
     geofile.save_vector_geojson(layer_name, data)
+    tiles.invalidate(layer_name)
 
     time_saved = time.time()
     current_app.logger.info(
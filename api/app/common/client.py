@@ -1,21 +1,121 @@
 #!/usr/bin/python
+import copy
 import json
 import logging
 import os
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from functools import lru_cache
 
 import requests
 from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from app.common import datasets, path
+from app.common import datasets, instrumentation, path
+from app.models import parameters as parameters_cache
 from app.models import storage
 
 DATASETS_SERVER_URL = os.environ.get("DATASETS_SERVER_URL", "")
 DATASETS_SERVER_API_KEY = os.environ.get("DATASETS_SERVER_API_KEY", "")
 RASTER_SERVER_URL = os.environ.get("RASTER_SERVER_URL", "")
 
+RASTER_CHUNK_SIZE = 1024 * 1024
+
+DATASETS_SERVER_TIMEOUT = float(os.environ.get("DATASETS_SERVER_TIMEOUT", 60))
+DATASETS_SERVER_POOL_SIZE = int(os.environ.get("DATASETS_SERVER_POOL_SIZE", 16))
+DATASETS_SERVER_RETRIES = int(os.environ.get("DATASETS_SERVER_RETRIES", 3))
+
+# HTTP session shared by all the threads of the process
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+# Latency metrics of the requests, indexed by RPC name
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def get_session():
+    """Return the HTTP session shared by all the threads of the current process,
+    keeping the connections to the servers alive between the requests. A new
+    session is created after a fork, since connections can't be shared between
+    processes.
+    """
+    global _session, _session_pid
+
+    with _session_lock:
+        if (_session is None) or (_session_pid != os.getpid()):
+            _session = _create_session()
+            _session_pid = os.getpid()
+
+        return _session
+
+
+def get_metrics():
+    """Return the latency metrics of the requests done by the current process,
+    indexed by RPC name
+    """
+    with _metrics_lock:
+        return copy.deepcopy(_metrics)
+
+
+def _create_session():
+    # Retry the idempotent requests on connection errors and when the server is
+    # temporarily unavailable
+    retry = Retry(
+        total=DATASETS_SERVER_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+
+    adapter = HTTPAdapter(
+        pool_connections=DATASETS_SERVER_POOL_SIZE,
+        pool_maxsize=DATASETS_SERVER_POOL_SIZE,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    session.headers["Connection"] = "keep-alive"
+
+    return session
+
+
+@contextmanager
+def _measure(name):
+    """Record the duration of a request in the latency metrics"""
+    time_started = time.perf_counter()
+    failed = True
+
+    try:
+        with instrumentation.span(f"client.{name}"):
+            yield
+        failed = False
+    finally:
+        duration = time.perf_counter() - time_started
+
+        with _metrics_lock:
+            metrics = _metrics.setdefault(
+                name, {"count": 0, "errors": 0, "total_time": 0.0, "max_time": 0.0}
+            )
+
+            metrics["count"] += 1
+            metrics["total_time"] += duration
+            metrics["max_time"] = max(metrics["max_time"], duration)
+
+            if failed:
+                metrics["errors"] += 1
+
+        logging.debug(f"RPC <{name}> done in {int(duration * 1000)} ms")
+
 
 def get_ttl_hash(seconds=10):
     """Return the same value within `seconds` time period"""
@@ -27,7 +127,9 @@ def get_dataset_list(disable_filtering=False, pretty_print=False):
     url = DATASETS_SERVER_URL + "dataset_list"
 
     try:
-        with requests.get(url) as resp:
+        with _measure("dataset_list"), get_session().get(
+            url, timeout=DATASETS_SERVER_TIMEOUT
+        ) as resp:
             if pretty_print:
                 _pretty_print_request(resp)
 
@@ -48,6 +150,14 @@ def get_dataset_list(disable_filtering=False, pretty_print=False):
 
 
 def get_parameters(dataset_id, pretty_print=False):
+    # Always contact the server when the request must be displayed
+    if pretty_print:
+        return _get_parameters(dataset_id, pretty_print=True)
+
+    return parameters_cache.get(dataset_id, lambda: _get_parameters(dataset_id))
+
+
+def _get_parameters(dataset_id, pretty_print=False):
     url = DATASETS_SERVER_URL + "rpc/enermaps_get_parameters"
 
     params = {
@@ -57,7 +167,9 @@ def get_parameters(dataset_id, pretty_print=False):
     headers = {"Authorization": "Bearer {}".format(DATASETS_SERVER_API_KEY)}
 
     try:
-        with requests.get(url, headers=headers, params=params) as resp:
+        with _measure("enermaps_get_parameters"), get_session().get(
+            url, headers=headers, params=params, timeout=DATASETS_SERVER_TIMEOUT
+        ) as resp:
             if pretty_print:
                 _pretty_print_request(resp)
 
@@ -118,11 +230,37 @@ def get_geojson(
     return _get_geojson(parameters, pretty_print, row_limit=row_limit)
 
 
+def iter_geojson_features(
+    layer_name,
+    ignore_intersecting=False,
+    target_area=None,
+    pretty_print=False,
+    row_limit=1000,
+    jobs=1,
+):
+    """
+    Fetch the features of a geojson dataset layer from the enermaps server, and
+    return an iterator over them.
+
+    The pages of features are retrieved by `jobs` concurrent threads, and
+    only those pages are kept in memory, whatever the size of the layer. The
+    iterator raises an exception on failure.
+    """
+    parameters = _parameters_from_layer_name(
+        layer_name, ignore_intersecting=ignore_intersecting, target_area=target_area
+    )
+    return _iter_geojson_features(
+        parameters, pretty_print=pretty_print, row_limit=row_limit, jobs=jobs
+    )
+
+
 def get_raster_file(dataset_id, feature_id):
     url = f"{RASTER_SERVER_URL}{dataset_id}/{feature_id}"
 
     try:
-        with requests.get(url, stream=True) as resp:
+        with _measure("raster_file"), get_session().get(
+            url, stream=True, timeout=DATASETS_SERVER_TIMEOUT
+        ) as resp:
             if resp.status_code != 200:
                 resp.raise_for_status()
 
@@ -136,6 +274,44 @@ def get_raster_file(dataset_id, feature_id):
     return None
 
 
+def download_raster_file(session, dataset_id, feature_id, filename, validators=None):
+    """Stream a raster file from the raster server into a file, without holding its
+    whole content in memory.
+
+    The validators are the ones returned by a previous download of the file: if
+    the server indicates that the file didn't change since then, nothing is
+    written. Return a (modified, validators) tuple, raise an exception on failure.
+    """
+    url = f"{RASTER_SERVER_URL}{dataset_id}/{feature_id}"
+
+    headers = {}
+    if validators is not None:
+        if validators.get("etag") is not None:
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified") is not None:
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    with session.get(
+        url, headers=headers, stream=True, timeout=DATASETS_SERVER_TIMEOUT
+    ) as resp:
+        if resp.status_code == 304:
+            return (False, validators)
+
+        if resp.status_code != 200:
+            resp.raise_for_status()
+
+        with open(filename, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=RASTER_CHUNK_SIZE):
+                f.write(chunk)
+
+        validators = {
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+        }
+
+    return (True, validators)
+
+
 @lru_cache(maxsize=10)
 def get_legend(layer_name, pretty_print=False, ttl_hash=None):
     """
@@ -154,7 +330,9 @@ def get_legend(layer_name, pretty_print=False, ttl_hash=None):
             "parameters": json.dumps(parameters),
         }
 
-        with requests.get(url, headers=headers, params=params, timeout=10) as resp:
+        with _measure("enermaps_get_legend"), get_session().get(
+            url, headers=headers, params=params, timeout=10
+        ) as resp:
             if pretty_print:
                 _pretty_print_request(resp)
 
@@ -203,7 +381,9 @@ def get_rasters(
             "parameters": json.dumps(parameters),
         }
 
-        with requests.get(url, headers=headers, params=params) as resp:
+        with _measure("enermaps_get_rasters"), get_session().get(
+            url, headers=headers, params=params, timeout=DATASETS_SERVER_TIMEOUT
+        ) as resp:
             if pretty_print:
                 _pretty_print_request(resp)
 
@@ -239,7 +419,9 @@ def _get_geojson(parameters, pretty_print=False, row_limit=1000):
                 "row_limit": row_limit,
             }
 
-            with requests.get(url, headers=headers, params=params) as resp:
+            with _measure("enermaps_query_geojson"), get_session().get(
+                url, headers=headers, params=params, timeout=DATASETS_SERVER_TIMEOUT
+            ) as resp:
                 if pretty_print:
                     _pretty_print_request(resp)
 
@@ -268,6 +450,61 @@ def _get_geojson(parameters, pretty_print=False, row_limit=1000):
     return all_data
 
 
+def _iter_geojson_features(parameters, pretty_print=False, row_limit=1000, jobs=1):
+    url = DATASETS_SERVER_URL + "rpc/enermaps_query_geojson"
+
+    headers = {"Authorization": "Bearer {}".format(DATASETS_SERVER_API_KEY)}
+
+    def _get_page(row_offset):
+        params = {
+            "parameters": json.dumps(parameters),
+            "row_offset": row_offset,
+            "row_limit": row_limit,
+        }
+
+        with _measure("enermaps_query_geojson"), get_session().get(
+            url, headers=headers, params=params, timeout=DATASETS_SERVER_TIMEOUT
+        ) as resp:
+            if pretty_print:
+                _pretty_print_request(resp)
+
+            if resp.status_code != 200:
+                resp.raise_for_status()
+
+            data = resp.json()
+
+        if "features" not in data:
+            raise ValueError(f"Invalid page of features at offset {row_offset}")
+
+        # No more features
+        if data["features"] is None:
+            return []
+
+        return data["features"]
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            pending = deque()
+            row_offset = 0
+
+            while True:
+                # Keep retrieving the next pages while the current one is processed
+                while len(pending) < jobs:
+                    pending.append(executor.submit(_get_page, row_offset))
+                    row_offset += row_limit
+
+                features = pending.popleft().result()
+
+                yield from features
+
+                if len(features) < row_limit:
+                    break
+
+    except Exception as ex:
+        logging.error(f"Failed to retrieve the geojson: {repr(ex)}")
+        raise
+
+
 def _parameters_from_layer_name(
     layer_name, ignore_intersecting=False, target_area=None
 ):
@@ -0,0 +1,275 @@
+"""Opt-in instrumentation of the requests handled by the API.
+
+When INSTRUMENTATION is enabled, the duration of the main steps of each request
+(the "spans", recorded with span()) is:
+
+* sent back to the client in a Server-Timing header
+* aggregated in metrics, published in the Prometheus text format on /metrics
+
+Each gunicorn worker regularly saves its metrics in the WMS cache folder, so
+/metrics can report the metrics of all the workers, whichever one handles it.
+
+Additionally, a fraction (PROFILING_SAMPLE_RATE) of the requests can be
+profiled with cProfile: the profiles of the ones slower than PROFILING_THRESHOLD
+seconds are saved in PROFILING_DIR, to be inspected with pstats or snakeviz.
+"""
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+
+from flask import Blueprint, Response, current_app, g, has_request_context, request
+
+# Upper bounds (in seconds) of the buckets of the histograms
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Delay (in seconds) between two saves of the metrics of a process
+METRICS_SAVE_INTERVAL = 5
+
+# The metrics of the processes not updated for that long (in seconds) are ignored
+METRICS_EXPIRATION = 3600
+
+instrumentation = Blueprint("instrumentation", __name__)
+
+# Metrics of the current process: {metric name: {labels: histogram}}
+_metrics = {}
+_metrics_lock = threading.Lock()
+_metrics_saved_at = 0
+
+
+def is_enabled(app=None):
+    if app is None:
+        app = current_app
+
+    return str(app.config["INSTRUMENTATION"]).lower() in ("1", "true", "yes")
+
+
+def init_app(app):
+    """Install the instrumentation in the application, if enabled"""
+    if not is_enabled(app):
+        return
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    app.register_blueprint(instrumentation)
+
+
+@contextmanager
+def span(name):
+    """Record the duration of a step of the current request. Does nothing if the
+    instrumentation is disabled, or outside of a request.
+    """
+    if not has_request_context() or ("spans" not in g):
+        yield
+        return
+
+    time_started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - time_started
+
+        count, total = g.spans.get(name, (0, 0.0))
+        g.spans[name] = (count + 1, total + duration)
+
+        _observe("enermaps_span_seconds", (("span", name),), duration)
+
+
+@instrumentation.route("/metrics")
+def get_metrics():
+    _save_metrics(force=True)
+
+    metrics = {}
+    for process_metrics in _load_all_metrics():
+        for name, series in process_metrics.items():
+            for labels, histogram in series:
+                _merge(
+                    metrics.setdefault(name, {}), tuple(map(tuple, labels)), histogram
+                )
+
+    return Response(_format_metrics(metrics), mimetype="text/plain; version=0.0.4")
+
+
+def _start_request():
+    g.spans = OrderedDict()
+    g.request_started_at = time.perf_counter()
+    g.profiler = None
+
+    sample_rate = float(current_app.config["PROFILING_SAMPLE_RATE"])
+    if (sample_rate > 0) and (random.random() < sample_rate):
+        g.profiler = cProfile.Profile()
+        try:
+            g.profiler.enable()
+        except ValueError:
+            # Another profiler is already running in this process
+            g.profiler = None
+
+
+def _finish_request(response):
+    if "spans" not in g:
+        return response
+
+    duration = time.perf_counter() - g.request_started_at
+
+    endpoint = request.endpoint or "unknown"
+    _observe(
+        "enermaps_request_seconds",
+        (("endpoint", endpoint), ("status", str(response.status_code))),
+        duration,
+    )
+
+    timings = [
+        f'{name};dur={total * 1000:.1f};desc="{count}x"'
+        for name, (count, total) in g.spans.items()
+    ]
+    timings.append(f"total;dur={duration * 1000:.1f}")
+    response.headers.add("Server-Timing", ", ".join(timings))
+
+    _save_metrics()
+
+    return response
+
+
+def _teardown_request(exception=None):
+    # Done here rather than in _finish_request, which isn't called when the
+    # request fails: the profiler must always be disabled, or no other request
+    # could be profiled by this process
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+
+    profiler.disable()
+
+    duration = time.perf_counter() - g.request_started_at
+    if duration >= float(current_app.config["PROFILING_THRESHOLD"]):
+        _save_profile(profiler, duration)
+
+
+def _observe(name, labels, value):
+    with _metrics_lock:
+        histogram = _metrics.setdefault(name, {}).get(labels)
+        if histogram is None:
+            histogram = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+            _metrics[name][labels] = histogram
+
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+
+        histogram["count"] += 1
+        histogram["sum"] += value
+
+
+def _merge(series, labels, histogram):
+    total = series.get(labels)
+    if total is None:
+        series[labels] = {
+            "buckets": list(histogram["buckets"]),
+            "count": histogram["count"],
+            "sum": histogram["sum"],
+        }
+        return
+
+    total["buckets"] = [x + y for x, y in zip(total["buckets"], histogram["buckets"])]
+    total["count"] += histogram["count"]
+    total["sum"] += histogram["sum"]
+
+
+def _format_metrics(metrics):
+    lines = []
+
+    for name in sorted(metrics.keys()):
+        lines.append(f"# TYPE {name} histogram")
+
+        for labels, histogram in sorted(metrics[name].items()):
+            labels_str = ",".join(f'{k}="{v}"' for k, v in labels)
+
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                lines.append(f'{name}_bucket{{{labels_str},le="{bound}"}} {count}')
+
+            lines.append(
+                f'{name}_bucket{{{labels_str},le="+Inf"}} {histogram["count"]}'
+            )
+            lines.append(f"{name}_count{{{labels_str}}} {histogram['count']}")
+            lines.append(f"{name}_sum{{{labels_str}}} {histogram['sum']:.6f}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _get_metrics_dir():
+    return os.path.join(current_app.config["WMS_CACHE_DIR"], "metrics")
+
+
+def _save_metrics(force=False):
+    """Save the metrics of the current process, so they can be published by any
+    worker
+    """
+    global _metrics_saved_at
+
+    now = time.time()
+    if not (force) and (now - _metrics_saved_at < METRICS_SAVE_INTERVAL):
+        return
+
+    _metrics_saved_at = now
+
+    with _metrics_lock:
+        content = {
+            name: [[list(labels), histogram] for labels, histogram in series.items()]
+            for name, series in _metrics.items()
+        }
+        content = json.dumps(content)
+
+    folder = _get_metrics_dir()
+    os.makedirs(folder, exist_ok=True)
+
+    with NamedTemporaryFile("w", dir=folder, suffix=".tmp", delete=False) as f:
+        f.write(content)
+
+    try:
+        os.replace(f.name, os.path.join(folder, f"{os.getpid()}.json"))
+    except OSError as e:
+        print(e)
+        os.remove(f.name)
+
+
+def _load_all_metrics():
+    folder = _get_metrics_dir()
+
+    for filename in os.listdir(folder):
+        if not filename.endswith(".json"):
+            continue
+
+        filename = os.path.join(folder, filename)
+
+        try:
+            if os.path.getmtime(filename) + METRICS_EXPIRATION < time.time():
+                os.remove(filename)
+                continue
+
+            with open(filename, "r") as f:
+                yield json.load(f)
+        except (OSError, ValueError):
+            continue
+
+
+def _save_profile(profiler, duration):
+    folder = current_app.config["PROFILING_DIR"]
+    os.makedirs(folder, exist_ok=True)
+
+    endpoint = (request.endpoint or "unknown").replace("/", "_")
+    filename = os.path.join(
+        folder,
+        f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{int(duration * 1000)}ms"
+        f"-{os.getpid()}.prof",
+    )
+
+    try:
+        profiler.dump_stats(filename)
+    except OSError as e:
+        print(e)
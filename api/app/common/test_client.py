@@ -59,6 +59,37 @@ class TTLHashTest(BaseApiTest):
         self.assertNotEqual(hash1, hash2)
 
 
+class SessionTest(BaseApiTest):
+    def testSharedSession(self):
+        self.assertTrue(client.get_session() is client.get_session())
+
+    @patch("os.getpid")
+    def testNewSessionAfterFork(self, getpid_mock):
+        getpid_mock.return_value = 1
+        session = client.get_session()
+
+        getpid_mock.return_value = 2
+        self.assertFalse(client.get_session() is session)
+
+    @patch("requests.Session.get")
+    def testMetrics(self, get_mock):
+        with self.flask_app.app_context():
+            metrics = client.get_metrics().get(
+                "dataset_list", {"count": 0, "errors": 0}
+            )
+
+            get_mock.return_value = setupResponse(Response(json.dumps([])))
+            client.get_dataset_list(disable_filtering=True)
+
+            get_mock.side_effect = Exception()
+            client.get_dataset_list(disable_filtering=True)
+
+            new_metrics = client.get_metrics()["dataset_list"]
+            self.assertEqual(new_metrics["count"], metrics["count"] + 2)
+            self.assertEqual(new_metrics["errors"], metrics["errors"] + 1)
+            self.assertTrue(new_metrics["max_time"] >= 0)
+
+
 class DatasetListTest(BaseApiTest):
 
     DATASETS = [
@@ -76,7 +107,7 @@ class DatasetListTest(BaseApiTest):
         super().setUp()
         os.makedirs(os.path.join(self.wms_cache_dir, "rasters", "1"))
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testWithoutFiltering(self, get_mock):
         with self.flask_app.app_context():
             get_mock.return_value = setupResponse(
@@ -88,11 +119,12 @@ class DatasetListTest(BaseApiTest):
             self.assertEqual(len(get_mock.call_args.args), 1)
             self.assertEqual(get_mock.call_args.args[0], "dataset_list")
 
-            self.assertEqual(len(get_mock.call_args.kwargs), 0)
+            self.assertEqual(len(get_mock.call_args.kwargs), 1)
+            self.assertTrue("timeout" in get_mock.call_args.kwargs)
 
             self.assertEqual(datasets, DatasetListTest.DATASETS)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testWithFiltering(self, get_mock):
         with self.flask_app.app_context():
             get_mock.return_value = setupResponse(
@@ -104,12 +136,12 @@ class DatasetListTest(BaseApiTest):
             self.assertEqual(len(get_mock.call_args.args), 1)
             self.assertEqual(get_mock.call_args.args[0], "dataset_list")
 
-            self.assertEqual(len(get_mock.call_args.kwargs), 0)
+            self.assertEqual(len(get_mock.call_args.kwargs), 1)
 
             self.assertEqual(len(datasets), 1)
             self.assertEqual(datasets[0], DatasetListTest.DATASETS[0])
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testFailure(self, get_mock):
         with self.flask_app.app_context():
             get_mock.return_value = setupResponse(Response(None, 500))
@@ -117,7 +149,7 @@ class DatasetListTest(BaseApiTest):
             datasets = client.get_dataset_list()
             self.assertEqual(len(datasets), 0)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testException(self, get_mock):
         with self.flask_app.app_context():
             get_mock.side_effect = Exception()
@@ -146,7 +178,7 @@ class ParametersTest(BaseApiTest):
         "default_parameters": {},
     }
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testSuccess(self, get_mock):
         with self.flask_app.app_context():
             get_mock.return_value = setupResponse(
@@ -158,7 +190,7 @@ class ParametersTest(BaseApiTest):
             self.assertEqual(len(get_mock.call_args.args), 1)
             self.assertEqual(get_mock.call_args.args[0], "rpc/enermaps_get_parameters")
 
-            self.assertEqual(len(get_mock.call_args.kwargs), 2)
+            self.assertEqual(len(get_mock.call_args.kwargs), 3)
             self.assertTrue("headers" in get_mock.call_args.kwargs)
             self.assertTrue("params" in get_mock.call_args.kwargs)
             self.assertTrue("Authorization" in get_mock.call_args.kwargs["headers"])
@@ -167,7 +199,7 @@ class ParametersTest(BaseApiTest):
 
             self.assertEqual(parameters, datasets.convert(ParametersTest.PARAMETERS))
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testFailure(self, get_mock):
         with self.flask_app.app_context():
             get_mock.return_value = setupResponse(Response(None, 500))
@@ -175,7 +207,7 @@ class ParametersTest(BaseApiTest):
             parameters = client.get_parameters(1)
             self.assertTrue(parameters is None)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testException(self, get_mock):
         with self.flask_app.app_context():
             get_mock.side_effect = Exception()
@@ -199,7 +231,7 @@ class RasterFileTest(BaseApiTest):
 
     RASTER_CONTENT = b"this is a raster file"
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testSuccess(self, get_mock):
         with self.flask_app.app_context():
             get_mock.return_value = setupResponse(
@@ -211,13 +243,14 @@ class RasterFileTest(BaseApiTest):
             self.assertEqual(len(get_mock.call_args.args), 1)
             self.assertEqual(get_mock.call_args.args[0], "1/FID.tif")
 
-            self.assertEqual(len(get_mock.call_args.kwargs), 1)
+            self.assertEqual(len(get_mock.call_args.kwargs), 2)
             self.assertTrue("stream" in get_mock.call_args.kwargs)
             self.assertTrue(get_mock.call_args.kwargs["stream"])
+            self.assertTrue("timeout" in get_mock.call_args.kwargs)
 
             self.assertEqual(content, RasterFileTest.RASTER_CONTENT)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testFailure(self, get_mock):
         with self.flask_app.app_context():
             get_mock.return_value = setupResponse(Response(None, 500))
@@ -225,7 +258,7 @@ class RasterFileTest(BaseApiTest):
             content = client.get_raster_file(1, "FID.tif")
             self.assertTrue(content is None)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testException(self, get_mock):
         with self.flask_app.app_context():
             get_mock.side_effect = Exception()
@@ -234,6 +267,81 @@ class RasterFileTest(BaseApiTest):
             self.assertTrue(content is None)
 
 
+class StreamedResponse(Response):
+    def __init__(self, content, status_code=200, headers=None):
+        super().__init__(content, status_code=status_code)
+        self.headers = headers if headers is not None else {}
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
+
+
+class DownloadRasterFileTest(BaseApiTest):
+
+    RASTER_CONTENT = b"this is a raster file"
+
+    def setUp(self):
+        super().setUp()
+        self.filename = os.path.join(self.wms_cache_dir, "FID.tif")
+
+    def testSuccess(self):
+        with self.flask_app.app_context():
+            session = Mock()
+            session.get.return_value = setupResponse(
+                StreamedResponse(
+                    DownloadRasterFileTest.RASTER_CONTENT,
+                    headers={"ETag": '"1234"', "Last-Modified": "yesterday"},
+                )
+            )
+
+            modified, validators = client.download_raster_file(
+                session, 1, "FID.tif", self.filename
+            )
+
+            self.assertEqual(session.get.call_args.args[0], "1/FID.tif")
+            self.assertTrue(session.get.call_args.kwargs["stream"])
+            self.assertEqual(session.get.call_args.kwargs["headers"], {})
+            self.assertEqual(
+                session.get.call_args.kwargs["timeout"], client.DATASETS_SERVER_TIMEOUT
+            )
+
+            self.assertTrue(modified)
+            self.assertEqual(
+                validators, {"etag": '"1234"', "last_modified": "yesterday"}
+            )
+
+            with open(self.filename, "rb") as f:
+                self.assertEqual(f.read(), DownloadRasterFileTest.RASTER_CONTENT)
+
+    def testNotModified(self):
+        with self.flask_app.app_context():
+            session = Mock()
+            session.get.return_value = setupResponse(StreamedResponse(b"", 304))
+
+            validators = {"etag": '"1234"', "last_modified": "yesterday"}
+
+            modified, new_validators = client.download_raster_file(
+                session, 1, "FID.tif", self.filename, validators=validators
+            )
+
+            headers = session.get.call_args.kwargs["headers"]
+            self.assertEqual(headers["If-None-Match"], '"1234"')
+            self.assertEqual(headers["If-Modified-Since"], "yesterday")
+
+            self.assertFalse(modified)
+            self.assertEqual(new_validators, validators)
+            self.assertFalse(os.path.exists(self.filename))
+
+    def testFailure(self):
+        with self.flask_app.app_context():
+            session = Mock()
+            session.get.return_value = setupResponse(StreamedResponse(b"", 500))
+
+            with self.assertRaises(Exception):
+                client.download_raster_file(session, 1, "FID.tif", self.filename)
+
+
 class GeoJSONTest(BaseApiTest):
 
     GEOJSON = {
@@ -504,7 +612,7 @@ class GeoJSONTest(BaseApiTest):
         self.assertEqual(len(get_mock.call_args.args), 1)
         self.assertEqual(get_mock.call_args.args[0], "rpc/enermaps_query_geojson")
 
-        self.assertEqual(len(get_mock.call_args.kwargs), 2)
+        self.assertEqual(len(get_mock.call_args.kwargs), 3)
 
         self.assertTrue("headers" in get_mock.call_args.kwargs)
         self.assertTrue("Authorization" in get_mock.call_args.kwargs["headers"])
@@ -518,7 +626,7 @@ class GeoJSONTest(BaseApiTest):
 
         return json.loads(get_mock.call_args.kwargs["params"]["parameters"])
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS)),
@@ -545,7 +653,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_VARIABLE)),
@@ -574,7 +682,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_VARIABLE)),
@@ -603,7 +711,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_VARIABLE2)),
@@ -632,7 +740,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_TIME_PERIOD)),
@@ -661,7 +769,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_TIME_PERIOD_WITH_MONTH)),
@@ -692,7 +800,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_NONE_TIME_PERIOD)),
@@ -721,7 +829,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_MONTH_TIME_PERIOD)),
@@ -750,7 +858,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_TIME_PERIOD)),
@@ -779,7 +887,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_TIME_PERIOD2)),
@@ -808,7 +916,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_FIELDS)),
@@ -840,7 +948,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_EMPTY_FIELDS)),
@@ -867,7 +975,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_LEVEL)),
@@ -896,7 +1004,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_INTERSECTING)),
@@ -930,7 +1038,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_INTERSECTING)),
@@ -957,7 +1065,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(geojson, GeoJSONTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS)),
@@ -983,7 +1091,7 @@ class GeoJSONTest(BaseApiTest):
             self.assertEqual(len(get_mock.call_args.args), 1)
             self.assertEqual(get_mock.call_args.args[0], "rpc/enermaps_query_geojson")
 
-            self.assertEqual(len(get_mock.call_args.kwargs), 2)
+            self.assertEqual(len(get_mock.call_args.kwargs), 3)
 
             self.assertTrue("headers" in get_mock.call_args.kwargs)
             self.assertTrue("Authorization" in get_mock.call_args.kwargs["headers"])
@@ -1010,7 +1118,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertEqual(len(geojson["features"]), 1001)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS)),
@@ -1024,7 +1132,7 @@ class GeoJSONTest(BaseApiTest):
 
             self.assertTrue(geojson is None)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS)),
@@ -1039,6 +1147,78 @@ class GeoJSONTest(BaseApiTest):
             self.assertTrue(geojson is None)
 
 
+class GeoJSONFeaturesTest(BaseApiTest):
+
+    PARAMETERS = GeoJSONTest.PARAMETERS
+
+    @staticmethod
+    def makePages(nb_features, row_limit):
+        """Return a function replacing requests.Session.get, returning the pages of
+        a layer containing the given number of features
+        """
+
+        def _get(url, **kwargs):
+            row_offset = kwargs["params"]["row_offset"]
+            ids = range(row_offset, min(row_offset + row_limit, nb_features))
+            features = [{"id": id} for id in ids]
+
+            return setupResponse(
+                Response(
+                    json.dumps(
+                        {
+                            "type": "FeatureCollection",
+                            "features": features if len(features) > 0 else None,
+                        }
+                    )
+                )
+            )
+
+        return _get
+
+    @patch("requests.Session.get")
+    @patch(
+        "app.common.client.get_parameters",
+        new=Mock(return_value=datasets.convert(PARAMETERS)),
+    )
+    def testOrderedFeatures(self, get_mock):
+        with self.flask_app.app_context():
+            get_mock.side_effect = GeoJSONFeaturesTest.makePages(25, 10)
+
+            layer_name = path.make_unique_layer_name(path.VECTOR, 1)
+            features = client.iter_geojson_features(layer_name, row_limit=10, jobs=4)
+
+            self.assertEqual([x["id"] for x in features], list(range(25)))
+
+    @patch("requests.Session.get")
+    @patch(
+        "app.common.client.get_parameters",
+        new=Mock(return_value=datasets.convert(PARAMETERS)),
+    )
+    def testFullLastPage(self, get_mock):
+        with self.flask_app.app_context():
+            get_mock.side_effect = GeoJSONFeaturesTest.makePages(20, 10)
+
+            layer_name = path.make_unique_layer_name(path.VECTOR, 1)
+            features = client.iter_geojson_features(layer_name, row_limit=10, jobs=2)
+
+            self.assertEqual([x["id"] for x in features], list(range(20)))
+
+    @patch("requests.Session.get")
+    @patch(
+        "app.common.client.get_parameters",
+        new=Mock(return_value=datasets.convert(PARAMETERS)),
+    )
+    def testFailure(self, get_mock):
+        with self.flask_app.app_context():
+            get_mock.return_value = setupResponse(Response(None, 500))
+
+            layer_name = path.make_unique_layer_name(path.VECTOR, 1)
+            features = client.iter_geojson_features(layer_name, jobs=2)
+
+            with self.assertRaises(Exception):
+                list(features)
+
+
 class AeraTest(BaseApiTest):
 
     GEOJSON = {
@@ -1068,7 +1248,7 @@ class AeraTest(BaseApiTest):
         ],
     }
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testSuccess(self, get_mock):
         with self.flask_app.app_context():
             get_mock.return_value = setupResponse(
@@ -1082,7 +1262,7 @@ class AeraTest(BaseApiTest):
             self.assertEqual(len(get_mock.call_args.args), 1)
             self.assertEqual(get_mock.call_args.args[0], "rpc/enermaps_query_geojson")
 
-            self.assertEqual(len(get_mock.call_args.kwargs), 2)
+            self.assertEqual(len(get_mock.call_args.kwargs), 3)
 
             self.assertTrue("headers" in get_mock.call_args.kwargs)
             self.assertTrue("Authorization" in get_mock.call_args.kwargs["headers"])
@@ -1111,7 +1291,7 @@ class AeraTest(BaseApiTest):
 
             self.assertEqual(geojson, AeraTest.GEOJSON)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testFailure(self, get_mock):
         with self.flask_app.app_context():
             get_mock.return_value = setupResponse(Response(None, 500))
@@ -1119,7 +1299,7 @@ class AeraTest(BaseApiTest):
             geojson = client.get_area("NUTS1")
             self.assertTrue(geojson is None)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def testException(self, get_mock):
         with self.flask_app.app_context():
             get_mock.side_effect = Exception()
@@ -1153,7 +1333,7 @@ class LegendTest(BaseApiTest):
         },
     }
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_INTERSECTING)),
@@ -1197,7 +1377,7 @@ class LegendTest(BaseApiTest):
 
             self.assertEqual(legend, LegendTest.LEGEND)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_INTERSECTING)),
@@ -1227,7 +1407,7 @@ class LegendTest(BaseApiTest):
             self.assertEqual(get_mock.call_count, 2)
             self.assertEqual(legend3, LegendTest.LEGEND2)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_INTERSECTING)),
@@ -1240,7 +1420,7 @@ class LegendTest(BaseApiTest):
             legend = client.get_legend(layer_name, ttl_hash=900)
             self.assertTrue(legend is None)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS_DEFAULT_INTERSECTING)),
@@ -1289,7 +1469,7 @@ class RastersTest(BaseApiTest):
         },
     ]
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS)),
@@ -1307,7 +1487,7 @@ class RastersTest(BaseApiTest):
             self.assertEqual(len(get_mock.call_args.args), 1)
             self.assertEqual(get_mock.call_args.args[0], "rpc/enermaps_get_rasters")
 
-            self.assertEqual(len(get_mock.call_args.kwargs), 2)
+            self.assertEqual(len(get_mock.call_args.kwargs), 3)
 
             self.assertTrue("headers" in get_mock.call_args.kwargs)
             self.assertTrue("Authorization" in get_mock.call_args.kwargs["headers"])
@@ -1330,7 +1510,7 @@ class RastersTest(BaseApiTest):
 
             self.assertEqual(rasters, RastersTest.RASTERS)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS)),
@@ -1342,7 +1522,7 @@ class RastersTest(BaseApiTest):
             rasters = client.get_rasters("raster/42")
             self.assertTrue(rasters is None)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     @patch(
         "app.common.client.get_parameters",
         new=Mock(return_value=datasets.convert(PARAMETERS)),
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+
+from app.common import instrumentation
+from app.common.test import BaseApiTest
+
+
+class InstrumentationDisabledTest(BaseApiTest):
+    def testNoHeader(self):
+        response = self.client.get("/healthz")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("Server-Timing" not in response.headers)
+
+    def testNoMetrics(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 404)
+
+
+class InstrumentationTest(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+
+        self.profiling_dir = tempfile.mkdtemp()
+
+        instrumentation._metrics.clear()
+
+        self.flask_app.config["INSTRUMENTATION"] = "1"
+        self.flask_app.config["PROFILING_DIR"] = self.profiling_dir
+        instrumentation.init_app(self.flask_app)
+
+        @self.flask_app.route("/instrumented")
+        def instrumented():
+            with instrumentation.span("step1"):
+                pass
+
+            with instrumentation.span("step2"):
+                pass
+
+            with instrumentation.span("step2"):
+                pass
+
+            return "OK"
+
+        @self.flask_app.route("/failing")
+        def failing():
+            raise RuntimeError("failure")
+
+    def tearDown(self):
+        shutil.rmtree(self.profiling_dir)
+        super().tearDown()
+
+    def testServerTiming(self):
+        response = self.client.get("/instrumented")
+        self.assertEqual(response.status_code, 200)
+
+        timings = [x.strip() for x in response.headers["Server-Timing"].split(",")]
+        self.assertEqual(len(timings), 3)
+        self.assertTrue(timings[0].startswith("step1;dur="))
+        self.assertTrue(timings[0].endswith('desc="1x"'))
+        self.assertTrue(timings[1].startswith("step2;dur="))
+        self.assertTrue(timings[1].endswith('desc="2x"'))
+        self.assertTrue(timings[2].startswith("total;dur="))
+
+    def testSpanOutsideRequest(self):
+        with self.flask_app.app_context():
+            with instrumentation.span("step"):
+                pass
+
+    def testMetrics(self):
+        self.client.get("/instrumented")
+        self.client.get("/instrumented")
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+
+        lines = response.data.decode().split("\n")
+        self.assertTrue(
+            'enermaps_request_seconds_count{endpoint="instrumented",status="200"} 2'
+            in lines
+        )
+        self.assertTrue('enermaps_span_seconds_count{span="step2"} 4' in lines)
+        self.assertTrue(
+            'enermaps_span_seconds_bucket{span="step1",le="+Inf"} 2' in lines
+        )
+
+    def testProfiling(self):
+        self.flask_app.config["PROFILING_SAMPLE_RATE"] = 1.0
+        self.flask_app.config["PROFILING_THRESHOLD"] = 0.0
+
+        self.client.get("/instrumented")
+
+        filenames = os.listdir(self.profiling_dir)
+        self.assertEqual(len(filenames), 1)
+        self.assertTrue(filenames[0].endswith(".prof"))
+
+    def testProfilingBelowThreshold(self):
+        self.flask_app.config["PROFILING_SAMPLE_RATE"] = 1.0
+        self.flask_app.config["PROFILING_THRESHOLD"] = 60.0
+
+        self.client.get("/instrumented")
+
+        self.assertEqual(os.listdir(self.profiling_dir), [])
+
+    def testProfilingFailedRequest(self):
+        self.flask_app.config["PROFILING_SAMPLE_RATE"] = 1.0
+        self.flask_app.config["PROFILING_THRESHOLD"] = 0.0
+
+        with self.assertRaises(RuntimeError):
+            self.client.get("/failing")
+
+        self.assertEqual(len(os.listdir(self.profiling_dir)), 1)
+
+        # The profiler of the failed request must have been disabled
+        self.client.get("/instrumented")
+
+        self.assertEqual(len(os.listdir(self.profiling_dir)), 2)
@@ -7,7 +7,15 @@ import os
 import re
 import unicodedata
 
-from flask import Response, abort, redirect, request, send_file, url_for
+from flask import (
+    Response,
+    abort,
+    redirect,
+    request,
+    send_file,
+    stream_with_context,
+    url_for,
+)
 from flask_restx import Namespace, Resource
 from werkzeug.datastructures import FileStorage
 
@@ -131,14 +139,28 @@ class CMTaskDownload(Resource):
         layer_name = path.make_unique_layer_name(path.CM, cm_name, task_id=task_id)
         storage_instance = storage.create_for_layer_type(path.CM)
 
-        content = storage_instance.as_zip(layer_name)
-        if content is None:
+        filenames = storage_instance.list_files(layer_name)
+        if len(filenames) == 0:
             abort(404)
 
-        return send_file(
-            content,
-            attachment_filename=f"{cm_name}_{task_id}.zip",
+        attachment_filename = f"{cm_name}_{task_id}.zip"
+
+        zip_file = storage_instance.get_cached_zip_file(layer_name, filenames)
+        if zip_file is not None:
+            return send_file(
+                zip_file,
+                as_attachment=True,
+                attachment_filename=attachment_filename,
+                mimetype="application/zip",
+                conditional=True,
+            )
+
+        return Response(
+            stream_with_context(storage_instance.iter_zip(layer_name, filenames)),
             mimetype="application/zip",
+            headers={
+                "Content-Disposition": f"attachment; filename={attachment_filename}"
+            },
         )
 
     def head(self, cm_name, task_id):
@@ -146,12 +168,7 @@ class CMTaskDownload(Resource):
         layer_name = path.make_unique_layer_name(path.CM, cm_name, task_id=task_id)
         storage_instance = storage.create_for_layer_type(path.CM)
 
-        cm_dir = storage_instance.get_dir(layer_name)
-
-        if not os.path.exists(cm_dir):
-            abort(404)
-
-        filenames = os.listdir(cm_dir)
+        filenames = storage_instance.list_files(layer_name)
         if len(filenames) == 0:
             abort(404)
 
@@ -2,13 +2,19 @@
 """
 
 import hashlib
+import json
+import zlib
 
-from flask import Response
+from flask import Response, request, send_file
 from flask_restx import Namespace, Resource, abort
 
 from app.common import client
 from app.common import datasets as datasets_fcts
 from app.common import path
+from app.models import geofile
+
+# Minimal size of the chunks of the streamed GeoJSON files
+GEOJSON_CHUNK_SIZE = 64 * 1024
 
 api = Namespace("datasets", description="Datasets related endpoints")
 
@@ -127,11 +133,43 @@ class Legend(Resource):
 class GeoJSON(Resource):
     def get(self, layer_name):
         """Return the GeoJSON file corresponding to the layer"""
-        geojson = client.get_geojson(layer_name, ignore_intersecting=True)
-        if geojson is None:
+        compress = "gzip" in request.accept_encodings
+
+        # Send the response from the cache if possible
+        filename = geofile.get_cached_geojson_response(layer_name, compressed=compress)
+        if filename is not None:
+            response = send_file(
+                filename, mimetype="application/geo+json", conditional=True
+            )
+
+            if filename.endswith(".gz"):
+                response.headers["Content-Encoding"] = "gzip"
+
+            response.vary.add("Accept-Encoding")
+            return response
+
+        # Otherwise, stream the features while they are retrieved from the server
+        # (the response is cached if the layer is)
+        try:
+            features = client.iter_geojson_features(
+                layer_name, ignore_intersecting=True
+            )
+            first_feature = next(features)
+        except Exception:
             abort(404)
 
-        return geojson
+        response = Response(
+            stream_feature_collection(
+                first_feature, features, compress, cached_layer_name=layer_name
+            ),
+            mimetype="application/geo+json",
+        )
+
+        if compress:
+            response.headers["Content-Encoding"] = "gzip"
+
+        response.vary.add("Accept-Encoding")
+        return response
 
 
 @api.route("/areas/")
@@ -145,6 +183,57 @@ class Areas(Resource):
         return areas
 
 
+def stream_feature_collection(
+    first_feature, features, compress=False, cached_layer_name=None
+):
+    """Generate the content of a GeoJSON file containing the features, by chunks
+    (optionally compressed with gzip).
+
+    If cached_layer_name is given, the content is also saved as the cached
+    response of that layer (see geofile.cache_geojson_response()).
+    """
+    chunks = iter_feature_collection(first_feature, features, compress)
+    if cached_layer_name is not None:
+        chunks = geofile.cache_geojson_response(
+            cached_layer_name, chunks, compressed=compress
+        )
+
+    try:
+        yield from chunks
+    except Exception:
+        # The response is already partially sent, all we can do is to stop here
+        # (the error was logged by the client)
+        return
+
+
+def iter_feature_collection(first_feature, features, compress=False):
+    """Generate the content of a GeoJSON file containing the features, by chunks
+    (optionally compressed with gzip). Raise an exception if the features can't
+    be retrieved.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def _encode(chunk):
+        data = chunk.encode()
+        if compressor is not None:
+            data = compressor.compress(data)
+        return data
+
+    chunk = '{"type": "FeatureCollection", "features": [' + json.dumps(first_feature)
+
+    for feature in features:
+        chunk += ", " + json.dumps(feature)
+
+        if len(chunk) >= GEOJSON_CHUNK_SIZE:
+            yield _encode(chunk)
+            chunk = ""
+
+    yield _encode(chunk + "]}")
+
+    if compressor is not None:
+        yield compressor.flush()
+
+
 def add_openaire_links(datasets):
     for dataset in datasets:
         shared_id = dataset.get("shared_id")
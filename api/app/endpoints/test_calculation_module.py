@@ -420,6 +420,27 @@ class CMTaskDownloadTest(BaseApiTest):
                     with open(raster_filename, "rb") as f2:
                         self.assertEqual(f.read(), f2.read())
 
+    def testDownloadFromCache(self):
+        with self.flask_app.app_context():
+            self.setupFiles()
+
+            response = self.client.get(
+                "api/cm/mock_cm/task/01234567-0000-0000-0000-000000000000/download/"
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue("ETag" not in response.headers)
+
+            content = response.data
+
+            response = self.client.get(
+                "api/cm/mock_cm/task/01234567-0000-0000-0000-000000000000/download/"
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "application/zip")
+            self.assertTrue("ETag" in response.headers)
+            self.assertEqual(response.data, content)
+            response.close()
+
     def testDownloadFromUnknownTask(self):
         response = self.client.get(
             "api/cm/mock_cm/task/01234567-0000-0000-0000-000000000000/download/"
@@ -1,7 +1,11 @@
+import gzip
+import json
+import os
 from unittest.mock import Mock, patch
 
 from app.common import path
 from app.common.test import BaseApiTest
+from app.models import storage
 
 ENCODED_VAR = "var%20name"
 
@@ -320,13 +324,14 @@ class GeoJSONTest(BaseApiTest):
     GEOJSON = {
         "type": "FeatureCollection",
         "features": [
-            {"id": "FID1", "type": "Feature", "geometry": None, "properties": {}}
+            {"id": "FID1", "type": "Feature", "geometry": None, "properties": {}},
+            {"id": "FID2", "type": "Feature", "geometry": None, "properties": {}},
         ],
     }
 
     @patch(
-        "app.common.client.get_geojson",
-        new=Mock(return_value=GEOJSON),
+        "app.common.client.iter_geojson_features",
+        new=Mock(side_effect=lambda *args, f=GEOJSON["features"], **kwargs: iter(f)),
     )
     def testSuccess(self):
         response = self.client.get("api/datasets/geojson/vector%2F42/")
@@ -334,9 +339,162 @@ class GeoJSONTest(BaseApiTest):
         self.assertEqual(response.json, GeoJSONTest.GEOJSON)
 
     @patch(
-        "app.common.client.get_geojson",
-        new=Mock(return_value=None),
+        "app.common.client.iter_geojson_features",
+        new=Mock(side_effect=lambda *args, f=GEOJSON["features"], **kwargs: iter(f)),
+    )
+    def testCompressed(self):
+        response = self.client.get(
+            "api/datasets/geojson/vector%2F42/",
+            headers={"Accept-Encoding": "gzip"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(
+            json.loads(gzip.decompress(response.data)), GeoJSONTest.GEOJSON
+        )
+
+    @patch(
+        "app.common.client.iter_geojson_features",
+        new=Mock(side_effect=lambda *args, **kwargs: iter([])),
+    )
+    def testNoFeature(self):
+        response = self.client.get("api/datasets/geojson/vector%2F42/")
+        self.assertEqual(response.status_code, 404)
+
+    @patch(
+        "app.common.client.iter_geojson_features",
+        new=Mock(side_effect=Exception()),
     )
     def testFailure(self):
         response = self.client.get("api/datasets/geojson/vector%2F42/")
         self.assertEqual(response.status_code, 404)
+
+    FEATURES = [
+        {
+            "id": "FID1",
+            "type": "Feature",
+            "geometry": None,
+            "properties": {
+                "variables": {"var": 1.0, "other": 2.0},
+                "legend": {"symbology": []},
+            },
+        },
+        {"id": "FID2", "type": "Feature", "geometry": None, "properties": {}},
+    ]
+
+    def createLayerFolder(self, layer_name):
+        with self.flask_app.app_context():
+            storage_instance = storage.create(layer_name)
+            os.makedirs(storage_instance.get_dir(layer_name))
+
+    @patch("app.common.client.iter_geojson_features")
+    def testFromCache(self, iter_mock):
+        iter_mock.side_effect = lambda *args, **kwargs: iter(GeoJSONTest.FEATURES)
+
+        self.createLayerFolder("vector/42")
+
+        # The response is streamed from the server, then cached
+        response = self.client.get("api/datasets/geojson/vector%2F42/")
+        self.assertEqual(response.status_code, 200)
+        streamed_data = response.data
+        response.close()
+
+        self.assertEqual(iter_mock.call_count, 1)
+
+        # The cached response is the same as the streamed one
+        response = self.client.get("api/datasets/geojson/vector%2F42/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, streamed_data)
+        self.assertEqual(json.loads(response.data)["features"], GeoJSONTest.FEATURES)
+
+        etag = response.headers["ETag"]
+        response.close()
+
+        response = self.client.get(
+            "api/datasets/geojson/vector%2F42/", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        response.close()
+
+        self.assertEqual(iter_mock.call_count, 1)
+
+    @patch("app.common.client.iter_geojson_features")
+    def testCompressedFromCache(self, iter_mock):
+        iter_mock.side_effect = lambda *args, **kwargs: iter(GeoJSONTest.FEATURES)
+
+        self.createLayerFolder("vector/42")
+
+        response = self.client.get(
+            "api/datasets/geojson/vector%2F42/",
+            headers={"Accept-Encoding": "gzip"},
+        )
+        self.assertEqual(response.status_code, 200)
+        streamed_data = response.data
+        response.close()
+
+        response = self.client.get(
+            "api/datasets/geojson/vector%2F42/",
+            headers={"Accept-Encoding": "gzip"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.data, streamed_data)
+        self.assertEqual(
+            json.loads(gzip.decompress(response.data))["features"],
+            GeoJSONTest.FEATURES,
+        )
+        response.close()
+
+        self.assertEqual(iter_mock.call_count, 1)
+
+    @patch("app.common.client.iter_geojson_features")
+    def testVariableFromCache(self, iter_mock):
+        iter_mock.side_effect = lambda *args, **kwargs: iter(GeoJSONTest.FEATURES)
+
+        self.createLayerFolder("vector/42")
+
+        layer_name = path.make_unique_layer_name(path.VECTOR, 42, variable="var")
+        other_layer_name = path.make_unique_layer_name(
+            path.VECTOR, 42, variable="other"
+        )
+
+        for name in (layer_name, layer_name, other_layer_name):
+            response = self.client.get(
+                f"api/datasets/geojson/{name.replace('/', '%2F')}/"
+            )
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+        # Each variable has its own cached response
+        self.assertEqual(iter_mock.call_count, 2)
+
+    @patch("app.common.client.iter_geojson_features")
+    def testNotCachedLayer(self, iter_mock):
+        iter_mock.side_effect = lambda *args, **kwargs: iter(GeoJSONTest.FEATURES)
+
+        for _ in range(2):
+            response = self.client.get("api/datasets/geojson/vector%2F42/")
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+        self.assertEqual(iter_mock.call_count, 2)
+
+    @patch("app.common.client.iter_geojson_features")
+    def testFailureNotCached(self, iter_mock):
+        def _iter_features(*args, **kwargs):
+            yield GeoJSONTest.FEATURES[0]
+            raise Exception()
+
+        iter_mock.side_effect = _iter_features
+
+        self.createLayerFolder("vector/42")
+
+        response = self.client.get("api/datasets/geojson/vector%2F42/")
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+        with self.flask_app.app_context():
+            storage_instance = storage.create("vector/42")
+            self.assertFalse(
+                os.path.exists(storage_instance.get_geojson_response_file("vector/42"))
+            )
@@ -14,6 +14,7 @@ from app.common import datasets, path
 from app.common.projection import epsg_to_proj4
 from app.common.test import BaseApiTest, BaseIntegrationTest
 from app.models import storage
+from app.models.wms import capabilities
 
 GETCAPABILITIES_ARGS = {"service": "WMS", "request": "GetCapabilities"}
 WMS_VERSION = "1.3.0"
@@ -133,6 +134,106 @@ class WMSGetCapabilitiesTest(BaseApiTest):
         self.assertEqual(len(layer_names), 0, "Found a layer, expected none")
         self._validate_xml(root)
 
+    @patch(
+        "app.common.client.get_dataset_list",
+        new=Mock(return_value=DATASETS),
+    )
+    @patch(
+        "app.common.client.get_parameters",
+        new=Mock(return_value=datasets.convert(PARAMETERS)),
+    )
+    def testConditionalRequest(self):
+        """Test that the document isn't sent again when the client already has
+        the current version
+        """
+        response = self.client.get("api/wms", query_string=GETCAPABILITIES_ARGS)
+        self.assertStatusCodeEqual(response, 200)
+
+        etag = response.headers.get("ETag")
+        self.assertTrue(etag is not None)
+
+        response = self.client.get(
+            "api/wms",
+            query_string=GETCAPABILITIES_ARGS,
+            headers={"If-None-Match": etag},
+        )
+        self.assertStatusCodeEqual(response, 304)
+        self.assertEqual(len(response.data), 0)
+
+    @patch(
+        "app.common.client.get_parameters",
+        new=Mock(return_value=datasets.convert(PARAMETERS)),
+    )
+    def testRefresh(self):
+        """Test that the document is only regenerated when refreshed"""
+        self.flask_app.config["WMS_BASE_URL"] = "https://example.org/api/wms"
+
+        with patch(
+            "app.common.client.get_dataset_list", new=Mock(return_value=[])
+        ) as get_dataset_list:
+            response = self.client.get("api/wms", query_string=GETCAPABILITIES_ARGS)
+            self.assertStatusCodeEqual(response, 404)
+
+            get_dataset_list.return_value = self.DATASETS
+            response = self.client.get("api/wms", query_string=GETCAPABILITIES_ARGS)
+            self.assertStatusCodeEqual(response, 200)
+
+            etag = response.headers.get("ETag")
+
+            get_dataset_list.return_value = self.DATASETS[:1]
+            response = self.client.get("api/wms", query_string=GETCAPABILITIES_ARGS)
+            self.assertEqual(response.headers.get("ETag"), etag)
+
+            with self.flask_app.app_context():
+                capabilities.refresh()
+
+            response = self.client.get("api/wms", query_string=GETCAPABILITIES_ARGS)
+            self.assertNotEqual(response.headers.get("ETag"), etag)
+
+    @patch(
+        "app.common.client.get_dataset_list",
+        new=Mock(return_value=DATASETS),
+    )
+    @patch(
+        "app.common.client.get_parameters",
+        new=Mock(return_value=datasets.convert(PARAMETERS)),
+    )
+    def testCanonicalURL(self):
+        """Test that only the document of the configured URL is cached, whatever
+        the host of the requests
+        """
+        self.flask_app.config["WMS_BASE_URL"] = "https://example.org/api/wms"
+
+        for host in ("example.org", "host1.test", "host2.test"):
+            response = self.client.get(
+                "api/wms", query_string=GETCAPABILITIES_ARGS, headers={"Host": host}
+            )
+            self.assertStatusCodeEqual(response, 200)
+            self.assertIn(b'xlink:href="https://example.org/api/wms"', response.data)
+            self.assertNotIn(b".test", response.data)
+
+        with self.flask_app.app_context():
+            self.assertEqual(len(os.listdir(capabilities.get_capabilities_dir())), 1)
+
+    @patch(
+        "app.common.client.get_dataset_list",
+        new=Mock(return_value=DATASETS),
+    )
+    @patch(
+        "app.common.client.get_parameters",
+        new=Mock(return_value=datasets.convert(PARAMETERS)),
+    )
+    def testNotCachedWithoutCanonicalURL(self):
+        """Test that the document isn't cached if the URL isn't configured"""
+        response = self.client.get(
+            "api/wms", query_string=GETCAPABILITIES_ARGS, headers={"Host": "host.test"}
+        )
+        self.assertStatusCodeEqual(response, 200)
+        self.assertIn(b'xlink:href="http://host.test/api/wms"', response.data)
+
+        with self.flask_app.app_context():
+            self.assertFalse(os.path.exists(capabilities.get_capabilities_dir()))
+
     def _validate_xml_string(self, xml_string):
         """Validate a xml schema saved as string based on the xml validator."""
         root = etree.fromstring(xml_string)  # nosec
@@ -251,6 +352,65 @@ class WMSGetMapTest(BaseApiTest):
         self.assertEqual(image.size, self.TILE_SIZE)
         self.assertEqual(image.format, "PNG")
 
+    @patch(
+        "app.common.client.get_legend",
+        new=Mock(return_value=None),
+    )
+    def testMultiLayersTileWorkflow(self):
+        """Retrieve a raster layer and a vector layer in the same image from the WMS
+        endpoint, with and without the tiles of the individual layers in the cache
+        """
+        raster_layer = path.make_unique_layer_name(path.RASTER, 42, "heat")
+        vector_layer = path.make_unique_layer_name(path.AREA, "example")
+
+        args = dict(self.TILE_PARAMETERS)
+        args["layers"] = f"{raster_layer},{vector_layer}"
+
+        self.flask_app.config["WMS"]["GETMAP"]["CACHE"] = False
+
+        response = self.client.get("api/wms", query_string=args)
+        self.assertStatusCodeEqual(response, 200)
+
+        image = Image.open(io.BytesIO(response.data))
+        self.assertEqual(image.size, self.TILE_SIZE)
+        self.assertEqual(image.format, "PNG")
+
+        self.flask_app.config["WMS"]["GETMAP"]["CACHE"] = True
+
+        # Render each layer alone, so they are put in the tile cache
+        for layer_name in (raster_layer, vector_layer):
+            response = self.client.get(
+                "api/wms", query_string=dict(self.TILE_PARAMETERS, layers=layer_name)
+            )
+            self.assertStatusCodeEqual(response, 200)
+
+        with patch(
+            "app.models.wms.map.add_layer_to_image",
+            new=Mock(side_effect=Exception("Layer rendered")),
+        ):
+            response = self.client.get("api/wms", query_string=args)
+            self.assertStatusCodeEqual(response, 200)
+
+        image = Image.open(io.BytesIO(response.data))
+        self.assertEqual(image.size, self.TILE_SIZE)
+        self.assertEqual(image.format, "PNG")
+
+    @patch(
+        "app.common.client.get_legend",
+        new=Mock(return_value=None),
+    )
+    def testMultiLayersTileWorkflowUnknownLayers(self):
+        args = dict(self.TILE_PARAMETERS)
+        args["layers"] = ",".join(
+            [
+                path.make_unique_layer_name(path.RASTER, 42, "unknown"),
+                path.make_unique_layer_name(path.AREA, "unknown"),
+            ]
+        )
+
+        response = self.client.get("api/wms", query_string=args)
+        self.assertStatusCodeEqual(response, 404)
+
     @patch(
         "app.common.client.get_legend",
         new=Mock(return_value=None),
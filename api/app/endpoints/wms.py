@@ -11,15 +11,14 @@ The three operations defined for a WMS are :
 For more information about the WMS, see https://portal.ogc.org/files/?artifact_id=14416.
 """
 
-import json
-
 from flask import Response, abort, request
 from flask_restx import Namespace, Resource
 
-from app.common import path
+from app.common import instrumentation, path
+from app.models import geofile, tiles
 from app.models.wms import utils
-from app.models.wms.capabilities import get_capabilities
-from app.models.wms.map import get_map_image, get_mapnik_map_for_feature_info
+from app.models.wms.capabilities import get_cached_capabilities
+from app.models.wms.map import get_map_image
 
 api = Namespace("wms", "WMS compatible endpoint")
 
@@ -52,20 +51,31 @@ class WMS(Resource):
         )
 
     def get_capabilities(self, _):
-        capabilities = get_capabilities()
+        capabilities, etag = get_cached_capabilities(request.base_url)
         if capabilities is None:
             abort(404)
 
-        return Response(capabilities, mimetype="text/xml")
+        response = Response(capabilities, mimetype="text/xml")
+        response.set_etag(etag)
+
+        return response.make_conditional(request)
 
     def get_map(self, normalized_args):
         """Return the map."""
-        image = get_map_image(normalized_args)
-        if image is None:
-            abort(404)
-
         mapnik_format, mime_format = utils.parse_format(normalized_args)
-        return Response(image.tostring(mapnik_format), mimetype=mime_format)
+
+        with instrumentation.span("tiles.get"):
+            content = tiles.get(normalized_args)
+        if content is None:
+            image = get_map_image(normalized_args)
+            if image is None:
+                abort(404)
+
+            with instrumentation.span("image.encode"):
+                content = image.tostring(mapnik_format)
+            tiles.save(normalized_args, content)
+
+        return Response(content, mimetype=mime_format)
 
     def get_feature_info(self, normalized_args):
         """Implement the GetFeatureInfo entrypoint for the WMS endpoint"""
@@ -74,37 +84,36 @@ class WMS(Resource):
         if normalized_args["info_format"] != "application/json":
             abort(400, "this endpoint doesn't support non json return value")
 
-        mp = get_mapnik_map_for_feature_info(normalized_args)
-        if mp is None:
-            abort(404)
+        layers = utils.parse_layers(normalized_args)
 
-        mp.zoom_to_box(utils.parse_envelope(normalized_args))
+        # Only authorized for vector and area layers
+        for layer_name in layers:
+            if path.get_type(layer_name) not in (path.VECTOR, path.AREA):
+                abort(404)
 
         raw_query_layers = normalized_args.get("query_layers", "")
         query_layers = utils.parse_list(raw_query_layers)
-        if set(query_layers) != {layer.name for layer in mp.layers}:
+        if set(query_layers) != set(layers):
             abort(400, "Requested layer didnt match the query_layers parameter")
 
-        features = {"features": []}
-        for layerindex, mapnick_layer in enumerate(mp.layers):
-            mapnick_layer.queryable = True
+        box = utils.parse_position_box(normalized_args)
+        projection = utils.parse_projection(normalized_args)
 
-            (type, _, variable, _, _) = path.parse_unique_layer_name(mapnick_layer.name)
-
-            position = utils.parse_position(normalized_args)
+        features = {"features": []}
+        for layer_name in layers:
+            layer = geofile.load(layer_name)
 
-            layer_features = []
-            variable_found = None
+            with instrumentation.span("get_features_in_box"):
+                layer_features = layer.get_features_in_box(box, projection)
+            if layer_features is None:
+                abort(404)
 
-            featureset = mp.query_map_point(layerindex, position.x, position.y)
-            for feature in featureset:
-                geojson = json.loads(feature.to_geojson())
-                layer_features.append(geojson)
+            (type, _, variable, _, _) = path.parse_unique_layer_name(layer_name)
 
-                if (type == path.VECTOR) and not (variable_found):
-                    variable_found = ("properties" in geojson) and (
-                        f"__variable__{variable}" in geojson["properties"]
-                    )
+            variable_found = any(
+                f"__variable__{variable}" in feature["properties"]
+                for feature in layer_features
+            )
 
             if (type == path.AREA) or variable_found:
                 features["features"].extend(layer_features)
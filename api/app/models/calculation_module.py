@@ -7,12 +7,16 @@ import json
 import logging
 import os
 import re
+import threading
+import time
 from typing import Dict, Text
 
 import kombu
 import redis
 from celery import Celery
 
+from app.common import instrumentation
+
 TASK_MATCH = "(?P<cm_id>[ a-zA-Z._]+)"
 CM_INFO_MATCH = "\\[cm_info=(?P<cm_info>.+)\\]"
 INFO_STRING = re.compile("^" + TASK_MATCH + " " + CM_INFO_MATCH + "$")
@@ -20,6 +24,16 @@ INFO_STRING = re.compile("^" + TASK_MATCH + " " + CM_INFO_MATCH + "$")
 DEFAULT_BROKER = "redis://localhost"
 DEFAULT_BACKEND = "redis://localhost"
 
+# Redis hash in which the workers publish their calculation modules
+CM_REGISTRY_KEY = "enermaps:cms"
+
+# Number of seconds during which the content of the registry is reused
+CM_REGISTRY_CACHE_DURATION = float(os.environ.get("CM_REGISTRY_CACHE_DURATION", 5))
+
+_registry_client = None
+_cms_cache = None
+_cms_cache_lock = threading.Lock()
+
 
 def get_celery_app():
     """Return an instance of a celery application using either the
@@ -77,32 +91,71 @@ class CalculationModule:
         (failure, running or done) and its results.
         """
         # Send to proper queue
-        return self.app.send_task(self.cm_id, args, kwargs, queue=self.queue)
+        with instrumentation.span("celery.send_task"):
+            return self.app.send_task(self.cm_id, args, kwargs, queue=self.queue)
+
+
+def get_registry_client():
+    """Return the client used to read the registry of the calculation modules"""
+    global _registry_client
+
+    if _registry_client is None:
+        _registry_client = redis.Redis.from_url(
+            os.environ.get("CELERY_BROKER_URL", DEFAULT_BROKER),
+            socket_connect_timeout=2,
+            socket_timeout=2,
+        )
+
+    return _registry_client
 
 
 def list_cms() -> Dict[Text, CalculationModule]:
-    """List all cms available on a celery queue."""
-    app = get_celery_app()
+    """List all cms available, as published in the registry by the workers.
+
+    The content of the registry is reused for CM_REGISTRY_CACHE_DURATION seconds.
+    """
+    global _cms_cache
+
+    with _cms_cache_lock:
+        if (_cms_cache is not None) and (
+            time.time() - _cms_cache[0] < CM_REGISTRY_CACHE_DURATION
+        ):
+            return dict(_cms_cache[1])
+
     try:
-        app_inspector = app.control.inspect()
-        nodes = app_inspector.registered("cm_info")
-    except (redis.exceptions.ConnectionError, kombu.exceptions.OperationalError) as err:
+        with instrumentation.span("redis.list_cms"):
+            entries = get_registry_client().hgetall(CM_REGISTRY_KEY)
+    except (redis.exceptions.RedisError, kombu.exceptions.OperationalError) as err:
         # If redis is down, we just don't expose any calculation module
         logging.error("Connection to celery broker failed with error: %s", err)
         return {}
-    if not nodes:
-        return {}
+
+    now = time.time()
+
     cms = {}
-    for node in nodes.values():
-        for entry in node:
-            try:
-                cm = from_registration_string(entry)
-            except InvalidRegistrationString as e:
-                # invalid cm was encountered, skip it
-                logging.error(e)
-                continue
-            cms[cm.name] = cm
-    return cms
+    for entry in entries.values():
+        try:
+            entry = json.loads(entry)
+        except ValueError as e:
+            logging.error(e)
+            continue
+
+        # The workers of this calculation module stopped publishing it
+        if entry.get("expires_at", 0) < now:
+            continue
+
+        try:
+            cm = from_registration_string(entry["registration"])
+        except (InvalidRegistrationString, KeyError) as e:
+            # invalid cm was encountered, skip it
+            logging.error(e)
+            continue
+        cms[cm.name] = cm
+
+    with _cms_cache_lock:
+        _cms_cache = (now, cms)
+
+    return dict(cms)
 
 
 class UnexistantCalculationModule(Exception):
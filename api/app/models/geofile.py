@@ -6,13 +6,16 @@ also catch those on accessing the layer.
 
 """
 import json
+import math
 import os
 import shutil
 from abc import ABC, abstractmethod
 from pathlib import Path
-from tempfile import TemporaryDirectory, mkdtemp
+from tempfile import NamedTemporaryFile, TemporaryDirectory, mkdtemp
 
+import gdal
 import mapnik
+import numpy as np
 import ogr
 import osr
 from flask import current_app, safe_join
@@ -21,7 +24,11 @@ from PIL import Image
 import app.common.projection as project
 from app.common import path
 
-from . import storage
+from . import storage, tiles
+
+# The overviews of the raster layers are only created if they would be at least
+# that large (in pixels), smaller layers are rendered fast enough from their files
+OVERVIEW_MIN_SIZE = 256
 
 
 def load(name):
@@ -38,49 +45,98 @@ def load(name):
 
 
 def save_vector_geojson(layer_name, geojson):
+    return save_vector_features(layer_name, geojson["features"])
+
+
+def save_vector_features(layer_name, features, replace=False):
+    """Save the features of a vector layer. The features can be produced by an
+    iterator: they are processed and written to disk one by one, so they don't
+    need to be all kept in memory.
+
+    If replace is True, the existing files of the layer are replaced once the new
+    ones are ready. Return the list of variables having a value in at least one
+    feature.
+    """
     type = path.get_type(layer_name)
     storage_instance = storage.create_for_layer_type(type)
 
-    # Processing
     valid_variables = []
+    envelopes = []
+    offsets = []
 
-    filtered_features = []
-    for i in range(len(geojson["features"])):
-        feature = geojson["features"][i]
+    # Save the files
+    with TemporaryDirectory(prefix=storage_instance.get_tmp_dir()) as tmp_dir:
+        tmp_filepath = safe_join(tmp_dir, storage_instance.GEOJSON_FILENAME)
+        proj_filepath = safe_join(tmp_dir, storage_instance.PROJECTION_FILENAME)
+        variables_filepath = safe_join(tmp_dir, storage_instance.VARIABLES_FILENAME)
+        envelopes_filepath = safe_join(tmp_dir, storage_instance.ENVELOPES_FILENAME)
+        offsets_filepath = safe_join(tmp_dir, storage_instance.OFFSETS_FILENAME)
+        bbox_filepath = safe_join(tmp_dir, storage_instance.BBOX_FILENAME)
 
-        if (
-            ("geometry" in feature)
-            and (feature["geometry"] is not None)
-            and (len(feature["geometry"]["coordinates"]) == 0)
-        ):
-            break
+        with open(tmp_filepath, "w") as f:
+            header = '{"type": "FeatureCollection", "features": ['
+            f.write(header)
+
+            # json.dumps() escapes the non-ASCII characters, so the number of
+            # characters written is also the number of bytes
+            position = len(header)
+
+            separator = ""
+            for feature in features:
+                if (
+                    ("geometry" in feature)
+                    and (feature["geometry"] is not None)
+                    and (len(feature["geometry"]["coordinates"]) == 0)
+                ):
+                    break
 
-        properties = feature["properties"]
+                properties = feature["properties"]
 
-        # Retrieve the list of variable names
-        for variable, value in properties["variables"].items():
-            if (variable not in valid_variables) and (value is not None):
-                valid_variables.append(variable)
+                # Retrieve the list of variable names
+                for variable, value in properties["variables"].items():
+                    if (variable not in valid_variables) and (value is not None):
+                        valid_variables.append(variable)
 
-        # Delete the legend (we don't need it)
-        del properties["legend"]
+                # Delete the legend (we don't need it)
+                del properties["legend"]
 
-        # Add the variable values as keys accessible by mapnik
-        for variable, value in properties["variables"].items():
-            properties[f"__variable__{variable}"] = value
+                # Add the variable values as keys accessible by mapnik
+                for variable, value in properties["variables"].items():
+                    properties[f"__variable__{variable}"] = value
 
-        filtered_features.append(feature)
+                envelopes.append(compute_geometry_envelope(feature.get("geometry")))
 
-    geojson["features"] = filtered_features
+                content = json.dumps(feature)
 
-    # Save the files
-    with TemporaryDirectory(prefix=storage_instance.get_tmp_dir()) as tmp_dir:
-        tmp_filepath = safe_join(tmp_dir, storage_instance.GEOJSON_FILENAME)
-        proj_filepath = safe_join(tmp_dir, storage_instance.PROJECTION_FILENAME)
-        variables_filepath = safe_join(tmp_dir, storage_instance.VARIABLES_FILENAME)
+                f.write(separator)
+                f.write(content)
 
-        with open(tmp_filepath, "w") as f:
-            f.write(json.dumps(geojson))
+                position += len(separator)
+                offsets.append((position, position + len(content)))
+                position += len(content)
+
+                separator = ", "
+
+            f.write("]}")
+
+        envelopes = np.array(envelopes, dtype=float).reshape((-1, 4))
+        np.save(envelopes_filepath, envelopes)
+
+        offsets = np.array(offsets, dtype=np.int64).reshape((-1, 2))
+        np.save(offsets_filepath, offsets)
+
+        # Determine the bounding box of the data (the features are always in
+        # longitude/latitude in GeoJSON)
+        bbox = compute_bbox(envelopes)
+        if bbox is not None:
+            with open(bbox_filepath, "w") as f:
+                f.write(json.dumps(bbox))
+
+        convert_to_geopackage(
+            tmp_filepath,
+            safe_join(tmp_dir, storage_instance.GEOPACKAGE_FILENAME),
+            storage_instance.GEOPACKAGE_LAYER,
+        )
 
         with open(proj_filepath, "w") as fd:
             fd.write(
@@ -95,6 +151,9 @@ def save_vector_geojson(layer_name, geojson):
         target_folder = storage_instance.get_dir(layer_name)
         os.makedirs(os.path.dirname(target_folder), exist_ok=True)
 
+        if replace:
+            delete_all_features(layer_name)
+
         try:
             os.replace(tmp_dir, target_folder)
         except (FileExistsError, OSError):
@@ -104,42 +163,95 @@ def save_vector_geojson(layer_name, geojson):
             print(e)
             return valid_variables
 
-    # Determine the bounding box of the data
-    layer = load(layer_name)
-    mapnik_layers = layer.as_mapnik_layers()
+    return valid_variables
 
-    low_left = None
-    upper_right = None
 
-    for mapnik_layer in mapnik_layers:
-        layerproj = mapnik.Projection(mapnik_layer.srs)
-        bbox = mapnik_layer.envelope()
+def get_cached_geojson_response(layer_name, compressed=False):
+    """Return the path of the cached GeoJSON response of a vector layer (see
+    cache_geojson_response()), or None if not found
+    """
+    if path.get_type(layer_name) != path.VECTOR:
+        return None
 
-        layer_low_left = layerproj.inverse(mapnik.Coord(bbox.minx, bbox.miny))
-        layer_upper_right = layerproj.inverse(mapnik.Coord(bbox.maxx, bbox.maxy))
+    storage_instance = storage.create(layer_name)
 
-        if low_left is not None:
-            low_left.x = min(low_left.x, layer_low_left.x)
-            low_left.y = min(low_left.y, layer_low_left.y)
-            upper_right.x = max(upper_right.x, layer_upper_right.x)
-            upper_right.y = max(upper_right.y, layer_upper_right.y)
-        else:
-            low_left = layer_low_left
-            upper_right = layer_upper_right
-
-    with open(layer.storage.get_bbox_file(layer_name), "w") as f:
-        f.write(
-            json.dumps(
-                {
-                    "left": low_left.x,
-                    "right": upper_right.x,
-                    "bottom": low_left.y,
-                    "top": upper_right.y,
-                }
-            )
-        )
+    filename = storage_instance.get_geojson_response_file(layer_name, compressed)
+    if not os.path.exists(filename):
+        return None
 
-    return valid_variables
+    return filename
+
+
+def cache_geojson_response(layer_name, chunks, compressed=False):
+    """Generate the chunks of the GeoJSON response of a vector layer, and save
+    them in the cache once they were all generated, to be sent as is by the next
+    requests.
+
+    The response is only cached if the layer is in the cache: it is then deleted
+    with the layer.
+    """
+    if path.get_type(layer_name) != path.VECTOR:
+        yield from chunks
+        return
+
+    storage_instance = storage.create(layer_name)
+
+    if not os.path.exists(storage_instance.get_dir(layer_name)):
+        yield from chunks
+        return
+
+    filename = storage_instance.get_geojson_response_file(layer_name, compressed)
+
+    os.makedirs(storage_instance.get_tmp_dir(), exist_ok=True)
+
+    completed = False
+
+    with NamedTemporaryFile(dir=storage_instance.get_tmp_dir(), delete=False) as f:
+        try:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+
+            completed = True
+        finally:
+            f.close()
+
+            try:
+                if completed:
+                    os.replace(f.name, filename)
+                else:
+                    os.remove(f.name)
+            except OSError as e:
+                # The layer was deleted in the meantime
+                print(e)
+                if os.path.exists(f.name):
+                    os.remove(f.name)
+
+
+def convert_to_geopackage(geojson_filepath, geopackage_filepath, layer_name):
+    """Convert a GeoJSON file into a GeoPackage. Unlike the GeoJSON file, the
+    GeoPackage has a spatial index, so mapnik only reads the features located in
+    the rendered area.
+    """
+    dataset = gdal.VectorTranslate(
+        geopackage_filepath,
+        geojson_filepath,
+        format="GPKG",
+        layerName=layer_name,
+        geometryType="PROMOTE_TO_MULTI",
+        layerCreationOptions=["SPATIAL_INDEX=YES"],
+    )
+
+    if dataset is None:
+        print(f"Failed to convert '{geojson_filepath}' to GeoPackage")
+        if os.path.exists(geopackage_filepath):
+            os.remove(geopackage_filepath)
+        return False
+
+    # Close the dataset, to ensure everything is written on disk
+    dataset = None
+
+    return True
 
 
 def save_raster_projection(layer_name, projection):
@@ -188,17 +300,24 @@ def save_raster_geometries(layer_name, rasters_list):
         else:
             geometries[raster["fid"]] = geometry["coordinates"][0]
 
-    # Save the file
+    # Save the files
     with TemporaryDirectory(prefix=storage_instance.get_tmp_dir()) as tmp_dir:
         tmp_filepath = safe_join(tmp_dir, storage_instance.GEOMETRIES_FILENAME)
+        envelopes_filepath = safe_join(tmp_dir, storage_instance.ENVELOPES_FILENAME)
 
         with open(tmp_filepath, "w") as f:
             f.write(json.dumps(geometries))
 
+        envelopes = compute_envelopes(geometries)
+        np.save(envelopes_filepath, envelopes)
+
         target_filename = storage_instance.get_geometries_file(layer_name)
         os.makedirs(os.path.dirname(target_filename), exist_ok=True)
 
         try:
+            os.replace(
+                envelopes_filepath, storage_instance.get_envelopes_file(layer_name)
+            )
             os.replace(tmp_filepath, target_filename)
         except (FileExistsError, OSError):
             print("Geometries file already exists")
@@ -207,72 +326,263 @@ def save_raster_geometries(layer_name, rasters_list):
             print(e)
             return
 
-    # Determine the bounding box of the data
-    if geometries[next(iter(geometries))] is not None:
-        left = None
-        right = None
-        bottom = None
-        top = None
-
-        for feature_id, coordinates in geometries.items():
-            for p in coordinates:
-                if left is not None:
-                    left = min(left, p[0])
-                    right = max(right, p[0])
-                    bottom = min(bottom, p[1])
-                    top = max(top, p[1])
-                else:
-                    left = p[0]
-                    right = p[0]
-                    bottom = p[1]
-                    top = p[1]
+    # Determine the bounding box of the data, from the geometries if available or
+    # from the extents of the raster files otherwise
+    if np.isnan(envelopes).any():
+        envelopes = np.concatenate(
+            [envelopes, compute_raster_files_envelopes(layer_name)]
+        )
 
+    bbox = compute_bbox(envelopes)
+    if bbox is not None:
         with open(storage_instance.get_bbox_file(layer_name), "w") as f:
-            f.write(
-                json.dumps(
-                    {
-                        "left": left,
-                        "right": right,
-                        "bottom": bottom,
-                        "top": top,
-                    }
-                )
+            f.write(json.dumps(bbox))
+
+
+def save_raster_overview(layer_name):
+    """Create a downsampled mosaic of all the raster files of a layer (with internal
+    overviews), used to render the zoomed-out views of the layer without reading
+    the full-resolution files. Return True if the overview was created.
+    """
+    storage_instance = storage.create(layer_name)
+
+    # Delete the overview of the previous content of the layer, which must not be
+    # used if no new one is created (the metadata first, since it makes the
+    # overview used)
+    for filename in (
+        storage_instance.get_overview_metadata_file(layer_name),
+        storage_instance.get_overview_file(layer_name),
+    ):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+    geometries = storage_instance.get_geometries(layer_name)
+    if not geometries:
+        return False
+
+    filenames = [
+        storage_instance.get_file_path(layer_name, feature_id)
+        for feature_id in geometries.keys()
+    ]
+    filenames = [x for x in filenames if os.path.exists(x)]
+    if len(filenames) == 0:
+        return False
+
+    factor = int(current_app.config["RASTER_OVERVIEW_FACTOR"])
+    if factor <= 1:
+        return False
+
+    with TemporaryDirectory(prefix=storage_instance.get_tmp_dir()) as tmp_dir:
+        vrt_filepath = safe_join(tmp_dir, "mosaic.vrt")
+        tmp_filepath = safe_join(tmp_dir, storage_instance.OVERVIEW_FILENAME)
+        metadata_filepath = safe_join(
+            tmp_dir, storage_instance.OVERVIEW_METADATA_FILENAME
+        )
+
+        mosaic = gdal.BuildVRT(vrt_filepath, filenames)
+        if mosaic is None:
+            return False
+
+        width = mosaic.RasterXSize // factor
+        height = mosaic.RasterYSize // factor
+
+        if max(width, height) < OVERVIEW_MIN_SIZE:
+            return False
+
+        overview = gdal.Translate(
+            tmp_filepath,
+            mosaic,
+            width=width,
+            height=height,
+            resampleAlg="average",
+            creationOptions=["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"],
+        )
+        mosaic = None
+
+        if overview is None:
+            return False
+
+        # Internal overviews, used by GDAL when mapnik reads the file at a lower
+        # resolution
+        levels = []
+        level = 2
+        while max(width, height) // level >= OVERVIEW_MIN_SIZE:
+            levels.append(level)
+            level *= 2
+
+        if len(levels) > 0:
+            overview.BuildOverviews("AVERAGE", levels)
+
+        geotransform = overview.GetGeoTransform()
+        overview = None
+
+        with open(metadata_filepath, "w") as f:
+            json.dump({"resolution": [abs(geotransform[1]), abs(geotransform[5])]}, f)
+
+        try:
+            os.replace(tmp_filepath, storage_instance.get_overview_file(layer_name))
+            os.replace(
+                metadata_filepath,
+                storage_instance.get_overview_metadata_file(layer_name),
             )
+        except OSError as e:
+            print(e)
+            return False
 
-    else:
-        layer = load(layer_name)
-        mapnik_layers = layer.as_mapnik_layers()
-
-        low_left = None
-        upper_right = None
-
-        for mapnik_layer in mapnik_layers:
-            layerproj = mapnik.Projection(mapnik_layer.srs)
-            bbox = mapnik_layer.envelope()
-
-            layer_low_left = layerproj.inverse(mapnik.Coord(bbox.minx, bbox.miny))
-            layer_upper_right = layerproj.inverse(mapnik.Coord(bbox.maxx, bbox.maxy))
-
-            if low_left is not None:
-                low_left.x = min(low_left.x, layer_low_left.x)
-                low_left.y = min(low_left.y, layer_low_left.y)
-                upper_right.x = max(upper_right.x, layer_upper_right.x)
-                upper_right.y = max(upper_right.y, layer_upper_right.y)
-            else:
-                low_left = layer_low_left
-                upper_right = layer_upper_right
-
-        with open(layer.storage.get_bbox_file(layer_name), "w") as f:
-            f.write(
-                json.dumps(
-                    {
-                        "left": low_left.x,
-                        "right": upper_right.x,
-                        "bottom": low_left.y,
-                        "top": upper_right.y,
-                    }
-                )
+    return True
+
+
+def compute_envelopes(geometries):
+    """Return the envelopes of the polygons of a geometries dict, as an array of
+    (minx, miny, maxx, maxy) rows in the order of the dict. The rows of the
+    missing polygons are filled with NaN, so they never intersect anything.
+    """
+    envelopes = np.full((len(geometries), 4), np.nan)
+
+    for i, coordinates in enumerate(geometries.values()):
+        if coordinates is None:
+            continue
+
+        points = np.asarray(coordinates, dtype=float)
+        envelopes[i, 0:2] = points.min(axis=0)
+        envelopes[i, 2:4] = points.max(axis=0)
+
+    return envelopes
+
+
+# Nesting depth of the positions in the coordinates of each type of geometry
+_GEOMETRY_DEPTHS = {
+    "Point": 0,
+    "MultiPoint": 1,
+    "LineString": 1,
+    "MultiLineString": 2,
+    "Polygon": 2,
+    "MultiPolygon": 3,
+}
+
+
+def compute_geometry_envelope(geometry):
+    """Return the envelope of a GeoJSON geometry, as a (minx, miny, maxx, maxy)
+    tuple, filled with NaN if the geometry is missing or empty
+    """
+    points = _get_geometry_points(geometry)
+    if len(points) == 0:
+        return (np.nan, np.nan, np.nan, np.nan)
+
+    return tuple(points.min(axis=0)) + tuple(points.max(axis=0))
+
+
+def _get_geometry_points(geometry):
+    """Return all the positions of a GeoJSON geometry as a (N, 2) array"""
+    if geometry is None:
+        return np.empty((0, 2))
+
+    if geometry["type"] == "GeometryCollection":
+        parts = [_get_geometry_points(x) for x in geometry["geometries"]]
+        return np.concatenate(parts) if len(parts) > 0 else np.empty((0, 2))
+
+    depth = _GEOMETRY_DEPTHS.get(geometry["type"])
+    coordinates = geometry.get("coordinates")
+    if (depth is None) or not coordinates:
+        return np.empty((0, 2))
+
+    if depth == 0:
+        return np.asarray([coordinates[:2]], dtype=float)
+
+    # Flatten the coordinates into lists of positions, which can be converted to
+    # arrays as a whole (unlike the ragged coordinates of polygons with holes or
+    # of multi-geometries)
+    parts = [coordinates]
+    for _ in range(depth - 1):
+        parts = [x for part in parts for x in part]
+
+    parts = [np.asarray(x, dtype=float)[:, :2] for x in parts if len(x) > 0]
+    return np.concatenate(parts) if len(parts) > 0 else np.empty((0, 2))
+
+
+def compute_raster_files_envelopes(layer_name):
+    """Return the envelopes of the raster files of a layer (in longitude/latitude),
+    computed from the extents of the files
+    """
+    storage_instance = storage.create(layer_name)
+
+    geometries = storage_instance.get_geometries(layer_name)
+    if not geometries:
+        return np.empty((0, 4))
+
+    extents = []
+    for feature_id in geometries.keys():
+        dataset = gdal.Open(storage_instance.get_file_path(layer_name, feature_id))
+        if dataset is None:
+            continue
+
+        geotransform = dataset.GetGeoTransform()
+        extents.append(
+            (
+                geotransform[0],
+                geotransform[3],
+                geotransform[0] + geotransform[1] * dataset.RasterXSize,
+                geotransform[3] + geotransform[5] * dataset.RasterYSize,
             )
+        )
+        dataset = None
+
+    if len(extents) == 0:
+        return np.empty((0, 4))
+
+    extents = np.array(extents)
+    low_left = np.stack(
+        [extents[:, [0, 2]].min(axis=1), extents[:, [1, 3]].min(axis=1)]
+    )
+    upper_right = np.stack(
+        [extents[:, [0, 2]].max(axis=1), extents[:, [1, 3]].max(axis=1)]
+    )
+
+    projection = storage_instance.get_projection(layer_name)
+    if projection is None:
+        projection = project.epsg_string_to_proj4(
+            current_app.config["RASTER_PROJECTION_SYSTEM"]
+        )
+
+    source = osr.SpatialReference()
+    source.ImportFromProj4(projection)
+
+    target = osr.SpatialReference()
+    target.ImportFromEPSG(4326)
+
+    if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+        source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    transform = osr.CoordinateTransformation(source, target)
+
+    # Transform all the corners at once
+    corners = np.array(
+        transform.TransformPoints(np.concatenate([low_left.T, upper_right.T]).tolist())
+    )[:, :2]
+
+    return np.concatenate([corners[: len(extents)], corners[len(extents) :]], axis=1)
+
+
+def compute_bbox(envelopes):
+    """Return the bounding box of a set of envelopes (as returned by
+    compute_envelopes()), ignoring the missing ones. Return None if there is no
+    envelope.
+    """
+    envelopes = np.asarray(envelopes, dtype=float)
+
+    envelopes = envelopes[~np.isnan(envelopes).any(axis=1)]
+    if len(envelopes) == 0:
+        return None
+
+    return {
+        "left": float(envelopes[:, 0].min()),
+        "right": float(envelopes[:, 2].max()),
+        "bottom": float(envelopes[:, 1].min()),
+        "top": float(envelopes[:, 3].max()),
+    }
 
 
 def save_raster_file(layer_name, feature_id, raster_content):
@@ -383,6 +693,9 @@ def _save_cm_json(layer_name, filename, data):
 def delete_all_features(layer_name):
     storage_instance = storage.create(layer_name)
 
+    if path.get_type(layer_name) != path.CM:
+        tiles.invalidate(layer_name)
+
     folder = storage_instance.get_dir(layer_name, cache=True)
     if not os.path.exists(folder):
         return
@@ -402,8 +715,10 @@ class Layer(ABC):
         self.storage = storage
 
     @abstractmethod
-    def get_data_for_bounding_box(self, bbox, bbox_projection):
-        """Get layer-specific data relevant to the provided bounding box.
+    def get_data_for_bounding_box(self, bbox, bbox_projection, size=None):
+        """Get layer-specific data relevant to the provided bounding box. If the
+        size of the image to render is provided, data with a lower resolution
+        might be returned for the zoomed-out views.
 
         Consider the data as an opaque array, that can be given to
         'as_mapnik_layers()' later. For example:
@@ -437,7 +752,13 @@ class RasterLayer(Layer):
     def is_queryable(self):
         return False
 
-    def get_data_for_bounding_box(self, bbox, bbox_projection):
+    def get_data_for_bounding_box(self, bbox, bbox_projection, size=None):
+        # Use the overview of the layer if it is detailed enough for the image
+        if (size is not None) and (bbox is not None) and (bbox_projection is not None):
+            overview = self.get_overview(bbox, bbox_projection, size)
+            if overview is not None:
+                return [overview]
+
         return self.get_rasters_in_bbox(bbox, bbox_projection)
 
     def as_mapnik_layers(self, data=None):
@@ -484,6 +805,31 @@ class RasterLayer(Layer):
 
         return layers
 
+    def get_overview(self, bbox, bbox_projection, size):
+        """Return the (feature_id, filename) of the overview of the layer if its
+        resolution is sufficient to render an image of the given size covering the
+        bounding box, or None
+        """
+        if path.get_type(self.name) != path.RASTER:
+            return None
+
+        metadata = self.storage.get_overview_metadata(self.name)
+        if metadata is None:
+            return None
+
+        projection = self.storage.get_projection(self.name)
+        if projection is None:
+            return None
+
+        pixel_size = _get_pixel_size(bbox, bbox_projection, size, projection)
+        if (pixel_size is None) or (pixel_size < max(metadata["resolution"])):
+            return None
+
+        return (
+            self.storage.OVERVIEW_FILENAME,
+            self.storage.get_overview_file(self.name),
+        )
+
     def get_rasters_in_feature_list(self, features):
         geometries = self.storage.get_geometries(self.name)
 
@@ -554,35 +900,35 @@ class RasterLayer(Layer):
             return rasters
 
         # Check the intersections
-        source_ref = osr.SpatialReference()
-        target_ref = osr.SpatialReference()
+        bbox_poly = _bbox_to_polygon(bbox, bbox_projection)
 
-        source_ref.ImportFromEPSG(project.epsg_string_to_epsg(bbox_projection))
-        target_ref.ImportFromEPSG(
-            project.epsg_string_to_epsg(current_app.config["VECTOR_PROJECTION_SYSTEM"])
-        )
+        return self._get_rasters_in_polygons(geometries, [bbox_poly])
 
-        t = osr.CoordinateTransformation(source_ref, target_ref)
+    def _get_rasters_in_polygons(self, geometries, polygons):
+        rasters = []
 
-        bbox_top_left = t.TransformPoint(bbox.minx, bbox.maxy)
-        bbox_bottom_right = t.TransformPoint(bbox.maxx, bbox.miny)
+        feature_ids = list(geometries.keys())
 
-        bbox_ring = ogr.Geometry(ogr.wkbLinearRing)
-        bbox_ring.AddPoint(bbox_top_left[1], bbox_top_left[0])
-        bbox_ring.AddPoint(bbox_top_left[1], bbox_bottom_right[0])
-        bbox_ring.AddPoint(bbox_bottom_right[1], bbox_bottom_right[0])
-        bbox_ring.AddPoint(bbox_bottom_right[1], bbox_top_left[0])
-        bbox_ring.AddPoint(bbox_top_left[1], bbox_top_left[0])
+        # Only test the exact intersection for the raster files whose envelope
+        # intersects the envelope of one of the polygons
+        envelopes = self.storage.get_envelopes(self.name)
+        if (envelopes is not None) and (len(envelopes) == len(feature_ids)):
+            candidates = np.zeros(len(feature_ids), dtype=bool)
 
-        bbox_poly = ogr.Geometry(ogr.wkbPolygon)
-        bbox_poly.AddGeometry(bbox_ring)
+            for polygon in polygons:
+                (minx, maxx, miny, maxy) = polygon.GetEnvelope()
+                candidates |= (
+                    (envelopes[:, 0] <= maxx)
+                    & (envelopes[:, 2] >= minx)
+                    & (envelopes[:, 1] <= maxy)
+                    & (envelopes[:, 3] >= miny)
+                )
 
-        return self._get_rasters_in_polygons(geometries, [bbox_poly])
+            feature_ids = [feature_ids[i] for i in np.flatnonzero(candidates)]
 
-    def _get_rasters_in_polygons(self, geometries, polygons):
-        rasters = []
+        for feature_id in feature_ids:
+            coordinates = geometries[feature_id]
 
-        for feature_id, coordinates in geometries.items():
             raster_ring = ogr.Geometry(ogr.wkbLinearRing)
 
             for p in coordinates:
@@ -605,7 +951,12 @@ class RasterLayer(Layer):
 class VectorLayer(Layer):
     """Future implementation of a vector layer."""
 
-    def get_data_for_bounding_box(self, bbox, bbox_projection):
+    def get_data_for_bounding_box(self, bbox, bbox_projection, size=None):
+        # Prefer the spatially indexed version of the data when available
+        geopackage_file = self.storage.get_geopackage_file(self.name)
+        if os.path.exists(geopackage_file):
+            return [geopackage_file]
+
         geojson_file = self.storage.get_geojson_file(self.name)
         if not os.path.exists(geojson_file):
             print(f"GeoJSON file '{geojson_file}' was not found")
@@ -629,7 +980,14 @@ class VectorLayer(Layer):
             )
 
         layer = mapnik.Layer(self.name)
-        layer.datasource = mapnik.GeoJSON(file=data[0])
+
+        if os.path.basename(data[0]) == self.storage.GEOPACKAGE_FILENAME:
+            layer.datasource = mapnik.Ogr(
+                file=data[0], layer=self.storage.GEOPACKAGE_LAYER
+            )
+        else:
+            layer.datasource = storage.read_metadata_file(data[0], _load_geojson)
+
         layer.srs = projection
         layer.queryable = True
         layer.name = self.name
@@ -643,6 +1001,66 @@ class VectorLayer(Layer):
         """
         return True
 
+    def get_features_in_box(self, box, box_projection):
+        """Return the features (in GeoJSON format) intersecting a (small) bounding
+        box, typically the location clicked by the user.
+
+        Only the features whose envelope intersects the box are read from the
+        GeoJSON file (at their position in it) and tested, without loading the
+        whole layer. They are returned like mapnik did: with their original
+        geometry, the nested objects serialized as strings and the unset
+        properties omitted.
+        """
+        geojson_file = self.storage.get_geojson_file(self.name)
+        if not os.path.exists(geojson_file):
+            return None
+
+        box_poly = _bbox_to_polygon(box, box_projection)
+
+        envelopes = self.storage.get_envelopes(self.name)
+        offsets = self.storage.get_offsets(self.name)
+
+        if (
+            (envelopes is not None)
+            and (offsets is not None)
+            and (len(envelopes) == len(offsets))
+        ):
+            (minx, maxx, miny, maxy) = box_poly.GetEnvelope()
+            candidates = (
+                (envelopes[:, 0] <= maxx)
+                & (envelopes[:, 2] >= minx)
+                & (envelopes[:, 1] <= maxy)
+                & (envelopes[:, 3] >= miny)
+            )
+
+            candidate_features = _read_features_at(
+                geojson_file, offsets[np.flatnonzero(candidates)]
+            )
+        else:
+            # Layer saved before the positions of the features were stored
+            with open(geojson_file, "r") as f:
+                candidate_features = json.load(f)["features"]
+
+        features = []
+        for feature in candidate_features:
+            geometry = feature.get("geometry")
+            if geometry is None:
+                continue
+
+            geometry = ogr.CreateGeometryFromJson(json.dumps(geometry))
+            if (geometry is None) or not (geometry.Intersects(box_poly)):
+                continue
+
+            feature["properties"] = {
+                k: json.dumps(v) if isinstance(v, (dict, list)) else v
+                for k, v in feature["properties"].items()
+                if v is not None
+            }
+
+            features.append(feature)
+
+        return features
+
     def get_legend_images(self, legend):
         """Create images containing the colors defined in the legend. The caller is
         responsible to delete the folder when the images aren't needed anymore.
@@ -666,3 +1084,83 @@ class VectorLayer(Layer):
             images.append(filename)
 
         return (images, images_folder)
+
+
+def _bbox_to_polygon(bbox, bbox_projection):
+    """Return a polygon covering a bounding box, in the projection of the vector
+    layers
+    """
+    source_ref = osr.SpatialReference()
+    target_ref = osr.SpatialReference()
+
+    source_ref.ImportFromEPSG(project.epsg_string_to_epsg(bbox_projection))
+    target_ref.ImportFromEPSG(
+        project.epsg_string_to_epsg(current_app.config["VECTOR_PROJECTION_SYSTEM"])
+    )
+
+    t = osr.CoordinateTransformation(source_ref, target_ref)
+
+    bbox_top_left = t.TransformPoint(bbox.minx, bbox.maxy)
+    bbox_bottom_right = t.TransformPoint(bbox.maxx, bbox.miny)
+
+    bbox_ring = ogr.Geometry(ogr.wkbLinearRing)
+    bbox_ring.AddPoint(bbox_top_left[1], bbox_top_left[0])
+    bbox_ring.AddPoint(bbox_top_left[1], bbox_bottom_right[0])
+    bbox_ring.AddPoint(bbox_bottom_right[1], bbox_bottom_right[0])
+    bbox_ring.AddPoint(bbox_bottom_right[1], bbox_top_left[0])
+    bbox_ring.AddPoint(bbox_top_left[1], bbox_top_left[0])
+
+    bbox_poly = ogr.Geometry(ogr.wkbPolygon)
+    bbox_poly.AddGeometry(bbox_ring)
+
+    return bbox_poly
+
+
+def _get_pixel_size(bbox, bbox_projection, size, projection):
+    """Return the size of the pixels of an image covering a bounding box, in the
+    unit of a projection (in the proj4 format), or None if it can't be computed
+    """
+    source_ref = osr.SpatialReference()
+    source_ref.ImportFromEPSG(project.epsg_string_to_epsg(bbox_projection))
+
+    target_ref = osr.SpatialReference()
+    target_ref.ImportFromProj4(projection)
+
+    # Always use the (x, y) order
+    if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+        source_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        target_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    t = osr.CoordinateTransformation(source_ref, target_ref)
+
+    center_y = (bbox.miny + bbox.maxy) / 2
+
+    try:
+        left = t.TransformPoint(bbox.minx, center_y)
+        right = t.TransformPoint(bbox.maxx, center_y)
+    except RuntimeError:
+        return None
+
+    distance = math.hypot(right[0] - left[0], right[1] - left[1])
+    if not math.isfinite(distance):
+        return None
+
+    return distance / size.width
+
+
+def _read_features_at(filename, offsets):
+    """Read the features located at the given (start, end) positions of a GeoJSON
+    file
+    """
+    with open(filename, "rb") as f:
+        for start, end in offsets:
+            f.seek(start)
+            yield json.loads(f.read(end - start))
+
+
+def _load_geojson(filename):
+    """Return a mapnik datasource for a GeoJSON file. Those are expensive to create
+    (the whole file is parsed), so they are kept in the metadata cache of the
+    storage module and shared between the layers.
+    """
+    return mapnik.GeoJSON(file=filename)
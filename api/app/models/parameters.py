@@ -0,0 +1,120 @@
+"""Cache of the parameters of the datasets.
+
+The parameters are needed for nearly every request to the datasets server, but
+rarely change. They are stored in files in the WMS cache folder, so they are
+shared by all the workers (and the command-line tools), and expire after
+PARAMETERS_CACHE_TTL seconds.
+
+When an entry is missing or expired, only one thread (in all the processes)
+retrieves it from the server: the other ones wait for it, then read the new
+entry.
+"""
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+
+from flask import current_app, safe_join
+
+
+def get_dir():
+    return safe_join(current_app.config["WMS_CACHE_DIR"], "parameters")
+
+
+def get_tmp_dir():
+    return safe_join(current_app.config["WMS_CACHE_DIR"], "tmp")
+
+
+def get_file(dataset_id):
+    return safe_join(get_dir(), f"{dataset_id}.json")
+
+
+def get(dataset_id, fetch):
+    """Return the parameters of a dataset, calling fetch() to retrieve them if they
+    aren't in the cache or are expired. Failures (None) aren't cached.
+
+    Each call returns a new copy of the parameters, that the caller is free to
+    modify.
+    """
+    ttl = float(current_app.config["PARAMETERS_CACHE_TTL"])
+    if ttl <= 0:
+        return fetch()
+
+    parameters = _read(dataset_id, ttl)
+    if parameters is not None:
+        return parameters
+
+    with _lock(dataset_id):
+        # Another thread might have retrieved the parameters while we were waiting
+        parameters = _read(dataset_id, ttl)
+        if parameters is not None:
+            return parameters
+
+        parameters = fetch()
+        if parameters is not None:
+            _write(dataset_id, parameters)
+
+    return parameters
+
+
+def invalidate(dataset_id):
+    """Remove the parameters of a dataset from the cache"""
+    try:
+        os.remove(get_file(dataset_id))
+    except FileNotFoundError:
+        pass
+
+
+def invalidate_all():
+    """Remove the parameters of all the datasets from the cache"""
+    folder = get_dir()
+    if not os.path.exists(folder):
+        return
+
+    for filename in os.listdir(folder):
+        if filename.endswith(".json"):
+            try:
+                os.remove(safe_join(folder, filename))
+            except FileNotFoundError:
+                pass
+
+
+def _read(dataset_id, ttl):
+    filename = get_file(dataset_id)
+
+    try:
+        with open(filename, "r") as f:
+            if os.fstat(f.fileno()).st_mtime + ttl < time.time():
+                return None
+
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write(dataset_id, parameters):
+    os.makedirs(get_dir(), exist_ok=True)
+    os.makedirs(get_tmp_dir(), exist_ok=True)
+
+    with NamedTemporaryFile("w", dir=get_tmp_dir(), delete=False) as f:
+        json.dump(parameters, f)
+
+    try:
+        os.replace(f.name, get_file(dataset_id))
+    except OSError as e:
+        print(e)
+        os.remove(f.name)
+
+
+@contextmanager
+def _lock(dataset_id):
+    os.makedirs(get_dir(), exist_ok=True)
+
+    with open(safe_join(get_dir(), f"{dataset_id}.lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -2,12 +2,30 @@ import glob
 import io
 import json
 import os
+import threading
 import zipfile
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
 
+import numpy as np
 from flask import current_app, safe_join
 
 from app.common import path
 
+# Size of the chunks of the ZIP archives of the CM outputs
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# Name of the ZIP archive of the outputs of a task, cached in the folder of the
+# task (so it is deleted with the outputs)
+ZIP_FILENAME = ".outputs.zip"
+
+# Files that are already compressed, and are stored as is in the ZIP archives
+ZIP_STORED_EXTENSIONS = (".tif", ".tiff", ".png", ".jpg", ".jpeg", ".gz", ".zip")
+
+# Per-process cache of the parsed metadata files, indexed by filename
+_metadata_cache = OrderedDict()
+_metadata_cache_lock = threading.Lock()
+
 
 def create(layer_name):
     return create_for_layer_type(path.get_type(layer_name))
@@ -26,11 +44,69 @@ def create_for_layer_type(type):
     return None
 
 
+def read_metadata_file(filename, loader):
+    """Return the content of a metadata file, as parsed by loader(filename), or None
+    if the file doesn't exist.
+
+    The parsed content is kept in memory and reused as long as the inode,
+    modification time and size of the file don't change. It is shared between
+    all the callers, so it must not be modified.
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+
+    signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    with _metadata_cache_lock:
+        entry = _metadata_cache.get(filename)
+        if (entry is not None) and (entry[0] == signature):
+            _metadata_cache.move_to_end(filename)
+            return entry[1]
+
+    try:
+        content = loader(filename)
+    except FileNotFoundError:
+        return None
+
+    max_size = int(current_app.config["METADATA_CACHE_SIZE"])
+    if max_size <= 0:
+        return content
+
+    with _metadata_cache_lock:
+        _metadata_cache[filename] = (signature, content)
+        _metadata_cache.move_to_end(filename)
+
+        while len(_metadata_cache) > max_size:
+            _metadata_cache.popitem(last=False)
+
+    return content
+
+
+def _load_json(filename):
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def _load_text(filename):
+    with open(filename, "r") as f:
+        return f.read()
+
+
+def _load_array(filename):
+    return np.load(filename, mmap_mode="r")
+
+
 class BaseRasterStorage(object):
 
     PROJECTION_FILENAME = "projection.txt"
     GEOMETRIES_FILENAME = "geometries.json"
+    ENVELOPES_FILENAME = "envelopes.npy"
     BBOX_FILENAME = "bbox.json"
+    DOWNLOAD_MANIFEST_FILENAME = "download.json"
+    OVERVIEW_FILENAME = "overview.tif"
+    OVERVIEW_METADATA_FILENAME = "overview.json"
 
     def get_root_dir(self, cache=False):
         raise NotImplementedError
@@ -57,34 +133,52 @@ class BaseRasterStorage(object):
             self.get_dir(layer_name, cache=True), BaseRasterStorage.GEOMETRIES_FILENAME
         )
 
+    def get_envelopes_file(self, layer_name):
+        return safe_join(
+            self.get_dir(layer_name, cache=True), BaseRasterStorage.ENVELOPES_FILENAME
+        )
+
     def get_bbox_file(self, layer_name):
         return safe_join(
             self.get_dir(layer_name, cache=True), BaseRasterStorage.BBOX_FILENAME
         )
 
+    def get_download_manifest_file(self, layer_name):
+        return safe_join(
+            self.get_dir(layer_name, cache=True),
+            BaseRasterStorage.DOWNLOAD_MANIFEST_FILENAME,
+        )
+
+    def get_overview_file(self, layer_name):
+        return safe_join(
+            self.get_dir(layer_name, cache=True), BaseRasterStorage.OVERVIEW_FILENAME
+        )
+
+    def get_overview_metadata_file(self, layer_name):
+        return safe_join(
+            self.get_dir(layer_name, cache=True),
+            BaseRasterStorage.OVERVIEW_METADATA_FILENAME,
+        )
+
     def get_geometries(self, layer_name):
-        filename = self.get_geometries_file(layer_name)
-        if not os.path.exists(filename):
-            return None
+        return read_metadata_file(self.get_geometries_file(layer_name), _load_json)
 
-        with open(filename, "r") as f:
-            return json.load(f)
+    def get_overview_metadata(self, layer_name):
+        return read_metadata_file(
+            self.get_overview_metadata_file(layer_name), _load_json
+        )
 
-    def get_projection(self, layer_name):
-        filename = self.get_projection_file(layer_name)
-        if not os.path.exists(filename):
-            return None
+    def get_envelopes(self, layer_name):
+        """Return the envelopes of the raster files, as a memory-mapped array of
+        (minx, miny, maxx, maxy) rows in the order of the geometries file
+        """
+        return read_metadata_file(self.get_envelopes_file(layer_name), _load_array)
 
-        with open(filename, "r") as f:
-            return f.read()
+    def get_projection(self, layer_name):
+        return read_metadata_file(self.get_projection_file(layer_name), _load_text)
 
     def get_bbox(self, layer_name):
-        filename = self.get_bbox_file(layer_name)
-        if not os.path.exists(filename):
-            return None
-
-        with open(filename, "r") as f:
-            return json.load(f)
+        return read_metadata_file(self.get_bbox_file(layer_name), _load_json)
 
 
 class RasterStorage(BaseRasterStorage):
@@ -128,42 +222,146 @@ class CMStorage(BaseRasterStorage):
         return safe_join(self.get_dir(layer_name), feature_id.replace(".tif", ".prj"))
 
     def get_projection(self, layer_name, feature_id):
-        filename = self.get_projection_file(layer_name, feature_id)
-        if not os.path.exists(filename):
-            return None
+        return read_metadata_file(
+            self.get_projection_file(layer_name, feature_id), _load_text
+        )
 
-        with open(filename, "r") as f:
-            return f.read()
+    def list_files(self, layer_name):
+        """Return the paths (relative to the folder of the task) of all the files
+        produced by a task, including the ones located in subfolders
+        """
+        folder = self.get_dir(layer_name)
 
-    def as_zip(self, layer_name):
-        cm_dir = self.get_dir(layer_name)
+        filenames = []
+        for root, _, files in os.walk(folder):
+            for filename in files:
+                filenames.append(os.path.relpath(safe_join(root, filename), folder))
 
-        if not os.path.exists(cm_dir):
-            return None
+        if ZIP_FILENAME in filenames:
+            filenames.remove(ZIP_FILENAME)
 
-        filenames = os.listdir(cm_dir)
-        if len(filenames) == 0:
+        return sorted(filenames)
+
+    def get_zip_file(self, layer_name):
+        return safe_join(self.get_dir(layer_name), ZIP_FILENAME)
+
+    def get_cached_zip_file(self, layer_name, filenames):
+        """Return the path of the ZIP archive of the task if it exists and is more
+        recent than all the files of the task, or None
+        """
+        zip_file = self.get_zip_file(layer_name)
+
+        try:
+            mtime = os.path.getmtime(zip_file)
+        except FileNotFoundError:
             return None
 
-        zipbuffer = io.BytesIO()
-        with zipfile.ZipFile(zipbuffer, "a") as zip_file:
-            for filename in filenames:
-                file_path = safe_join(cm_dir, filename)
-                with open(file_path, "rb") as fd:
-                    zip_file.writestr(filename, fd.read())
+        folder = self.get_dir(layer_name)
+        for filename in filenames:
+            try:
+                if os.path.getmtime(safe_join(folder, filename)) > mtime:
+                    return None
+            except FileNotFoundError:
+                return None
+
+        return zip_file
+
+    def iter_zip(self, layer_name, filenames):
+        """Generate a ZIP archive of the given files of the task, chunk by chunk.
+
+        Each file is read and compressed piece by piece, so the memory usage doesn't
+        depend on the size of the files. Files that are already compressed (like
+        the GeoTIFFs) are stored as is. The archive is also saved in the folder of
+        the task, to be sent directly by the next downloads.
+        """
+        folder = self.get_dir(layer_name)
+        zip_file = self.get_zip_file(layer_name)
+
+        os.makedirs(self.get_tmp_dir(), exist_ok=True)
+
+        stream = _ZipStream()
+        completed = False
+
+        with NamedTemporaryFile(dir=self.get_tmp_dir(), delete=False) as f:
+            try:
+                with zipfile.ZipFile(stream, "w") as archive:
+                    for filename in filenames:
+                        file_path = safe_join(folder, filename)
+
+                        info = zipfile.ZipInfo.from_file(file_path, filename)
+                        if filename.lower().endswith(ZIP_STORED_EXTENSIONS):
+                            info.compress_type = zipfile.ZIP_STORED
+                        else:
+                            info.compress_type = zipfile.ZIP_DEFLATED
+
+                        with open(file_path, "rb") as src, archive.open(
+                            info, "w"
+                        ) as dst:
+                            while True:
+                                data = src.read(ZIP_CHUNK_SIZE)
+                                if not data:
+                                    break
+
+                                dst.write(data)
+
+                                if stream.size >= ZIP_CHUNK_SIZE:
+                                    chunk = stream.pop()
+                                    f.write(chunk)
+                                    yield chunk
+
+                chunk = stream.pop()
+                f.write(chunk)
+                yield chunk
+
+                completed = True
+            finally:
+                f.close()
 
-        zipbuffer.seek(0)
+                try:
+                    if completed:
+                        os.replace(f.name, zip_file)
+                    else:
+                        os.remove(f.name)
+                except OSError as e:
+                    print(e)
 
-        return zipbuffer
+
+class _ZipStream(io.RawIOBase):
+    """Non-seekable file-like object accumulating the data written by a ZipFile,
+    until it is retrieved with pop()
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
 
 
 class BaseVectorStorage(object):
 
     GEOJSON_FILENAME = "data.geojson"
+    GEOPACKAGE_FILENAME = "data.gpkg"
+    GEOPACKAGE_LAYER = "data"
     PROJECTION_FILENAME = "projection.txt"
     VARIABLES_FILENAME = "variables.json"
     COMBINATIONS_FILENAME = "combinations.json"
+    ENVELOPES_FILENAME = "envelopes.npy"
+    OFFSETS_FILENAME = "offsets.npy"
     BBOX_FILENAME = "bbox.json"
+    GEOJSON_RESPONSE_FILENAME = "response.geojson"
 
     def get_root_dir(self, cache=False):
         raise NotImplementedError
@@ -180,6 +378,24 @@ class BaseVectorStorage(object):
     def get_geojson_file(self, layer_name):
         return self.get_file_path(layer_name, BaseVectorStorage.GEOJSON_FILENAME)
 
+    def get_geojson_response_file(self, layer_name, compressed=False):
+        """Return the path of the GeoJSON response of the layer (as sent by the
+        datasets/geojson/ endpoint), which is specific to the variable of the layer
+        """
+        (_, _, variable, _, _) = path.parse_unique_layer_name(layer_name)
+
+        filename = BaseVectorStorage.GEOJSON_RESPONSE_FILENAME
+        if variable is not None:
+            filename = f"{path.encode(variable)}.{filename}"
+
+        if compressed:
+            filename += ".gz"
+
+        return self.get_file_path(layer_name, filename)
+
+    def get_geopackage_file(self, layer_name):
+        return self.get_file_path(layer_name, BaseVectorStorage.GEOPACKAGE_FILENAME)
+
     def get_projection_file(self, layer_name):
         return self.get_file_path(layer_name, BaseVectorStorage.PROJECTION_FILENAME)
 
@@ -189,32 +405,35 @@ class BaseVectorStorage(object):
     def get_combinations_file(self, layer_name):
         return self.get_file_path(layer_name, BaseVectorStorage.COMBINATIONS_FILENAME)
 
+    def get_envelopes_file(self, layer_name):
+        return self.get_file_path(layer_name, BaseVectorStorage.ENVELOPES_FILENAME)
+
+    def get_offsets_file(self, layer_name):
+        return self.get_file_path(layer_name, BaseVectorStorage.OFFSETS_FILENAME)
+
     def get_bbox_file(self, layer_name):
         return self.get_file_path(layer_name, BaseVectorStorage.BBOX_FILENAME)
 
     def get_projection(self, layer_name):
-        filename = self.get_projection_file(layer_name)
-        if not os.path.exists(filename):
-            return None
-
-        with open(filename, "r") as f:
-            return f.read()
+        return read_metadata_file(self.get_projection_file(layer_name), _load_text)
 
     def get_combinations(self, layer_name):
-        filename = self.get_combinations_file(layer_name)
-        if not os.path.exists(filename):
-            return None
+        return read_metadata_file(self.get_combinations_file(layer_name), _load_json)
 
-        with open(filename, "r") as f:
-            return json.load(f)
+    def get_envelopes(self, layer_name):
+        """Return the envelopes of the features, as a memory-mapped array of
+        (minx, miny, maxx, maxy) rows in the order of the GeoJSON file
+        """
+        return read_metadata_file(self.get_envelopes_file(layer_name), _load_array)
 
-    def get_bbox(self, layer_name):
-        filename = self.get_bbox_file(layer_name)
-        if not os.path.exists(filename):
-            return None
+    def get_offsets(self, layer_name):
+        """Return the positions of the features in the GeoJSON file, as a
+        memory-mapped array of (start, end) rows
+        """
+        return read_metadata_file(self.get_offsets_file(layer_name), _load_array)
 
-        with open(filename, "r") as f:
-            return json.load(f)
+    def get_bbox(self, layer_name):
+        return read_metadata_file(self.get_bbox_file(layer_name), _load_json)
 
 
 class VectorStorage(BaseVectorStorage):
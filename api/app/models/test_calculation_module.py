@@ -1,7 +1,10 @@
+import json
 import logging
-from unittest.mock import patch
+import time
+from unittest.mock import Mock, patch
 
 from app.common.test import BaseApiTest
+from app.models import calculation_module
 from app.models.calculation_module import from_registration_string, list_cms
 
 CM_STRING_NO_INFO = "[CMName]"
@@ -11,6 +14,10 @@ CM_STRING1 = 'CM Name [cm_info={"doc": "doc"}]'
 
 
 class TestCMS(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        calculation_module._cms_cache = None
+
     @patch("kombu.utils.functional.sleep", return_value=None)
     def testListCMTimeout(self, _):
         """Test that a non reachable redis will
@@ -38,3 +45,51 @@ class TestCMS(BaseApiTest):
         """Test a valid cm info parsing."""
         cm = from_registration_string(CM_STRING0)
         self.assertEqual(cm.__doc__, "doc")
+
+
+class TestCMRegistry(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        calculation_module._cms_cache = None
+
+    @staticmethod
+    def makeEntry(registration_string, expires_at):
+        return json.dumps(
+            {"registration": registration_string, "expires_at": expires_at}
+        ).encode()
+
+    @patch("app.models.calculation_module.get_registry_client")
+    def testListCMs(self, get_client):
+        get_client.return_value = Mock()
+        get_client.return_value.hgetall.return_value = {
+            b"CMName": self.makeEntry(CM_STRING0, time.time() + 60),
+            b"Expired": self.makeEntry(CM_STRING1, time.time() - 60),
+        }
+
+        cms = list_cms()
+        self.assertEqual(list(cms.keys()), ["CMName"])
+
+    @patch("app.models.calculation_module.get_registry_client")
+    def testInvalidEntry(self, get_client):
+        get_client.return_value = Mock()
+        get_client.return_value.hgetall.return_value = {
+            b"CMName": self.makeEntry(CM_STRING0, time.time() + 60),
+            b"Invalid": self.makeEntry(CM_STRING_NO_INFO, time.time() + 60),
+        }
+
+        with self.assertLogs(level=logging.ERROR):
+            cms = list_cms()
+        self.assertEqual(list(cms.keys()), ["CMName"])
+
+    @patch("app.models.calculation_module.get_registry_client")
+    def testCache(self, get_client):
+        get_client.return_value = Mock()
+        get_client.return_value.hgetall.return_value = {
+            b"CMName": self.makeEntry(CM_STRING0, time.time() + 60),
+        }
+
+        list_cms()
+        cms = list_cms()
+
+        self.assertEqual(list(cms.keys()), ["CMName"])
+        self.assertEqual(get_client.return_value.hgetall.call_count, 1)
@@ -1,13 +1,17 @@
 import copy
 import json
+import math
 import os
 import shutil
+from unittest.mock import patch
 
 import mapnik
+import numpy as np
 
 from app.common import path
 from app.common.projection import epsg_string_to_proj4
 from app.common.test import BaseApiTest
+from app.models.wms.utils import Size
 
 from . import geofile, storage
 
@@ -107,6 +111,9 @@ class TestSaveVectorGeoJSON(BaseApiTest):
             self.assertTrue(
                 os.path.exists(f"{self.wms_cache_dir}/vectors/42/data.geojson")
             )
+            self.assertTrue(
+                os.path.exists(f"{self.wms_cache_dir}/vectors/42/data.gpkg")
+            )
             self.assertTrue(
                 os.path.exists(f"{self.wms_cache_dir}/vectors/42/projection.txt")
             )
@@ -134,6 +141,65 @@ class TestSaveVectorGeoJSON(BaseApiTest):
             self.assertTrue("__variable__var2" in geojson["features"][0]["properties"])
             self.assertTrue("__variable__var3" in geojson["features"][0]["properties"])
 
+    def testFeaturesIterator(self):
+        with self.flask_app.app_context():
+            layer_name = "vector/42"
+
+            features = copy.deepcopy(TestSaveVectorGeoJSON.GEOJSON["features"])
+
+            valid_variables = geofile.save_vector_features(
+                layer_name, (feature for feature in features)
+            )
+            self.assertEqual(valid_variables, ["var1", "var2"])
+
+            with open(f"{self.wms_cache_dir}/vectors/42/data.geojson", "r") as f:
+                geojson = json.load(f)
+
+            self.assertEqual(geojson["type"], "FeatureCollection")
+            self.assertEqual(len(geojson["features"]), 1)
+
+    def testReplace(self):
+        with self.flask_app.app_context():
+            layer_name = "vector/42"
+
+            geofile.save_vector_geojson(
+                layer_name, copy.deepcopy(TestSaveVectorGeoJSON.GEOJSON)
+            )
+
+            features = copy.deepcopy(TestSaveVectorGeoJSON.GEOJSON["features"])
+            features[0]["properties"]["variables"] = {"var4": 10}
+
+            valid_variables = geofile.save_vector_features(
+                layer_name, features, replace=True
+            )
+            self.assertEqual(valid_variables, ["var4"])
+
+            with open(f"{self.wms_cache_dir}/vectors/42/variables.json", "r") as f:
+                self.assertEqual(json.load(f), ["var4"])
+
+    def testGeoPackageFile(self):
+        with self.flask_app.app_context():
+            layer_name = "vector/42"
+
+            geofile.save_vector_geojson(
+                layer_name, copy.deepcopy(TestSaveVectorGeoJSON.GEOJSON)
+            )
+
+            layer = geofile.load(layer_name)
+            data = layer.get_data_for_bounding_box(None, None)
+            self.assertEqual(data, [f"{self.wms_cache_dir}/vectors/42/data.gpkg"])
+
+            mapnik_layers = layer.as_mapnik_layers(data)
+            self.assertEqual(len(mapnik_layers), 1)
+
+            fields = mapnik_layers[0].datasource.fields()
+            self.assertTrue("__variable__var1" in fields)
+            self.assertTrue("__variable__var2" in fields)
+
+            features = list(mapnik_layers[0].datasource.all_features())
+            self.assertEqual(len(features), 1)
+            self.assertEqual(features[0]["__variable__var1"], 1000)
+
     def testVariablesFile(self):
         with self.flask_app.app_context():
             layer_name = "vector/42"
@@ -172,6 +238,166 @@ class TestSaveVectorGeoJSON(BaseApiTest):
             self.assertAlmostEqual(bbox["bottom"], 46.0)
             self.assertAlmostEqual(bbox["top"], 46.0)
 
+    def testEnvelopesFile(self):
+        with self.flask_app.app_context():
+            layer_name = "vector/42"
+
+            geofile.save_vector_geojson(
+                layer_name, copy.deepcopy(TestSaveVectorGeoJSON.GEOJSON)
+            )
+
+            envelopes = np.load(f"{self.wms_cache_dir}/vectors/42/envelopes.npy")
+            self.assertEqual(envelopes.shape, (1, 4))
+            self.assertEqual(list(envelopes[0]), [7.4, 46.0, 7.4, 46.0])
+
+    def testOffsetsFile(self):
+        with self.flask_app.app_context():
+            layer_name = "vector/42"
+
+            geofile.save_vector_geojson(
+                layer_name, copy.deepcopy(TestSaveVectorGeoJSON.GEOJSON)
+            )
+
+            offsets = np.load(f"{self.wms_cache_dir}/vectors/42/offsets.npy")
+            self.assertEqual(offsets.shape, (1, 2))
+
+            with open(f"{self.wms_cache_dir}/vectors/42/data.geojson", "rb") as f:
+                content = f.read()
+
+            feature = json.loads(content[offsets[0, 0] : offsets[0, 1]])
+            self.assertEqual(feature, json.loads(content)["features"][0])
+
+    def testGeometryEnvelope(self):
+        polygon = {
+            "type": "MultiPolygon",
+            "coordinates": [
+                [[[0, 0], [2, 0], [2, 3], [0, 0]], [[1, 1], [1, 2], [1.5, 1], [1, 1]]],
+                [[[-1, 1], [1, 2], [1, 1], [-1, 1]]],
+            ],
+        }
+
+        self.assertEqual(geofile.compute_geometry_envelope(polygon), (-1, 0, 2, 3))
+        self.assertTrue(np.isnan(geofile.compute_geometry_envelope(None)).all())
+
+
+class TestFeaturesInBox(BaseApiTest):
+    GEOJSON = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "id": f"FEATURE_{index}",
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [
+                        [
+                            [minx, miny],
+                            [minx, miny + 1.0],
+                            [minx + 1.0, miny + 1.0],
+                            [minx + 1.0, miny],
+                            [minx, miny],
+                        ]
+                    ],
+                },
+                "properties": {
+                    "units": {"var1": "MW"},
+                    "fields": {"field1": f"value{index}"},
+                    "legend": {"symbology": []},
+                    "start_at": None,
+                    "variables": {"var1": 1000 * index},
+                },
+            }
+            for index, (minx, miny) in enumerate([(7.0, 45.5), (9.0, 45.0)])
+        ],
+    }
+
+    def getBox(self, lon, lat):
+        """Return a small box around a location, in EPSG:3857"""
+        x = lon * 20037508.34 / 180.0
+        y = math.log(math.tan((90.0 + lat) * math.pi / 360.0)) * 6378137.0
+        return mapnik.Box2d(x - 10.0, y - 10.0, x + 10.0, y + 10.0)
+
+    def testFeatureFound(self):
+        with self.flask_app.app_context():
+            layer_name = "vector/42"
+
+            geofile.save_vector_geojson(
+                layer_name, copy.deepcopy(TestFeaturesInBox.GEOJSON)
+            )
+
+            layer = geofile.load(layer_name)
+            features = layer.get_features_in_box(self.getBox(7.4, 46.0), "epsg:3857")
+
+            self.assertEqual(len(features), 1)
+            self.assertEqual(features[0]["geometry"]["type"], "Polygon")
+            self.assertEqual(features[0]["properties"]["__variable__var1"], 0)
+            self.assertEqual(
+                json.loads(features[0]["properties"]["fields"]), {"field1": "value0"}
+            )
+
+    def testFeaturePayload(self):
+        with self.flask_app.app_context():
+            layer_name = "vector/42"
+
+            geofile.save_vector_geojson(
+                layer_name, copy.deepcopy(TestFeaturesInBox.GEOJSON)
+            )
+
+            layer = geofile.load(layer_name)
+            features = layer.get_features_in_box(self.getBox(9.5, 45.5), "epsg:3857")
+
+            expected = copy.deepcopy(TestFeaturesInBox.GEOJSON["features"][1])
+            expected["properties"] = {
+                "units": '{"var1": "MW"}',
+                "fields": '{"field1": "value1"}',
+                "variables": '{"var1": 1000}',
+                "__variable__var1": 1000,
+            }
+
+            self.assertEqual(features, [expected])
+            self.assertTrue(
+                isinstance(features[0]["properties"]["__variable__var1"], int)
+            )
+
+    def testWithoutOffsets(self):
+        with self.flask_app.app_context():
+            layer_name = "vector/42"
+
+            geofile.save_vector_geojson(
+                layer_name, copy.deepcopy(TestFeaturesInBox.GEOJSON)
+            )
+
+            # Layer saved before the positions of the features were stored
+            layer = geofile.load(layer_name)
+            os.remove(layer.storage.get_offsets_file(layer_name))
+
+            features = layer.get_features_in_box(self.getBox(9.5, 45.5), "epsg:3857")
+
+            self.assertEqual(len(features), 1)
+            self.assertEqual(features[0]["id"], "FEATURE_1")
+            self.assertEqual(features[0]["geometry"]["type"], "Polygon")
+
+    def testNoFeatureFound(self):
+        with self.flask_app.app_context():
+            layer_name = "vector/42"
+
+            geofile.save_vector_geojson(
+                layer_name, copy.deepcopy(TestFeaturesInBox.GEOJSON)
+            )
+
+            # Between the two features
+            layer = geofile.load(layer_name)
+            features = layer.get_features_in_box(self.getBox(8.5, 46.2), "epsg:3857")
+
+            self.assertEqual(features, [])
+
+    def testNoData(self):
+        with self.flask_app.app_context():
+            layer = geofile.load("vector/42")
+            features = layer.get_features_in_box(self.getBox(7.4, 46.0), "epsg:3857")
+
+            self.assertTrue(features is None)
+
 
 class TestSaveRasterProjection(BaseApiTest):
     def testFileCreation(self):
@@ -283,6 +509,13 @@ class TestSaveRasterGeometries(BaseApiTest):
             self.assertAlmostEqual(bbox["bottom"], 30)
             self.assertAlmostEqual(bbox["top"], 40)
 
+            filename = f"{self.wms_cache_dir}/rasters/{folder}/envelopes.npy"
+            self.assertTrue(os.path.exists(filename))
+
+            envelopes = np.load(filename)
+            self.assertEqual(envelopes.shape, (1, 4))
+            self.assertEqual(list(envelopes[0]), [10, 30, 20, 40])
+
     def testFailureNoFeatures(self):
         with self.flask_app.app_context():
             layer_name = path.make_unique_layer_name(
@@ -413,6 +646,121 @@ class TestSaveRasterGeometries(BaseApiTest):
             self.assertAlmostEqual(bbox["top"], 64.20132131770235)
 
 
+class TestSaveRasterOverview(BaseApiTest):
+    RASTERS = [
+        {
+            "fid": "FID1.tif",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [-10, 30],
+                        [40, 30],
+                        [40, 70],
+                        [-10, 70],
+                        [-10, 30],
+                    ],
+                ],
+            },
+        },
+    ]
+
+    def setupLayer(self, layer_name):
+        with open(self.get_testdata_path("hotmaps-cdd_curr_adapted.tif"), "rb") as f:
+            geofile.save_raster_file(layer_name, "FID1.tif", f.read())
+
+        geofile.save_raster_projection(layer_name, epsg_string_to_proj4("EPSG:3035"))
+        geofile.save_raster_geometries(
+            layer_name, copy.deepcopy(TestSaveRasterOverview.RASTERS)
+        )
+
+    @patch("app.models.geofile.OVERVIEW_MIN_SIZE", new=16)
+    def testSuccess(self):
+        with self.flask_app.app_context():
+            layer_name = "raster/42"
+            self.setupLayer(layer_name)
+
+            self.assertTrue(geofile.save_raster_overview(layer_name))
+
+            storage_instance = storage.create(layer_name)
+            self.assertTrue(
+                os.path.exists(storage_instance.get_overview_file(layer_name))
+            )
+
+            metadata = storage_instance.get_overview_metadata(layer_name)
+            self.assertEqual(len(metadata["resolution"]), 2)
+            self.assertGreater(metadata["resolution"][0], 7270.0 * 7)
+
+    @patch("app.models.geofile.OVERVIEW_MIN_SIZE", new=16)
+    def testResolutionSelection(self):
+        with self.flask_app.app_context():
+            layer_name = "raster/42"
+            self.setupLayer(layer_name)
+            geofile.save_raster_overview(layer_name)
+
+            layer = geofile.load(layer_name)
+
+            # Zoomed-out view: the overview is detailed enough
+            bbox = mapnik.Box2d(-2000000, 3000000, 6000000, 11000000)
+            data = layer.get_data_for_bounding_box(bbox, "epsg:3857", Size(64, 64))
+            self.assertEqual(len(data), 1)
+            self.assertEqual(data[0][0], storage.BaseRasterStorage.OVERVIEW_FILENAME)
+
+            # Zoomed-in view: the original files must be used
+            bbox = mapnik.Box2d(1000000, 6000000, 1000000 + 20000.0, 6000000 + 20000.0)
+            data = layer.get_data_for_bounding_box(bbox, "epsg:3857", Size(256, 256))
+            self.assertEqual(
+                [x[0] for x in data],
+                ["FID1.tif"],
+            )
+
+            # Size unknown
+            bbox = mapnik.Box2d(-2000000, 3000000, 6000000, 11000000)
+            data = layer.get_data_for_bounding_box(bbox, "epsg:3857")
+            self.assertEqual(
+                [x[0] for x in data],
+                ["FID1.tif"],
+            )
+
+    def testSmallLayer(self):
+        with self.flask_app.app_context():
+            layer_name = "raster/42"
+            self.setupLayer(layer_name)
+
+            self.assertFalse(geofile.save_raster_overview(layer_name))
+
+            storage_instance = storage.create(layer_name)
+            self.assertTrue(storage_instance.get_overview_metadata(layer_name) is None)
+
+    def testRebuildSmallLayer(self):
+        with self.flask_app.app_context():
+            layer_name = "raster/42"
+            self.setupLayer(layer_name)
+
+            with patch("app.models.geofile.OVERVIEW_MIN_SIZE", new=16):
+                self.assertTrue(geofile.save_raster_overview(layer_name))
+
+            # The new content of the layer is too small for an overview: the
+            # previous one must not be used anymore
+            self.setupLayer(layer_name)
+            self.assertFalse(geofile.save_raster_overview(layer_name))
+
+            storage_instance = storage.create(layer_name)
+            self.assertTrue(storage_instance.get_overview_metadata(layer_name) is None)
+            self.assertFalse(
+                os.path.exists(storage_instance.get_overview_file(layer_name))
+            )
+
+            layer = geofile.load(layer_name)
+
+            bbox = mapnik.Box2d(-2000000, 3000000, 6000000, 11000000)
+            data = layer.get_data_for_bounding_box(bbox, "epsg:3857", Size(64, 64))
+            self.assertEqual(
+                [x[0] for x in data],
+                ["FID1.tif"],
+            )
+
+
 class TestSaveRasterFile(BaseApiTest):
     def testSimple(self):
         with self.flask_app.app_context():
@@ -851,6 +1199,19 @@ class TestRasterLayerIntersections(
             self.assertEqual(len(rasters), 0)
 
 
+class TestRasterLayerIntersectionsWithEnvelopes(TestRasterLayerIntersections):
+    def createGeometryFile(self, filename):
+        super().createGeometryFile(filename)
+
+        with open(filename, "r") as f:
+            geometries = json.load(f)
+
+        np.save(
+            filename.replace("geometries.json", "envelopes.npy"),
+            geofile.compute_envelopes(geometries),
+        )
+
+
 class TestRasterLayerDataAndMapnikBase(BaseApiTest):
     def setUp(self):
         super().setUp()
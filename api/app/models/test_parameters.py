@@ -0,0 +1,81 @@
+import os
+import time
+from unittest.mock import Mock
+
+from app.common.test import BaseApiTest
+
+from . import parameters
+
+
+class TestParametersCache(BaseApiTest):
+
+    PARAMETERS = {
+        "variables": ["var1"],
+        "time_periods": [],
+    }
+
+    def testFetchOnce(self):
+        with self.flask_app.app_context():
+            fetch = Mock(return_value=TestParametersCache.PARAMETERS)
+
+            self.assertEqual(parameters.get(1, fetch), TestParametersCache.PARAMETERS)
+            self.assertEqual(parameters.get(1, fetch), TestParametersCache.PARAMETERS)
+            self.assertEqual(fetch.call_count, 1)
+
+    def testCopies(self):
+        with self.flask_app.app_context():
+            fetch = Mock(return_value=TestParametersCache.PARAMETERS)
+
+            parameters.get(1, fetch)
+            parameters.get(1, fetch)["variables"].append("var2")
+
+            self.assertEqual(parameters.get(1, fetch)["variables"], ["var1"])
+
+    def testExpired(self):
+        with self.flask_app.app_context():
+            fetch = Mock(return_value=TestParametersCache.PARAMETERS)
+
+            parameters.get(1, fetch)
+
+            expired = time.time() - 2 * self.flask_app.config["PARAMETERS_CACHE_TTL"]
+            os.utime(parameters.get_file(1), (expired, expired))
+
+            parameters.get(1, fetch)
+            self.assertEqual(fetch.call_count, 2)
+
+    def testFailureNotCached(self):
+        with self.flask_app.app_context():
+            fetch = Mock(return_value=None)
+
+            self.assertTrue(parameters.get(1, fetch) is None)
+            self.assertTrue(parameters.get(1, fetch) is None)
+            self.assertEqual(fetch.call_count, 2)
+
+    def testInvalidate(self):
+        with self.flask_app.app_context():
+            fetch = Mock(return_value=TestParametersCache.PARAMETERS)
+
+            parameters.get(1, fetch)
+            parameters.get(2, fetch)
+
+            parameters.invalidate(1)
+            parameters.get(1, fetch)
+            parameters.get(2, fetch)
+            self.assertEqual(fetch.call_count, 3)
+
+            parameters.invalidate_all()
+            parameters.get(1, fetch)
+            parameters.get(2, fetch)
+            self.assertEqual(fetch.call_count, 5)
+
+    def testDisabled(self):
+        self.flask_app.config["PARAMETERS_CACHE_TTL"] = 0
+
+        with self.flask_app.app_context():
+            fetch = Mock(return_value=TestParametersCache.PARAMETERS)
+
+            parameters.get(1, fetch)
+            parameters.get(1, fetch)
+            self.assertEqual(fetch.call_count, 2)
+
+        self.flask_app.config["PARAMETERS_CACHE_TTL"] = 300
@@ -1,9 +1,11 @@
+import importlib.util
 import io
 import json
 import os
 import shutil
 import tempfile
 import zipfile
+from datetime import datetime, timedelta
 from pathlib import Path
 
 from app.common import path
@@ -486,44 +488,67 @@ class TestCMStorage(BaseApiTest):
             self.assertTrue("subfolder2/FID3.tif" in features)
             self.assertTrue("subfolder2/FID4.tif" in features)
 
-    def testAsZip(self):
+    def setupTaskFiles(self, storage_instance, layer_name):
+        os.makedirs(storage_instance.get_dir(layer_name))
+        os.makedirs(storage_instance.get_file_path(layer_name, "subfolder"))
+
+        with open(storage_instance.get_file_path(layer_name, "data.prj"), "w") as f:
+            f.write("PROJECTION")
+
+        with open(
+            storage_instance.get_file_path(layer_name, "parameters.json"), "w"
+        ) as f:
+            f.write("PARAMETERS")
+
+        with open(
+            storage_instance.get_file_path(layer_name, "subfolder/result.json"), "w"
+        ) as f:
+            f.write("RESULT")
+
+        shutil.copy(
+            self.get_testdata_path("hotmaps-cdd_curr_adapted.tif"),
+            storage_instance.get_file_path(layer_name, "data.tif"),
+        )
+
+    def testListFiles(self):
         with self.flask_app.app_context():
             storage_instance = storage.CMStorage()
             layer_name = "cm/some_name/01234567-0000-0000-0000-000000000000"
 
-            os.makedirs(storage_instance.get_dir(layer_name))
+            self.assertEqual(storage_instance.list_files(layer_name), [])
 
-            with open(storage_instance.get_file_path(layer_name, "data.prj"), "w") as f:
-                f.write("PROJECTION")
+            self.setupTaskFiles(storage_instance, layer_name)
 
-            with open(
-                storage_instance.get_file_path(layer_name, "parameters.json"), "w"
-            ) as f:
-                f.write("PARAMETERS")
+            self.assertEqual(
+                storage_instance.list_files(layer_name),
+                ["data.prj", "data.tif", "parameters.json", "subfolder/result.json"],
+            )
 
-            with open(
-                storage_instance.get_file_path(layer_name, "result.json"), "w"
-            ) as f:
-                f.write("RESULT")
+    def testIterZip(self):
+        with self.flask_app.app_context():
+            storage_instance = storage.CMStorage()
+            layer_name = "cm/some_name/01234567-0000-0000-0000-000000000000"
 
-            raster_filename = self.get_testdata_path("hotmaps-cdd_curr_adapted.tif")
+            self.setupTaskFiles(storage_instance, layer_name)
 
-            shutil.copy(
-                raster_filename, storage_instance.get_file_path(layer_name, "data.tif")
+            filenames = storage_instance.list_files(layer_name)
+            self.assertTrue(
+                storage_instance.get_cached_zip_file(layer_name, filenames) is None
             )
 
-            content = storage_instance.as_zip(layer_name)
-
-            self.assertTrue(content is not None)
-            self.assertTrue(isinstance(content, io.BytesIO))
+            content = io.BytesIO(
+                b"".join(storage_instance.iter_zip(layer_name, filenames))
+            )
 
             with zipfile.ZipFile(content, "r") as zip_file:
-                filenames = zip_file.namelist()
-                self.assertEqual(len(filenames), 4)
-                self.assertTrue("data.prj" in filenames)
-                self.assertTrue("parameters.json" in filenames)
-                self.assertTrue("result.json" in filenames)
-                self.assertTrue("data.tif" in filenames)
+                self.assertEqual(zip_file.namelist(), filenames)
+
+                self.assertEqual(
+                    zip_file.getinfo("data.tif").compress_type, zipfile.ZIP_STORED
+                )
+                self.assertEqual(
+                    zip_file.getinfo("data.prj").compress_type, zipfile.ZIP_DEFLATED
+                )
 
                 with zip_file.open("data.prj", "r") as f:
                     self.assertEqual(f.read(), b"PROJECTION")
@@ -531,32 +556,97 @@ class TestCMStorage(BaseApiTest):
                 with zip_file.open("parameters.json", "r") as f:
                     self.assertEqual(f.read(), b"PARAMETERS")
 
-                with zip_file.open("result.json", "r") as f:
+                with zip_file.open("subfolder/result.json", "r") as f:
                     self.assertEqual(f.read(), b"RESULT")
 
                 with zip_file.open("data.tif", "r") as f:
+                    raster_filename = self.get_testdata_path(
+                        "hotmaps-cdd_curr_adapted.tif"
+                    )
                     with open(raster_filename, "rb") as f2:
                         self.assertEqual(f.read(), f2.read())
 
-    def testAsZipWithNotExistingDirectory(self):
+            zip_filename = storage_instance.get_cached_zip_file(layer_name, filenames)
+            self.assertEqual(zip_filename, storage_instance.get_zip_file(layer_name))
+
+            with open(zip_filename, "rb") as f:
+                self.assertEqual(f.read(), content.getvalue())
+
+    def testIterZipInterrupted(self):
         with self.flask_app.app_context():
             storage_instance = storage.CMStorage()
             layer_name = "cm/some_name/01234567-0000-0000-0000-000000000000"
 
-            os.makedirs(storage_instance.get_dir(layer_name))
+            self.setupTaskFiles(storage_instance, layer_name)
+
+            filenames = storage_instance.list_files(layer_name)
 
-            content = storage_instance.as_zip(layer_name)
+            generator = storage_instance.iter_zip(layer_name, filenames)
+            next(generator)
+            generator.close()
 
-            self.assertTrue(content is None)
+            self.assertTrue(
+                storage_instance.get_cached_zip_file(layer_name, filenames) is None
+            )
+            self.assertEqual(os.listdir(storage_instance.get_tmp_dir()), [])
 
-    def testAsZipWithEmptyDirectory(self):
+    def testCachedZipFileOutdated(self):
         with self.flask_app.app_context():
             storage_instance = storage.CMStorage()
             layer_name = "cm/some_name/01234567-0000-0000-0000-000000000000"
 
-            content = storage_instance.as_zip(layer_name)
+            self.setupTaskFiles(storage_instance, layer_name)
+
+            filenames = storage_instance.list_files(layer_name)
+            for _ in storage_instance.iter_zip(layer_name, filenames):
+                pass
+
+            outdated = os.path.getmtime(storage_instance.get_zip_file(layer_name)) - 10
+            os.utime(storage_instance.get_zip_file(layer_name), (outdated, outdated))
+
+            self.assertTrue(
+                storage_instance.get_cached_zip_file(layer_name, filenames) is None
+            )
+
+    def testCleanCMOutputs(self):
+        script_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "../../scripts/clean_cm_outputs.py",
+        )
+        spec = importlib.util.spec_from_file_location("clean_cm_outputs", script_path)
+        clean_cm_outputs = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(clean_cm_outputs)
+
+        with self.flask_app.app_context():
+            storage_instance = storage.CMStorage()
+            old_layer_name = "cm/some_name/01234567-0000-0000-0000-000000000000"
+            recent_layer_name = "cm/some_name/01234567-1111-0000-0000-000000000000"
 
-            self.assertTrue(content is None)
+            self.setupTaskFiles(storage_instance, old_layer_name)
+            self.setupTaskFiles(storage_instance, recent_layer_name)
+
+            filenames = storage_instance.list_files(old_layer_name)
+            for _ in storage_instance.iter_zip(old_layer_name, filenames):
+                pass
+
+            # The cached archive isn't one of the outputs of the task
+            self.assertEqual(storage_instance.list_files(old_layer_name), filenames)
+
+            now = datetime.utcnow()
+            for root, _, files in os.walk(storage_instance.get_dir(old_layer_name)):
+                for filename in files:
+                    os.utime(os.path.join(root, filename), (0, 0))
+
+            clean_cm_outputs.clean(self.cm_outputs_dir, now, timedelta(hours=1))
+
+            self.assertFalse(os.path.exists(storage_instance.get_dir(old_layer_name)))
+            self.assertFalse(
+                os.path.exists(storage_instance.get_zip_file(old_layer_name))
+            )
+            self.assertEqual(
+                storage_instance.list_files(recent_layer_name),
+                ["data.prj", "data.tif", "parameters.json", "subfolder/result.json"],
+            )
 
 
 class TestVectorStorage(BaseApiTest):
@@ -753,3 +843,78 @@ class TestAreaStorage(BaseApiTest):
                 storage_instance.get_geojson_file("area/NUTS42"),
                 f"{self.wms_cache_dir}/areas/NUTS42/data.geojson",
             )
+
+
+class TestMetadataCache(BaseApiTest):
+
+    BBOX = {
+        "left": 10,
+        "right": 20,
+        "bottom": 30,
+        "top": 40,
+    }
+
+    def setUp(self):
+        super().setUp()
+
+        with self.flask_app.app_context():
+            storage_instance = storage.RasterStorage()
+            os.makedirs(storage_instance.get_dir("raster/10"))
+
+            self.filename = storage_instance.get_bbox_file("raster/10")
+            self.writeFile(self.filename, TestMetadataCache.BBOX)
+
+    def writeFile(self, filename, data):
+        with tempfile.NamedTemporaryFile(
+            "w", dir=os.path.dirname(filename), delete=False
+        ) as f:
+            json.dump(data, f)
+
+        os.replace(f.name, filename)
+
+    def testReuseContent(self):
+        with self.flask_app.app_context():
+            storage_instance = storage.RasterStorage()
+
+            bbox1 = storage_instance.get_bbox("raster/10")
+            bbox2 = storage_instance.get_bbox("raster/10")
+
+            self.assertEqual(bbox1, TestMetadataCache.BBOX)
+            self.assertTrue(bbox1 is bbox2)
+
+    def testReplacedFile(self):
+        with self.flask_app.app_context():
+            storage_instance = storage.RasterStorage()
+
+            storage_instance.get_bbox("raster/10")
+
+            bbox = dict(TestMetadataCache.BBOX)
+            bbox["left"] = 0
+            self.writeFile(self.filename, bbox)
+
+            self.assertEqual(storage_instance.get_bbox("raster/10"), bbox)
+
+    def testDeletedFile(self):
+        with self.flask_app.app_context():
+            storage_instance = storage.RasterStorage()
+
+            storage_instance.get_bbox("raster/10")
+            os.remove(self.filename)
+
+            self.assertTrue(storage_instance.get_bbox("raster/10") is None)
+
+    def testMaximumSize(self):
+        self.flask_app.config["METADATA_CACHE_SIZE"] = 2
+
+        with self.flask_app.app_context():
+            storage_instance = storage.RasterStorage()
+
+            for id in range(11, 15):
+                layer_name = f"raster/{id}"
+                os.makedirs(storage_instance.get_dir(layer_name))
+                self.writeFile(
+                    storage_instance.get_bbox_file(layer_name), TestMetadataCache.BBOX
+                )
+                storage_instance.get_bbox(layer_name)
+
+            self.assertLessEqual(len(storage._metadata_cache), 2)
@@ -0,0 +1,113 @@
+import os
+
+from app.common import path
+from app.common.test import BaseApiTest
+
+from . import tiles
+
+
+class TestTiles(BaseApiTest):
+
+    PARAMETERS = {
+        "service": "WMS",
+        "request": "GetMap",
+        "layers": "raster/42",
+        "styles": "",
+        "format": "image/png",
+        "transparent": "true",
+        "version": "1.1.1",
+        "width": "256",
+        "height": "256",
+        "srs": "EPSG:3857",
+        "bbox": "0,0,10,10",
+    }
+
+    CONTENT = b"image content"
+
+    def setUp(self):
+        super().setUp()
+        tiles._memory_cache.clear()
+
+    def testNotFound(self):
+        with self.flask_app.app_context():
+            self.assertTrue(tiles.get(self.PARAMETERS) is None)
+
+    def testSaveAndGet(self):
+        with self.flask_app.app_context():
+            tiles.save(self.PARAMETERS, self.CONTENT)
+            self.assertEqual(tiles.get(self.PARAMETERS), self.CONTENT)
+
+    def testGetFromDisk(self):
+        with self.flask_app.app_context():
+            tiles.save(self.PARAMETERS, self.CONTENT)
+            tiles._memory_cache.clear()
+            self.assertEqual(tiles.get(self.PARAMETERS), self.CONTENT)
+
+    def testDifferentBoundingBox(self):
+        with self.flask_app.app_context():
+            tiles.save(self.PARAMETERS, self.CONTENT)
+
+            parameters = dict(self.PARAMETERS)
+            parameters["bbox"] = "0,0,20,20"
+            self.assertTrue(tiles.get(parameters) is None)
+
+    def testInvalidate(self):
+        with self.flask_app.app_context():
+            tiles.save(self.PARAMETERS, self.CONTENT)
+            version = tiles.get_layer_version("raster/42")
+
+            tiles.invalidate("raster/42")
+
+            self.assertNotEqual(tiles.get_layer_version("raster/42"), version)
+            self.assertTrue(tiles.get(self.PARAMETERS) is None)
+            self.assertFalse(
+                os.path.exists(os.path.join(tiles.get_layer_dir("raster/42"), version))
+            )
+
+    def testInvalidateOtherLayer(self):
+        with self.flask_app.app_context():
+            parameters = dict(self.PARAMETERS)
+            parameters["layers"] = "raster/42,area/NUTS3"
+
+            tiles.save(parameters, self.CONTENT)
+            folder, _ = tiles.get_key(parameters)
+            self.assertTrue(os.path.exists(folder))
+
+            tiles.invalidate("area/NUTS3")
+
+            self.assertTrue(tiles.get(parameters) is None)
+            self.assertFalse(os.path.exists(folder))
+
+    def testInvalidateFirstLayer(self):
+        with self.flask_app.app_context():
+            parameters = dict(self.PARAMETERS)
+            parameters["layers"] = "raster/42,area/NUTS3"
+
+            tiles.save(parameters, self.CONTENT)
+            tiles.save(self.PARAMETERS, self.CONTENT)
+            folder, _ = tiles.get_key(parameters)
+
+            tiles.invalidate("raster/42")
+
+            self.assertTrue(tiles.get(parameters) is None)
+            self.assertTrue(tiles.get(self.PARAMETERS) is None)
+            self.assertFalse(os.path.exists(folder))
+
+    def testCMNotCached(self):
+        with self.flask_app.app_context():
+            parameters = dict(self.PARAMETERS)
+            parameters["layers"] = path.make_unique_layer_name(
+                path.CM, "cm", task_id="1234"
+            )
+
+            tiles.save(parameters, self.CONTENT)
+            self.assertTrue(tiles.get(parameters) is None)
+
+    def testDisabled(self):
+        self.flask_app.config["WMS"]["GETMAP"]["CACHE"] = False
+
+        with self.flask_app.app_context():
+            tiles.save(self.PARAMETERS, self.CONTENT)
+            self.assertTrue(tiles.get(self.PARAMETERS) is None)
+
+        self.flask_app.config["WMS"]["GETMAP"]["CACHE"] = True
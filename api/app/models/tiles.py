@@ -0,0 +1,239 @@
+"""Cache of the images rendered by the "GetMap" operation of the WMS.
+
+The frontend keeps requesting the same tiles while panning around, so the
+rendered images are stored on disk (and in a small in-process LRU cache) and
+served directly when an identical request comes back.
+
+Each cached layer has a version token. Tiles of a single layer are stored
+under its current token, and tiles of several layers are stored in a folder
+derived from the tokens of all their layers, which is registered under the
+token of each of them. The key of a tile contains the tokens of all its layers.
+Invalidating a layer creates a new token, which makes all the tiles rendered
+from the previous content unreachable, and deletes the folder of the previous
+token along with the folders of the combinations it belongs to.
+
+Calculation module results aren't cached: their files are deleted when they
+aren't accessed anymore, which relies on the rendering touching them.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+from flask import current_app, safe_join
+
+from app.common import path
+from app.models.wms import utils
+
+VERSION_FILENAME = "version"
+DEFAULT_VERSION = "0"
+COMBINED_DIRNAME = "combined"
+
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+
+def is_enabled():
+    return current_app.config["WMS"]["GETMAP"]["CACHE"]
+
+
+def get_root_dir():
+    return safe_join(current_app.config["WMS_CACHE_DIR"], "tiles")
+
+
+def get_tmp_dir():
+    return safe_join(current_app.config["WMS_CACHE_DIR"], "tmp")
+
+
+def get_layer_dir(layer_name):
+    type = path.get_type(layer_name)
+    return safe_join(get_root_dir(), type, path.to_folder_path(layer_name))
+
+
+def get_combined_dir(layers, versions):
+    """Return the folder containing the images rendered from several layers"""
+    combination = hashlib.sha256(
+        "|".join([",".join(layers), ",".join(versions)]).encode()
+    ).hexdigest()
+    return safe_join(get_root_dir(), COMBINED_DIRNAME, combination)
+
+
+def get_layer_version(layer_name):
+    """Return the current version token of a layer"""
+    filename = safe_join(get_layer_dir(layer_name), VERSION_FILENAME)
+
+    try:
+        with open(filename, "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return DEFAULT_VERSION
+
+
+def get_key(normalized_args):
+    """Return the (folder, key) identifying the image corresponding to the
+    arguments of a GetMap request, or (None, None) if the request can't be
+    cached.
+    """
+    layers = utils.parse_layers(normalized_args)
+    if any(path.get_type(layer_name) == path.CM for layer_name in layers):
+        return (None, None)
+
+    size = utils.parse_size(normalized_args)
+    bbox = utils.parse_envelope(normalized_args)
+    bbox_projection = utils.parse_projection(normalized_args)
+    _, mime_format = utils.parse_format(normalized_args)
+
+    versions = [get_layer_version(layer_name) for layer_name in layers]
+
+    parts = [
+        get_root_dir(),
+        ",".join(layers),
+        ",".join(versions),
+        f"{bbox.minx!r},{bbox.miny!r},{bbox.maxx!r},{bbox.maxy!r}",
+        f"{size.width}x{size.height}",
+        bbox_projection,
+        mime_format,
+    ]
+
+    key = hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    if len(layers) == 1:
+        folder = safe_join(get_layer_dir(layers[0]), versions[0])
+    else:
+        folder = get_combined_dir(layers, versions)
+
+    return (folder, key)
+
+
+def get_tile_file(folder, key):
+    return safe_join(folder, key[:2], key)
+
+
+def get(normalized_args):
+    """Return the cached content of the image corresponding to the arguments of
+    a GetMap request, or None if not found.
+    """
+    if not is_enabled():
+        return None
+
+    folder, key = get_key(normalized_args)
+    if key is None:
+        return None
+
+    with _memory_cache_lock:
+        content = _memory_cache.get(key)
+        if content is not None:
+            _memory_cache.move_to_end(key)
+            return content
+
+    filename = get_tile_file(folder, key)
+
+    try:
+        with open(filename, "rb") as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+
+    _add_to_memory_cache(key, content)
+
+    return content
+
+
+def save(normalized_args, content):
+    """Store the content of the image corresponding to the arguments of a GetMap
+    request.
+    """
+    if not is_enabled():
+        return
+
+    folder, key = get_key(normalized_args)
+    if key is None:
+        return
+
+    _add_to_memory_cache(key, content)
+
+    filename = get_tile_file(folder, key)
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    os.makedirs(get_tmp_dir(), exist_ok=True)
+
+    layers = utils.parse_layers(normalized_args)
+    if len(layers) > 1:
+        # Register the folder under the version of each layer, so it is deleted
+        # when any of them is invalidated
+        combination = os.path.basename(folder)
+        for layer_name in layers:
+            combinations_dir = safe_join(
+                get_layer_dir(layer_name),
+                get_layer_version(layer_name),
+                COMBINED_DIRNAME,
+            )
+            os.makedirs(combinations_dir, exist_ok=True)
+            open(safe_join(combinations_dir, combination), "a").close()
+
+    with NamedTemporaryFile(dir=get_tmp_dir(), delete=False) as f:
+        f.write(content)
+
+    try:
+        os.replace(f.name, filename)
+    except OSError as e:
+        logging.error(f"Failed to store the tile in the cache: {repr(e)}")
+        os.remove(f.name)
+
+
+def invalidate(layer_name):
+    """Invalidate all the images rendered from the current content of a layer.
+    Must be called each time the files of the layer are modified.
+    """
+    layer_dir = get_layer_dir(layer_name)
+    previous_version = get_layer_version(layer_name)
+
+    os.makedirs(layer_dir, exist_ok=True)
+    os.makedirs(get_tmp_dir(), exist_ok=True)
+
+    with NamedTemporaryFile("w", dir=get_tmp_dir(), delete=False) as f:
+        f.write(uuid.uuid4().hex)
+
+    os.replace(f.name, safe_join(layer_dir, VERSION_FILENAME))
+
+    # Delete the images rendered from the previous version, including the ones
+    # rendered with other layers
+    folder = safe_join(layer_dir, previous_version)
+
+    combinations_dir = safe_join(folder, COMBINED_DIRNAME)
+    if os.path.exists(combinations_dir):
+        for combination in os.listdir(combinations_dir):
+            _delete_folder(safe_join(get_root_dir(), COMBINED_DIRNAME, combination))
+
+    _delete_folder(folder)
+
+
+def _delete_folder(folder):
+    if not os.path.exists(folder):
+        return
+
+    with TemporaryDirectory(prefix=get_tmp_dir()) as tmp_dir:
+        try:
+            os.replace(folder, tmp_dir)
+        except OSError:
+            # Already deleted by another process
+            return
+
+        shutil.rmtree(tmp_dir)
+
+
+def _add_to_memory_cache(key, content):
+    max_size = int(current_app.config["WMS"]["GETMAP"]["CACHE_MEMORY_SIZE"])
+    if max_size <= 0:
+        return
+
+    with _memory_cache_lock:
+        _memory_cache[key] = content
+        _memory_cache.move_to_end(key)
+
+        while len(_memory_cache) > max_size:
+            _memory_cache.popitem(last=False)
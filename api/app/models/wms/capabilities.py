@@ -1,10 +1,13 @@
 """Functions related to the "GetCapabilities" operation of the Web Map Service (WMS)"""
 
+import glob
+import hashlib
 import itertools
 import os
+from tempfile import NamedTemporaryFile
 
 import osr
-from flask import current_app, request
+from flask import current_app, request, safe_join
 from lxml import etree  # nosec
 
 import app.common.projection as project
@@ -16,7 +19,108 @@ from app.models import storage
 current_file_dir = os.path.dirname(os.path.abspath(__file__))
 
 
-def get_capabilities():
+def get_cached_capabilities(base_url):
+    """Return the xml description of the capabilities of the WMS endpoint located
+    at the base URL, along with its ETag, or (None, None).
+
+    If the public URL of the WMS endpoint is configured (WMS_BASE_URL), it is used
+    instead of the base URL of the request: the document is generated on the first
+    request, then stored in the cache folder and served as is until refresh() is
+    called. Otherwise, the document is generated for each request.
+    """
+    canonical_url = current_app.config["WMS_BASE_URL"]
+    if canonical_url is None:
+        document = get_capabilities(base_url)
+        if document is None:
+            return (None, None)
+
+        return (document, compute_etag(document))
+
+    filename = get_document_file()
+
+    entry = storage.read_metadata_file(filename, _load_document)
+    if entry is not None:
+        return entry
+
+    document = get_capabilities(canonical_url)
+    if document is None:
+        return (None, None)
+
+    save_document(document)
+
+    return (document, compute_etag(document))
+
+
+def refresh():
+    """Regenerate the cached document, and delete the ones generated with another
+    configuration. Must be called each time the cached datasets are updated.
+
+    The document is only replaced if its content changed, so its ETag stays valid
+    otherwise.
+    """
+    canonical_url = current_app.config["WMS_BASE_URL"]
+    filename = get_document_file() if canonical_url is not None else None
+
+    for other_filename in glob.glob(safe_join(get_capabilities_dir(), "*")):
+        if other_filename != filename:
+            os.remove(other_filename)
+
+    if canonical_url is None:
+        return
+
+    document = get_capabilities(canonical_url)
+    if document is None:
+        if os.path.exists(filename):
+            os.remove(filename)
+        return
+
+    if os.path.exists(filename):
+        with open(filename, "rb") as f:
+            if f.read() == document:
+                return
+
+    save_document(document)
+
+
+def get_capabilities_dir():
+    return safe_join(current_app.config["WMS_CACHE_DIR"], "capabilities")
+
+
+def get_document_file():
+    """Return the path of the file containing the document corresponding to the
+    current configuration of the WMS
+    """
+    key = "|".join(
+        [
+            current_app.config["WMS_BASE_URL"],
+            ",".join(current_app.config["WMS"]["ALLOWED_PROJECTIONS"]),
+            ",".join(current_app.config["WMS"]["GETMAP"]["ALLOWED_OUTPUTS"]),
+        ]
+    )
+
+    key = hashlib.sha256(key.encode()).hexdigest()
+
+    return safe_join(get_capabilities_dir(), f"{key}.xml")
+
+
+def save_document(document):
+    filename = get_document_file()
+    tmp_dir = safe_join(current_app.config["WMS_CACHE_DIR"], "tmp")
+
+    os.makedirs(get_capabilities_dir(), exist_ok=True)
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    with NamedTemporaryFile(dir=tmp_dir, delete=False) as f:
+        f.write(document)
+
+    os.replace(f.name, filename)
+
+
+def compute_etag(document):
+    return hashlib.sha256(document).hexdigest()
+
+
+def get_capabilities(base_url=None):
     """Return an xml description of the capabilities of the current WMS
     set of endpoints.
 
@@ -24,6 +128,9 @@ def get_capabilities():
     insert dynamic element from the list of layers and from the flask
     configuration.
     """
+    if base_url is None:
+        base_url = request.base_url
+
     with open(os.path.join(current_file_dir, "capabilities.xml"), "rb") as f:
         root = xml.etree_fromstring(f.read())
 
@@ -43,7 +150,7 @@ def get_capabilities():
     capabilities = root.findall("Capability//OnlineResource", root.nsmap)
     capabilities += root.findall("Service//OnlineResource", root.nsmap)
     for element in capabilities:
-        element.set("{http://www.w3.org/1999/xlink}href", request.base_url)
+        element.set("{http://www.w3.org/1999/xlink}href", base_url)
 
     get_map = root.find("Capability/Request/GetMap", root.nsmap)
     for get_map_format in current_app.config["WMS"]["GETMAP"]["ALLOWED_OUTPUTS"]:
@@ -225,3 +332,10 @@ def get_layer_capabilities(
         sublayer_node.append(bbox_node)
 
     parent_layer.append(sublayer_node)
+
+
+def _load_document(filename):
+    with open(filename, "rb") as f:
+        document = f.read()
+
+    return (document, compute_etag(document))
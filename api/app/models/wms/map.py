@@ -1,51 +1,194 @@
 """Functions related to the "GetMap" operation of the Web Map Service (WMS)"""
 
+import hashlib
+import json
 import os
 import shutil
+import threading
+import urllib
+from concurrent.futures import ThreadPoolExecutor
 
 import mapnik
 import seaborn as sns
+from flask import current_app
 
-from app.common import client, path
-from app.models import geofile
-from app.models.wms import utils
+from app.common import client, instrumentation, path
+from app.models import geofile, tiles
+from app.models.wms import pool, utils
 
+# Pool of threads used to render the layers of the GetMap requests in parallel
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
 
-def get_map_image(normalized_args):
-    size = utils.parse_size(normalized_args)
-    bbox = utils.parse_envelope(normalized_args)
-    bbox_projection = utils.parse_projection(normalized_args)
 
-    image = mapnik.Image(size.width, size.height)
+def get_map_image(normalized_args):
+    with instrumentation.span("parse_args"):
+        size = utils.parse_size(normalized_args)
+        bbox = utils.parse_envelope(normalized_args)
+        bbox_projection = utils.parse_projection(normalized_args)
+        layers = utils.parse_layers(normalized_args)
+
+    if len(layers) == 1:
+        image = mapnik.Image(size.width, size.height)
+        if not add_layer_to_image(0, layers[0], size, bbox, bbox_projection, image):
+            return None
 
-    layers = utils.parse_layers(normalized_args)
-    success = False
-    for index, layer_name in enumerate(layers):
-        if add_layer_to_image(index, layer_name, size, bbox, bbox_projection, image):
-            success = True
+        return image
+
+    # Render each layer into its own image, in parallel (mapnik releases the GIL
+    # while rendering), then composite them in order
+    app = current_app._get_current_object()
+
+    futures = [
+        get_executor().submit(
+            render_layer,
+            app,
+            normalized_args,
+            index,
+            layer_name,
+            size,
+            bbox,
+            bbox_projection,
+        )
+        for index, layer_name in enumerate(layers)
+    ]
 
-    if not success:
+    layer_images = [future.result() for future in futures]
+    if all(layer_image is None for layer_image in layer_images):
         return None
 
+    with instrumentation.span("image.composite"):
+        image = mapnik.Image(size.width, size.height)
+        image.premultiply()
+
+        for layer_image in layer_images:
+            if layer_image is not None:
+                layer_image.premultiply()
+                image.composite(layer_image)
+
+        image.demultiply()
+
     return image
 
 
+def get_executor():
+    """Return the pool of threads used to render the layers of the current process
+    (a new one is created after a fork)
+    """
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if (_executor is None) or (_executor_pid != os.getpid()):
+            _executor = ThreadPoolExecutor(
+                max_workers=int(current_app.config["WMS"]["GETMAP"]["RENDER_THREADS"]),
+                thread_name_prefix="render",
+            )
+            _executor_pid = os.getpid()
+
+        return _executor
+
+
+def render_layer(app, normalized_args, index, layer_name, size, bbox, bbox_projection):
+    """Return an image containing one layer of a GetMap request, or None if the
+    layer can't be rendered. The image is taken from the tile cache if that layer
+    was already requested alone.
+    """
+    with app.app_context():
+        _, mime_format = utils.parse_format(normalized_args)
+
+        # Only PNG images have an alpha channel
+        if mime_format == "image/png":
+            layer_args = dict(
+                normalized_args, layers=urllib.parse.quote(layer_name, safe="")
+            )
+
+            content = tiles.get(layer_args)
+            if content is not None:
+                return mapnik.Image.fromstring(content)
+
+        image = mapnik.Image(size.width, size.height)
+        if not add_layer_to_image(
+            index, layer_name, size, bbox, bbox_projection, image
+        ):
+            return None
+
+        return image
+
+
 def add_layer_to_image(index, layer_name, size, bbox, bbox_projection, image):
-    # Create the mapnik layers
-    layer = geofile.load(layer_name)
+    # Retrieve the data to render
+    with instrumentation.span("geofile.load"):
+        layer = geofile.load(layer_name)
     if layer is None:
         return False
 
     if not os.path.exists(layer.storage.get_dir(layer_name, cache=True)):
         return False
 
-    layer_data = layer.get_data_for_bounding_box(bbox, bbox_projection)
+    with instrumentation.span("get_data_for_bounding_box"):
+        layer_data = layer.get_data_for_bounding_box(bbox, bbox_projection, size)
     if (layer_data is None) or (len(layer_data) == 0):
         return True
 
-    # Create the style for the lines (if necessary)
+    type = path.get_type(layer_name)
+
+    legend = None
+    if type in (path.RASTER, path.VECTOR, path.CM):
+        with instrumentation.span("get_legend"):
+            legend = get_legend(layer_name)
+
+    # The maps of CM layers aren't pooled: rendering them must touch their files
+    # (see RasterLayer.as_mapnik_layers())
+    key_prefix = None
+    if type != path.CM:
+        key_prefix = (
+            layer_name,
+            tiles.get_layer_version(layer_name),
+            hash_legend(legend),
+            index,
+            size,
+            bbox_projection,
+        )
+
+    # Render the mapnik layers into the image
+    for i in range(0, len(layer_data) + 1, 9):
+        data = layer_data[i : i + 9]
+
+        key = None
+        entry = None
+
+        if key_prefix is not None:
+            key = key_prefix + (tuple(data),)
+            entry = pool.acquire(key)
+
+        if entry is None:
+            with instrumentation.span("make_map"):
+                entry = make_map(
+                    index, layer_name, layer, data, legend, size, bbox_projection
+                )
+
+        mp, legend_images_folder = entry
+
+        mp.zoom_to_box(bbox)
+        with instrumentation.span("mapnik.render"):
+            mapnik.render(mp, image)
+
+        if key is not None:
+            pool.release(key, mp, legend_images_folder)
+        elif legend_images_folder is not None:
+            shutil.rmtree(legend_images_folder)
+
+    return True
+
+
+def make_map(index, layer_name, layer, data, legend, size, bbox_projection):
+    """Create a mapnik map containing the mapnik layers corresponding to the data,
+    and return it along with the folder containing the legend images (if any)
+    """
     (type, _, variable, _, _) = path.parse_unique_layer_name(layer_name)
 
+    # Create the style for the lines (if necessary)
     line_style = None
     line_style_name = None
 
@@ -54,86 +197,43 @@ def add_layer_to_image(index, layer_name, size, bbox, bbox_projection, image):
     elif type == path.AREA:
         line_style, line_style_name = make_line_style(None)
 
+    mp = mapnik.Map(size.width, size.height, "+init=" + bbox_projection)
+
     if line_style is not None:
         line_style_name += f"_{index}"
+        mp.append_style(line_style_name, line_style)
 
-    # Render the mapnik layers into the image
     legend_style_created = False
     legend_style = None
     legend_style_name = None
     legend_images_folder = None
 
-    for i in range(0, len(layer_data) + 1, 9):
-        mp = mapnik.Map(size.width, size.height, "+init=" + bbox_projection)
-
-        if line_style is not None:
-            mp.append_style(line_style_name, line_style)
-
-        if legend_style is not None:
-            mp.append_style(legend_style_name, legend_style)
-
-        for mapnik_layer in layer.as_mapnik_layers(data=layer_data[i : i + 9]):
-            # Create the style for the legend (if necessary)
-            if not (legend_style_created) and (
-                path.get_type(layer_name) in (path.RASTER, path.VECTOR, path.CM)
-            ):
+    for mapnik_layer in layer.as_mapnik_layers(data=data):
+        # Create the style for the legend (if necessary)
+        if not (legend_style_created) and (legend is not None):
+            with instrumentation.span("create_style_from_legend"):
                 (
                     legend_style,
                     legend_style_name,
                     legend_images_folder,
-                ) = create_style_from_legend(layer_name, layer, mapnik_layer)
-
-                if legend_style is not None:
-                    legend_style_name += f"_{index}"
-                    mp.append_style(legend_style_name, legend_style)
-
-                legend_style_created = True
-
-            # Apply the styles to the mapnik layers
-            if line_style is not None:
-                mapnik_layer.styles.append(line_style_name)
+                ) = create_style_from_legend(layer_name, layer, mapnik_layer, legend)
 
             if legend_style is not None:
-                mapnik_layer.styles.append(legend_style_name)
-
-            mp.layers.append(mapnik_layer)
-
-        mp.zoom_to_box(bbox)
-        mapnik.render(mp, image)
-
-    # Cleanup
-    if legend_images_folder is not None:
-        shutil.rmtree(legend_images_folder)
-
-    return True
-
+                legend_style_name += f"_{index}"
+                mp.append_style(legend_style_name, legend_style)
 
-def get_mapnik_map_for_feature_info(normalized_args):
-    """Return the Mapnik object (with hardcoded symbology/rule)."""
+            legend_style_created = True
 
-    bbox_projection = utils.parse_projection(normalized_args)
-
-    size = utils.parse_size(normalized_args)
-    mp = mapnik.Map(size.width, size.height, "+init=" + bbox_projection)
-
-    layers = utils.parse_layers(normalized_args)
-    for index, layer_name in enumerate(layers):
-        # Only authorized for vector and area layers
-        if path.get_type(layer_name) not in (path.VECTOR, path.AREA):
-            return None
-
-        layer = geofile.load(layer_name)
-        if layer is None:
-            return None
+        # Apply the styles to the mapnik layers
+        if line_style is not None:
+            mapnik_layer.styles.append(line_style_name)
 
-        mapnik_layers = layer.as_mapnik_layers()
-        if (mapnik_layers is None) or (len(mapnik_layers) == 0):
-            return None
+        if legend_style is not None:
+            mapnik_layer.styles.append(legend_style_name)
 
-        for mapnik_layer in mapnik_layers:
-            mp.layers.append(mapnik_layer)
+        mp.layers.append(mapnik_layer)
 
-    return mp
+    return (mp, legend_images_folder)
 
 
 def delete_image_folders(mp):
@@ -141,10 +241,10 @@ def delete_image_folders(mp):
         shutil.rmtree(folder)
 
 
-def create_style_from_legend(layer_name, layer, mapnik_layer):
-    (type, layer_id, variable, _, _) = path.parse_unique_layer_name(layer_name)
+def get_legend(layer_name):
+    """Return the legend of a layer, or a default one if it doesn't have any"""
+    type = path.get_type(layer_name)
 
-    # Get the layer style and type
     if type in (path.VECTOR, path.RASTER):
         legend = client.get_legend(layer_name, ttl_hash=client.get_ttl_hash(30))
     elif type == path.CM:
@@ -155,6 +255,19 @@ def create_style_from_legend(layer_name, layer, mapnik_layer):
     if (legend is None) or (len(legend["symbology"]) == 0):
         legend = create_default_legend(type)
 
+    return legend
+
+
+def hash_legend(legend):
+    if legend is None:
+        return None
+
+    return hashlib.sha256(json.dumps(legend, sort_keys=True).encode()).hexdigest()
+
+
+def create_style_from_legend(layer_name, layer, mapnik_layer, legend):
+    (type, layer_id, variable, _, _) = path.parse_unique_layer_name(layer_name)
+
     mapnik_style = None
     style_name = None
     legend_images_folder = None
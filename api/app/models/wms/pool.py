@@ -0,0 +1,63 @@
+"""Per-process pool of mapnik maps ready to be rendered.
+
+Building a mapnik map (datasources, styles, layers) costs more than rendering
+a tile with it, so the maps are kept between the requests, indexed by a key
+describing everything they contain. A "GetMap" request only needs to zoom a
+pooled map to its bounding box and render it.
+
+A map is removed from the pool while it is used, so it is never shared between
+two threads.
+"""
+import shutil
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+_maps = OrderedDict()
+_maps_lock = threading.Lock()
+
+
+def acquire(key):
+    """Return a (map, legend images folder) tuple corresponding to the key, or
+    None if there isn't any available map. The caller must give the map back
+    with release() once the rendering is done.
+    """
+    with _maps_lock:
+        entries = _maps.get(key)
+        if not entries:
+            return None
+
+        entry = entries.pop()
+        if len(entries) == 0:
+            del _maps[key]
+
+        return entry
+
+
+def release(key, mp, legend_images_folder):
+    """Put a map back in the pool, evicting the least recently used maps if
+    necessary
+    """
+    max_size = int(current_app.config["WMS"]["GETMAP"]["MAPS_POOL_SIZE"])
+    if max_size <= 0:
+        _cleanup(legend_images_folder)
+        return
+
+    evicted = []
+
+    with _maps_lock:
+        _maps.setdefault(key, []).append((mp, legend_images_folder))
+        _maps.move_to_end(key)
+
+        while len(_maps) > max_size:
+            _, entries = _maps.popitem(last=False)
+            evicted.extend(entries)
+
+    for _, folder in evicted:
+        _cleanup(folder)
+
+
+def _cleanup(legend_images_folder):
+    if legend_images_folder is not None:
+        shutil.rmtree(legend_images_folder, ignore_errors=True)
@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+from app.common.test import BaseApiTest
+
+from . import pool
+
+
+class PoolTest(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        pool._maps.clear()
+
+    def testAcquireEmpty(self):
+        with self.flask_app.app_context():
+            self.assertTrue(pool.acquire("key") is None)
+
+    def testAcquireReleased(self):
+        with self.flask_app.app_context():
+            mp = object()
+            pool.release("key", mp, None)
+
+            self.assertEqual(pool.acquire("key"), (mp, None))
+            self.assertTrue(pool.acquire("key") is None)
+
+    def testEviction(self):
+        self.flask_app.config["WMS"]["GETMAP"]["MAPS_POOL_SIZE"] = 1
+
+        with self.flask_app.app_context():
+            folder = tempfile.mkdtemp()
+
+            pool.release("key1", object(), folder)
+            pool.release("key2", object(), None)
+
+            self.assertTrue(pool.acquire("key1") is None)
+            self.assertTrue(pool.acquire("key2") is not None)
+            self.assertFalse(os.path.exists(folder))
@@ -100,6 +100,29 @@ def parse_position(params) -> Position:
     return Position(x=x, y=y)
 
 
+def parse_position_box(params):
+    """Parse the map and return the bounding box (in the projection of the map) of
+    the pixel located at the position parameter (x and y). The box is enlarged by
+    half a pixel on each side, to tolerate imprecise clicks.
+    """
+    envelope = parse_envelope(params)
+    size = parse_size(params)
+    position = parse_position(params)
+
+    pixel_width = envelope.width() / size.width
+    pixel_height = envelope.height() / size.height
+
+    x = envelope.minx + position.x * pixel_width
+    y = envelope.maxy - position.y * pixel_height
+
+    return mapnik.Box2d(
+        x - pixel_width * 0.5,
+        y - pixel_height * 0.5,
+        x + pixel_width * 0.5,
+        y + pixel_height * 0.5,
+    )
+
+
 def parse_format(params):
     """Parse the map and return format.
     Check that it is in the allowed list of format.
@@ -0,0 +1,580 @@
+"""Offline benchmark of the WMS endpoint.
+
+Synthetic layers are generated in a temporary cache folder: a raster dataset made
+of GeoTIFF tiles in EPSG:3035 (with its geometries file), and a vector dataset
+made of polygons. Sequences of requests mimicking users panning and zooming on
+the map are then replayed by one or several workers:
+
+* GetMap requests for all the tiles displayed after each move, on both layers
+* GetFeatureInfo requests on the vector layer, at random positions
+* the generation of the GetCapabilities document, at the start of each session
+
+The latencies (p50 / p95 / max), the throughput of each worker and their peak
+memory usage are reported, and can be compared with the results of a previous
+run. The requests to the datasets server are answered with the description of the
+synthetic datasets, so no other service is needed.
+
+Usage (from the api folder, Linux only):
+
+    python -m scripts.benchmark_wms --tiles 100 --features 5000 --workers 4
+
+    python -m scripts.benchmark_wms --output baseline.json
+    (modify the code)
+    python -m scripts.benchmark_wms --baseline baseline.json
+"""
+import argparse
+import copy
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import gdal
+import numpy as np
+import osr
+
+from app import create_app
+from app.common import path
+from app.common.projection import epsg_string_to_proj4
+from app.models import geofile
+from app.models.wms import capabilities
+
+RASTER_DATASET_ID = 1
+VECTOR_DATASET_ID = 2
+
+RASTER_LAYER = path.make_unique_layer_name(path.RASTER, RASTER_DATASET_ID)
+VECTOR_LAYER = path.make_unique_layer_name(
+    path.VECTOR, VECTOR_DATASET_ID, variable="var1"
+)
+
+# Size (in pixels), resolution (in meters) and center of the grid (in EPSG:3035)
+# of the raster tiles
+RASTER_TILE_SIZE = 256
+RASTER_RESOLUTION = 250
+RASTER_CENTER = (4321000, 3210000)
+
+# Extent of the vector dataset (in EPSG:4326)
+VECTOR_EXTENT = (-10.0, 35.0, 30.0, 70.0)
+
+# Half the size of the world in EPSG:3857
+WEB_MERCATOR_EXTENT = 20037508.342789244
+
+# Size (in pixels) of the tiles requested by the frontend
+MAP_TILE_SIZE = 256
+
+DATASETS = [
+    {
+        "ds_id": RASTER_DATASET_ID,
+        "title": "Synthetic raster dataset",
+        "is_raster": True,
+        "shared_id": "synthetic_raster",
+    },
+    {
+        "ds_id": VECTOR_DATASET_ID,
+        "title": "Synthetic vector dataset",
+        "is_raster": False,
+        "shared_id": "synthetic_vector",
+    },
+]
+
+PARAMETERS = {
+    RASTER_DATASET_ID: {
+        "variables": [],
+        "time_periods": [],
+        "fields": {},
+        "levels": [],
+        "temporal_granularity": None,
+        "start_at": None,
+        "end_at": None,
+        "default_parameters": {},
+        "min_zoom_level": None,
+    },
+    VECTOR_DATASET_ID: {
+        "variables": ["var1"],
+        "time_periods": [],
+        "fields": {},
+        "levels": [],
+        "temporal_granularity": None,
+        "start_at": None,
+        "end_at": None,
+        "default_parameters": {},
+        "min_zoom_level": None,
+    },
+}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark of the WMS endpoint"
+    )
+    parser.add_argument(
+        "--tiles", type=int, default=100, help="number of raster tiles to generate"
+    )
+    parser.add_argument(
+        "--features",
+        type=int,
+        default=5000,
+        help="number of vector features to generate",
+    )
+    parser.add_argument(
+        "--sessions", type=int, default=20, help="number of sessions per worker"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=10,
+        help="number of requests done by each worker before measuring",
+    )
+    parser.add_argument(
+        "--tile-cache",
+        action="store_true",
+        help="enable the cache of the GetMap tiles",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", help="save the results in a JSON file")
+    parser.add_argument(
+        "--baseline", help="compare the results with the ones of a JSON file"
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="don't delete the generated files"
+    )
+    return parser
+
+
+def make_app(root_dir, tile_cache):
+    app = create_app(testing=True)
+    app.config["WMS_CACHE_DIR"] = os.path.join(root_dir, "wms_cache")
+    app.config["CM_OUTPUTS_DIR"] = os.path.join(root_dir, "cm_outputs")
+    app.config["RASTER_CACHE_DIR"] = None
+    app.config["WMS"]["GETMAP"]["CACHE"] = tile_cache
+
+    os.makedirs(app.config["WMS_CACHE_DIR"], exist_ok=True)
+    os.makedirs(app.config["CM_OUTPUTS_DIR"], exist_ok=True)
+
+    return app
+
+
+def offline():
+    """Answer the requests to the datasets server with the synthetic datasets"""
+    stack = ExitStack()
+
+    stack.enter_context(
+        patch(
+            "app.common.client.get_dataset_list",
+            new=lambda *args, **kwargs: copy.deepcopy(DATASETS),
+        )
+    )
+    stack.enter_context(
+        patch(
+            "app.common.client.get_parameters",
+            new=lambda dataset_id, *args, **kwargs: copy.deepcopy(
+                PARAMETERS.get(dataset_id)
+            ),
+        )
+    )
+    stack.enter_context(
+        patch("app.common.client.get_legend", new=lambda *args, **kwargs: None)
+    )
+
+    return stack
+
+
+def generate_raster_dataset(nb_tiles, rng):
+    """Generate tiled GeoTIFF files in EPSG:3035, along with the geometries file of
+    the dataset (in EPSG:4326)
+    """
+    source_ref = osr.SpatialReference()
+    source_ref.ImportFromEPSG(3035)
+
+    target_ref = osr.SpatialReference()
+    target_ref.ImportFromEPSG(4326)
+
+    # Always use the (x, y) / (lon, lat) order
+    if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+        source_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        target_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    transform = osr.CoordinateTransformation(source_ref, target_ref)
+
+    nb_columns = math.ceil(math.sqrt(nb_tiles))
+    tile_extent = RASTER_TILE_SIZE * RASTER_RESOLUTION
+
+    origin = (
+        RASTER_CENTER[0] - nb_columns * tile_extent / 2,
+        RASTER_CENTER[1] - math.ceil(nb_tiles / nb_columns) * tile_extent / 2,
+    )
+
+    driver = gdal.GetDriverByName("GTiff")
+    rasters = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for index in range(nb_tiles):
+            feature_id = f"tile_{index:05d}.tif"
+
+            minx = origin[0] + (index % nb_columns) * tile_extent
+            miny = origin[1] + (index // nb_columns) * tile_extent
+            maxx = minx + tile_extent
+            maxy = miny + tile_extent
+
+            filename = os.path.join(tmp_dir, feature_id)
+
+            dataset = driver.Create(
+                filename,
+                RASTER_TILE_SIZE,
+                RASTER_TILE_SIZE,
+                1,
+                gdal.GDT_Float32,
+                options=["TILED=YES", "COMPRESS=DEFLATE"],
+            )
+            dataset.SetGeoTransform(
+                (minx, RASTER_RESOLUTION, 0, maxy, 0, -RASTER_RESOLUTION)
+            )
+            dataset.SetProjection(source_ref.ExportToWkt())
+
+            gradient = np.linspace(1, 255, RASTER_TILE_SIZE, dtype=np.float32)
+            noise = rng.uniform(-20, 20, (RASTER_TILE_SIZE, RASTER_TILE_SIZE))
+            data = np.clip(gradient[np.newaxis, :] + noise, 1, 255)
+
+            dataset.GetRasterBand(1).WriteArray(data.astype(np.float32))
+            dataset = None
+
+            with open(filename, "rb") as f:
+                geofile.save_raster_file(RASTER_LAYER, feature_id, f.read())
+
+            os.remove(filename)
+
+            corners = [(minx, maxy), (maxx, maxy), (maxx, miny), (minx, miny)]
+            coordinates = [list(transform.TransformPoint(x, y)[:2]) for x, y in corners]
+            coordinates.append(coordinates[0])
+
+            rasters.append(
+                {
+                    "fid": feature_id,
+                    "geometry": {"type": "Polygon", "coordinates": [coordinates]},
+                }
+            )
+
+    geofile.save_raster_projection(RASTER_LAYER, epsg_string_to_proj4("EPSG:3035"))
+    geofile.save_raster_geometries(RASTER_LAYER, rasters)
+
+
+def generate_vector_features(nb_features, rng):
+    """Generate square polygons covering the extent of the vector dataset"""
+    nb_columns = math.ceil(math.sqrt(nb_features))
+    nb_rows = math.ceil(nb_features / nb_columns)
+
+    width = (VECTOR_EXTENT[2] - VECTOR_EXTENT[0]) / nb_columns
+    height = (VECTOR_EXTENT[3] - VECTOR_EXTENT[1]) / nb_rows
+
+    for index in range(nb_features):
+        minx = VECTOR_EXTENT[0] + (index % nb_columns) * width
+        miny = VECTOR_EXTENT[1] + (index // nb_columns) * height
+        maxx = minx + width
+        maxy = miny + height
+
+        yield {
+            "id": f"FID{index}",
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [minx, miny],
+                        [minx, maxy],
+                        [maxx, maxy],
+                        [maxx, miny],
+                        [minx, miny],
+                    ]
+                ],
+            },
+            "properties": {
+                "units": {"var1": "MW"},
+                "fields": {"name": f"Feature {index}"},
+                "legend": {"symbology": []},
+                "start_at": None,
+                "variables": {"var1": float(rng.uniform(0, 255))},
+            },
+        }
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return (x, y)
+
+
+def tile_to_bbox(x, y, zoom):
+    """Return the bounding box of a tile, in EPSG:3857"""
+    size = 2 * WEB_MERCATOR_EXTENT / 2 ** zoom
+    minx = -WEB_MERCATOR_EXTENT + x * size
+    maxy = WEB_MERCATOR_EXTENT - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+
+def make_sessions(nb_sessions, rng):
+    """Return a list of sessions, each one being a list of requests mimicking a
+    user exploring the map: the session starts at a random location at a low zoom
+    level, then the user pans, zooms in and out, and sometimes clicks on the map.
+
+    After each move, all the tiles of the viewport (3x3 tiles) are requested.
+    """
+    sessions = []
+
+    for _ in range(nb_sessions):
+        requests = [("GetCapabilities", None)]
+
+        zoom = rng.randint(4, 6)
+        lon = rng.uniform(VECTOR_EXTENT[0], VECTOR_EXTENT[2])
+        lat = rng.uniform(VECTOR_EXTENT[1], VECTOR_EXTENT[3])
+        x, y = lonlat_to_tile(lon, lat, zoom)
+
+        for _ in range(rng.randint(5, 20)):
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    bbox = tile_to_bbox(x + dx, y + dy, zoom)
+                    requests.append(("GetMap raster", bbox))
+                    requests.append(("GetMap vector", bbox))
+
+            if rng.random() < 0.3:
+                viewport = (
+                    tile_to_bbox(x - 1, y + 1, zoom)[:2]
+                    + tile_to_bbox(x + 1, y - 1, zoom)[2:]
+                )
+                position = (
+                    rng.randint(0, 3 * MAP_TILE_SIZE - 1),
+                    rng.randint(0, 3 * MAP_TILE_SIZE - 1),
+                )
+                requests.append(("GetFeatureInfo", (viewport, position)))
+
+            action = rng.random()
+            if (action < 0.3) and (zoom < 12):
+                zoom += 1
+                x = x * 2 + rng.randint(0, 1)
+                y = y * 2 + rng.randint(0, 1)
+            elif (action < 0.45) and (zoom > 3):
+                zoom -= 1
+                x //= 2
+                y //= 2
+            else:
+                x += rng.choice((-1, 0, 1))
+                y += rng.choice((-1, 0, 1))
+
+        sessions.append(requests)
+
+    return sessions
+
+
+def do_request(app, client, operation, args):
+    if operation == "GetCapabilities":
+        with app.test_request_context():
+            return capabilities.get_capabilities("http://localhost/api/wms") is not None
+
+    params = {
+        "service": "WMS",
+        "version": "1.1.1",
+        "srs": "EPSG:3857",
+        "styles": "",
+        "transparent": "true",
+        "format": "image/png",
+    }
+
+    if operation == "GetFeatureInfo":
+        bbox, position = args
+        params.update(
+            {
+                "request": "GetFeatureInfo",
+                "layers": VECTOR_LAYER,
+                "query_layers": VECTOR_LAYER,
+                "info_format": "application/json",
+                "width": 3 * MAP_TILE_SIZE,
+                "height": 3 * MAP_TILE_SIZE,
+                "x": position[0],
+                "y": position[1],
+            }
+        )
+    else:
+        bbox = args
+        params.update(
+            {
+                "request": "GetMap",
+                "layers": RASTER_LAYER
+                if operation == "GetMap raster"
+                else VECTOR_LAYER,
+                "width": MAP_TILE_SIZE,
+                "height": MAP_TILE_SIZE,
+            }
+        )
+
+    params["bbox"] = ",".join(str(x) for x in bbox)
+
+    response = client.get("/api/wms", query_string=params)
+    response.close()
+
+    # Empty tiles are reported as not found
+    return response.status_code in (200, 404)
+
+
+def run_worker(root_dir, sessions, warmup, tile_cache):
+    app = make_app(root_dir, tile_cache)
+    client = app.test_client()
+
+    requests = [request for session in sessions for request in session]
+
+    latencies = {}
+    errors = 0
+
+    with offline():
+        for operation, args in requests[:warmup]:
+            do_request(app, client, operation, args)
+
+        time_started = time.perf_counter()
+
+        for operation, args in requests:
+            request_started = time.perf_counter()
+            if not do_request(app, client, operation, args):
+                errors += 1
+
+            latencies.setdefault(operation, []).append(
+                time.perf_counter() - request_started
+            )
+
+        duration = time.perf_counter() - time_started
+
+    return {
+        "latencies": latencies,
+        "errors": errors,
+        "requests": len(requests),
+        "duration": duration,
+        # In kilobytes on Linux
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def summarize(results):
+    summary = {"operations": {}, "workers": []}
+
+    latencies = {}
+    for result in results:
+        for operation, values in result["latencies"].items():
+            latencies.setdefault(operation, []).extend(values)
+
+        summary["workers"].append(
+            {
+                "throughput": result["requests"] / result["duration"],
+                "errors": result["errors"],
+                "max_rss_mb": result["max_rss"] / 1024,
+            }
+        )
+
+    for operation, values in sorted(latencies.items()):
+        values = np.array(values) * 1000
+        summary["operations"][operation] = {
+            "count": len(values),
+            "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)),
+            "max_ms": float(np.max(values)),
+        }
+
+    return summary
+
+
+def print_summary(summary, baseline=None):
+    def delta(value, reference):
+        if reference is None or reference == 0:
+            return ""
+        return f" ({(value - reference) / reference * 100:+.0f}%)"
+
+    print(f"{'operation':<18}{'count':>8}{'p50 (ms)':>18}{'p95 (ms)':>18}{'max':>10}")
+
+    for operation, stats in summary["operations"].items():
+        reference = {}
+        if baseline is not None:
+            reference = baseline["operations"].get(operation, {})
+
+        p50 = f"{stats['p50_ms']:.1f}" + delta(stats["p50_ms"], reference.get("p50_ms"))
+        p95 = f"{stats['p95_ms']:.1f}" + delta(stats["p95_ms"], reference.get("p95_ms"))
+
+        print(
+            f"{operation:<18}{stats['count']:>8}{p50:>18}{p95:>18}"
+            f"{stats['max_ms']:>10.1f}"
+        )
+
+    print()
+
+    for index, worker in enumerate(summary["workers"]):
+        print(
+            f"worker {index}: {worker['throughput']:.1f} requests/s, "
+            f"peak RSS {worker['max_rss_mb']:.0f} MB, {worker['errors']} errors"
+        )
+
+
+def main():
+    args = get_parser().parse_args()
+
+    rng = random.Random(args.seed)
+    np_rng = np.random.default_rng(args.seed)
+
+    root_dir = tempfile.mkdtemp(prefix="enermaps-benchmark-")
+
+    try:
+        app = make_app(root_dir, args.tile_cache)
+
+        with app.app_context():
+            time_started = time.perf_counter()
+            generate_raster_dataset(args.tiles, np_rng)
+            geofile.save_vector_features(
+                VECTOR_LAYER, generate_vector_features(args.features, np_rng)
+            )
+            print(
+                f"Generated {args.tiles} raster tiles and {args.features} vector "
+                f"features in {time.perf_counter() - time_started:.1f}s"
+            )
+
+        sessions = [
+            make_sessions(args.sessions, random.Random(rng.random()))
+            for _ in range(args.workers)
+        ]
+
+        context = multiprocessing.get_context("fork")
+        with context.Pool(args.workers) as pool:
+            results = pool.starmap(
+                run_worker,
+                [
+                    (root_dir, worker_sessions, args.warmup, args.tile_cache)
+                    for worker_sessions in sessions
+                ],
+            )
+    finally:
+        if args.keep:
+            print(f"Generated files kept in {root_dir}")
+        else:
+            shutil.rmtree(root_dir, ignore_errors=True)
+
+    summary = summarize(results)
+    summary["settings"] = vars(args)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    print_summary(summary, baseline)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,50 +4,38 @@ import os
 import sys
 from datetime import datetime, timedelta
 
-# Retrieve the root folder of the CM outputs
-cm_outputs_dir = os.environ.get("CM_OUTPUTS_DIR", None)
-if cm_outputs_dir is None:
-    sys.exit(1)
+MAX_AGE = timedelta(hours=1)
 
 
-# Find all the files to delete
-now = datetime.utcnow()
-max_age = timedelta(hours=1)
-
-files_to_delete = []
-folders_to_delete = []
-
-for root, dirs, files in os.walk(cm_outputs_dir):
-    if files:
-        must_delete = True
+def clean(cm_outputs_dir, now=None, max_age=MAX_AGE):
+    """Delete all the files of the folders in which no file was accessed for
+    max_age (the cached ZIP archive of a task being one of the files of the task),
+    then the empty folders
+    """
+    if now is None:
+        now = datetime.utcnow()
 
+    # Bottom-up, so the subfolders of a folder are processed before it
+    for root, dirs, files in os.walk(cm_outputs_dir, topdown=False):
         fullpaths = [os.path.join(root, filename) for filename in files]
 
-        for fullpath in fullpaths:
-            access_time = datetime.utcfromtimestamp(os.path.getatime(fullpath))
-
-            if (now - access_time) < max_age:
-                must_delete = False
-                break
+        must_delete = all(
+            (now - datetime.utcfromtimestamp(os.path.getatime(fullpath))) >= max_age
+            for fullpath in fullpaths
+        )
 
-        if must_delete:
-            files_to_delete.extend(
-                [
-                    fullpath.replace(cm_outputs_dir + os.path.sep, "")
-                    for fullpath in fullpaths
-                ]
-            )
-            folders_to_delete.append(root.replace(cm_outputs_dir + os.path.sep, ""))
-    elif not dirs:
-        folders_to_delete.append(root.replace(cm_outputs_dir + os.path.sep, ""))
+        if fullpaths and must_delete:
+            for fullpath in fullpaths:
+                os.remove(fullpath)
 
+        if (root != cm_outputs_dir) and not os.listdir(root):
+            os.rmdir(root)
 
-# Delete the files and any empty directory left after
-os.chdir(cm_outputs_dir)
 
-for filename in files_to_delete:
-    os.remove(filename)
+if __name__ == "__main__":
+    # Retrieve the root folder of the CM outputs
+    cm_outputs_dir = os.environ.get("CM_OUTPUTS_DIR", None)
+    if cm_outputs_dir is None:
+        sys.exit(1)
 
-for path in folders_to_delete:
-    if os.path.exists(path):
-        os.removedirs(path)
+    clean(cm_outputs_dir)
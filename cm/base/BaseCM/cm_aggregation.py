@@ -0,0 +1,116 @@
+"""
+Per-label reductions of maps, as used to compute the potential of the
+coherent areas of a heat density map.
+
+The labels are non-negative integers (e.g. as returned by
+scipy.ndimage.label(), where 0 is the background), and all the reductions are
+computed in a single pass over the pixels: the returned arrays have
+n_labels + 1 elements and are indexed by label, label 0 included.
+"""
+import numpy as np
+
+
+def _check_shapes(labels: np.ndarray, values: np.ndarray):
+    if labels.shape != values.shape:
+        raise ValueError(
+            f"The labels and the values have not the same shape: {labels.shape}"
+            f" != {values.shape}"
+        )
+
+
+def label_sums(labels: np.ndarray, values: np.ndarray, n_labels: int):
+    """
+    Sum the values of each label.
+
+    Inputs :
+        * labels : label of each pixel.
+        * values : value of each pixel.
+        * n_labels : highest label.
+
+    Output :
+        * sums : sum of the values of each label.
+    """
+    labels = np.asarray(labels)
+    values = np.asarray(values)
+    _check_shapes(labels, values)
+
+    return np.bincount(
+        labels.ravel(), weights=values.ravel().astype(float), minlength=n_labels + 1
+    )
+
+
+def label_counts(labels: np.ndarray, n_labels: int):
+    """
+    Count the pixels of each label.
+
+    Inputs :
+        * labels : label of each pixel.
+        * n_labels : highest label.
+
+    Output :
+        * counts : number of pixels of each label.
+    """
+    return np.bincount(np.asarray(labels).ravel(), minlength=n_labels + 1)
+
+
+def label_maxima(
+    labels: np.ndarray, values: np.ndarray, n_labels: int, fill_value: float = 0
+):
+    """
+    Find the maximum of the values of each label.
+
+    Inputs :
+        * labels : label of each pixel.
+        * values : value of each pixel.
+        * n_labels : highest label.
+        * fill_value : maximum of the labels without any pixel.
+
+    Output :
+        * maxima : maximum of the values of each label.
+    """
+    labels = np.asarray(labels).ravel()
+    values = np.asarray(values).ravel()
+    _check_shapes(labels, values)
+
+    maxima = np.full(n_labels + 1, fill_value, dtype=float)
+    if labels.size == 0:
+        return maxima
+
+    # Group the values by label, then reduce each group
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.diff(sorted_labels, prepend=-1))
+
+    maxima[sorted_labels[starts]] = np.maximum.reduceat(values[order], starts)
+    return maxima
+
+
+def label_centroids(labels: np.ndarray, n_labels: int, weights: np.ndarray = None):
+    """
+    Compute the centroid of each label of a map, optionally weighted by the
+    values of the pixels.
+
+    Inputs :
+        * labels : label of each pixel (2D).
+        * n_labels : highest label.
+        * weights (optional) : weight of each pixel.
+
+    Outputs :
+        * rows : row of the centroid of each label (NaN for empty labels).
+        * columns : column of the centroid of each label (NaN for empty labels).
+    """
+    labels = np.asarray(labels)
+    if weights is None:
+        weights = np.ones(labels.shape)
+    else:
+        weights = np.asarray(weights, dtype=float)
+        _check_shapes(labels, weights)
+
+    rows, columns = np.indices(labels.shape)
+
+    total = label_sums(labels, weights, n_labels)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        centroid_rows = label_sums(labels, rows * weights, n_labels) / total
+        centroid_columns = label_sums(labels, columns * weights, n_labels) / total
+
+    return centroid_rows, centroid_columns
@@ -5,8 +5,11 @@ import inspect
 import json
 import logging
 import os
+import threading
+import time
 
 import jsonschema
+import redis
 import requests
 from celery import Celery, Task
 from celery.worker import worker
@@ -15,6 +18,11 @@ CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND")
 API_URL = os.environ.get("API_URL")
 
+# Redis hash in which the workers publish their calculation modules, read by the
+# API. The entries must be refreshed before they expire.
+CM_REGISTRY_KEY = "enermaps:cms"
+CM_REGISTRY_TTL = int(os.environ.get("CM_REGISTRY_TTL", 60))
+
 
 def get_default_app(name):
     """Create default Celery application."""
@@ -100,6 +108,11 @@ class CMBase(Task):
         except jsonschema.ValidationError as err:
             raise ValueError(str(err))
 
+    @property
+    def registration_string(self):
+        """Return the string describing the calculation module in the registry"""
+        return f"{self.name} [cm_info={self.cm_info}]"
+
     @property
     def cm_info(self):
         """Return worker information formatted as a json string"""
@@ -132,8 +145,53 @@ def base_task(app, schema_path):
     return app.task(base=CMBase, bind=True, schema_path=schema_path, queue=app.name)
 
 
+def publish_cms(app):
+    """Publish the calculation modules of the celery application in the registry"""
+    expires_at = time.time() + CM_REGISTRY_TTL
+
+    entries = {}
+    for task in app.tasks.values():
+        if isinstance(task, CMBase):
+            entries[task.name] = json.dumps(
+                {
+                    "registration": task.registration_string,
+                    "expires_at": expires_at,
+                }
+            )
+
+    if len(entries) == 0:
+        return
+
+    client = redis.Redis.from_url(CELERY_BROKER_URL)
+    with client.pipeline() as pipe:
+        pipe.hset(CM_REGISTRY_KEY, mapping=entries)
+        pipe.expire(CM_REGISTRY_KEY, CM_REGISTRY_TTL)
+        pipe.execute()
+
+
+def start_registry_heartbeat(app):
+    """Periodically publish the calculation modules of the celery application in
+    the registry, from a background thread
+    """
+
+    def _heartbeat():
+        while True:
+            try:
+                publish_cms(app)
+            except Exception:
+                # Keep publishing: the thread must survive any failure, otherwise
+                # the calculation modules silently disappear from the registry
+                logging.exception("Failed to publish the calculation modules")
+
+            time.sleep(CM_REGISTRY_TTL / 3)
+
+    thread = threading.Thread(target=_heartbeat, daemon=True)
+    thread.start()
+
+
 def start_app(app):
     """Start the celery application passed as single parameter"""
     logging.basicConfig(level=logging.ERROR)
+    start_registry_heartbeat(app)
     w = worker.WorkController(app=app)
     w.start()
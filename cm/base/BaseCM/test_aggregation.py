@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+
+from BaseCM import cm_aggregation
+
+LABELS = np.array(
+    [
+        [1, 1, 0, 2],
+        [1, 0, 0, 2],
+        [0, 0, 3, 3],
+    ]
+)
+
+VALUES = np.array(
+    [
+        [1.0, 2.0, 9.0, 4.0],
+        [3.0, 9.0, 9.0, 5.0],
+        [9.0, 9.0, 6.0, 7.0],
+    ]
+)
+
+
+class TestAggregation(unittest.TestCase):
+    def testSums(self):
+        sums = cm_aggregation.label_sums(LABELS, VALUES, 3)
+        self.assertEqual(list(sums), [45.0, 6.0, 9.0, 13.0])
+
+    def testSumsEmptyLabel(self):
+        sums = cm_aggregation.label_sums(LABELS, VALUES, 4)
+        self.assertEqual(list(sums), [45.0, 6.0, 9.0, 13.0, 0.0])
+
+    def testSumsWrongShape(self):
+        with self.assertRaises(ValueError):
+            cm_aggregation.label_sums(LABELS, VALUES[:, 1:], 3)
+
+    def testCounts(self):
+        counts = cm_aggregation.label_counts(LABELS, 3)
+        self.assertEqual(list(counts), [5, 3, 2, 2])
+
+    def testMaxima(self):
+        maxima = cm_aggregation.label_maxima(LABELS, VALUES, 4, fill_value=-1)
+        self.assertEqual(list(maxima), [9.0, 3.0, 5.0, 7.0, -1.0])
+
+    def testCentroids(self):
+        rows, columns = cm_aggregation.label_centroids(LABELS, 3)
+        self.assertAlmostEqual(rows[1], 1 / 3)
+        self.assertAlmostEqual(columns[1], 1 / 3)
+        self.assertAlmostEqual(rows[2], 0.5)
+        self.assertAlmostEqual(columns[2], 3.0)
+
+    def testWeightedCentroids(self):
+        rows, columns = cm_aggregation.label_centroids(LABELS, 4, weights=VALUES)
+        self.assertAlmostEqual(rows[3], 2.0)
+        self.assertAlmostEqual(columns[3], (6 * 2 + 7 * 3) / 13)
+        self.assertTrue(np.isnan(rows[4]))
+
+
+if __name__ == "__main__":
+    unittest.main()
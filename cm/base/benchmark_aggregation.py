@@ -0,0 +1,151 @@
+"""Benchmark of the per-label aggregations of BaseCM.cm_aggregation.
+
+A synthetic heat density map of the size of a country at 100 m resolution
+(Austria by default) is generated, and its coherent areas are labelled like the
+district heating CMs do. The potential of each area is then computed:
+
+* with the previous implementation (the pixels are sorted by label in Python,
+  then each label is summed in a loop)
+* with label_sums()
+
+Both results are compared, and the duration of each implementation is
+reported.
+
+Usage (requires scipy):
+
+    python3 benchmark_aggregation.py --width 5800 --height 3000
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy.ndimage import binary_dilation, binary_erosion, measurements
+
+from BaseCM.cm_aggregation import label_sums
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the per-label aggregations"
+    )
+    parser.add_argument(
+        "--width", type=int, default=5800, help="width of the map (in pixels)"
+    )
+    parser.add_argument(
+        "--height", type=int, default=3000, help="height of the map (in pixels)"
+    )
+    parser.add_argument(
+        "--cities", type=int, default=2000, help="number of populated areas"
+    )
+    parser.add_argument(
+        "--pixel-threshold",
+        type=float,
+        default=20,
+        help="pixel threshold (MWh/ha)",
+    )
+    parser.add_argument(
+        "--skip-legacy",
+        action="store_true",
+        help="don't run the previous implementation",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    return parser.parse_args()
+
+
+def make_heat_density_map(width, height, cities, rng):
+    """Generate a map of heat densities (MWh/ha) made of populated areas of
+    various sizes, with some noise
+    """
+    heat_density_map = rng.gamma(0.3, 5.0, size=(height, width))
+
+    rows = rng.integers(0, height, size=cities)
+    columns = rng.integers(0, width, size=cities)
+    radiuses = rng.integers(3, 60, size=cities)
+    peaks = rng.uniform(50, 500, size=cities)
+
+    for row, column, radius, peak in zip(rows, columns, radiuses, peaks):
+        top = max(row - 3 * radius, 0)
+        bottom = min(row + 3 * radius, height)
+        left = max(column - 3 * radius, 0)
+        right = min(column + 3 * radius, width)
+
+        y, x = np.ogrid[top:bottom, left:right]
+        distances = ((y - row) ** 2 + (x - column) ** 2) / (2 * radius ** 2)
+        heat_density_map[top:bottom, left:right] += peak * np.exp(-distances)
+
+    return heat_density_map
+
+
+def label_areas(pixel_filtered_map):
+    structure = np.ones((3, 3)).astype(int)
+    expanded_map = binary_dilation(input=pixel_filtered_map, structure=structure)
+    eroded_map = binary_erosion(input=expanded_map, structure=structure)
+    return measurements.label(input=eroded_map, structure=structure)
+
+
+def legacy_label_sums(labels, values, n_labels):
+    """Previous implementation of the sums, used by the district heating CMs"""
+    sums = np.zeros((n_labels + 1)).astype(float)
+    if n_labels == 0:
+        return sums
+
+    rows, columns = np.nonzero(labels)
+    sparse_labels = labels[rows, columns]
+    sparse_values = values[rows, columns]
+    sorted_array = np.asarray(
+        sorted(
+            zip(rows, columns, sparse_labels, sparse_values),
+            key=lambda items: items[2],
+        )
+    )
+
+    unique, counts = np.unique(sparse_labels, return_counts=True)
+    end = np.cumsum(counts)
+    start = np.concatenate((np.zeros((1)), end[0 : n_labels - 1]))
+
+    for i in range(n_labels):
+        sums[i + 1] = np.sum(sorted_array[int(start[i]) : int(end[i]), 3])
+
+    return sums
+
+
+def measure(function, *args):
+    time_started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - time_started
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print(f"Generating a {args.width}x{args.height} heat density map...")
+    heat_density_map = make_heat_density_map(args.width, args.height, args.cities, rng)
+
+    pixel_filtered_map = heat_density_map * (heat_density_map > args.pixel_threshold)
+    labels, n_labels = label_areas(pixel_filtered_map)
+
+    print(
+        f"{n_labels} coherent areas, {np.count_nonzero(labels)} labelled pixels"
+        f" ({heat_density_map.size} pixels)"
+    )
+
+    sums, duration = measure(label_sums, labels, pixel_filtered_map, n_labels)
+    print(f"label_sums():    {duration:8.3f} s")
+
+    if args.skip_legacy:
+        return
+
+    legacy_sums, legacy_duration = measure(
+        legacy_label_sums, labels, pixel_filtered_map, n_labels
+    )
+    print(f"previous:        {legacy_duration:8.3f} s")
+
+    if not np.allclose(sums[1:], legacy_sums[1:]):
+        raise ValueError("The results of both implementations differ")
+
+    print(f"speedup:         {legacy_duration / duration:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
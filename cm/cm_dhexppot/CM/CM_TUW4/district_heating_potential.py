@@ -3,6 +3,7 @@ import os
 import sys
 
 import numpy as np
+from BaseCM.cm_aggregation import label_sums
 from scipy.ndimage import binary_dilation, binary_erosion, measurements
 
 from CM.CM_TUW1.read_raster import raster_array as RA
@@ -34,46 +35,14 @@ def DHRegions(DH, DH_threshold):
     # This can also be incorporated in order to filter areas smaller than a
     # specific size e.g. 1km2 ~ 100.
     if labels.size > 0:
-        # labels start from 1. Therefore, PotDH should have numLabels+1
-        # elements
-        PotDH = np.zeros((numLabels + 1)).astype(bool)
-        # using sparse matrix indices to swift the calculation. This helps to
-        # implement "np.unique" much faster
-        sparseRow, sparseCol = np.nonzero(labels)
-        sparseLabels = labels[sparseRow, sparseCol]
-        sparseDH = DH[sparseRow, sparseCol]
-        # sort sparse values based on sparseLabels. This helps to implement
-        # summation process much faster.
-        sortedSparseData = np.asarray(
-            sorted(
-                zip(sparseRow, sparseCol, sparseLabels, sparseDH), key=lambda x: x[2]
-            )
-        )
-        # find unique values and their counts within the sparseLabels
-        unique, counts = np.unique(sparseLabels, return_counts=True)
-        """
-        calculate starting and ending indices of each unique value in order
-        to swift the summation operation. calculate starting and ending
-        indices of each unique value in order to swift the summation
-        operation. Note that a[st:end] refers to elements of a including "st"
-        and excluding end.
-        Note: To get the last element of the same type, however, cumsum shoud
-        be subtracted by 1:
-        (e.g. [1,1,1,1,2,2,2]: hear st for 1 is 0; end for 1 is 4; the last
-        element which is one is 3)
-        """
-        end = np.cumsum(counts)
-        st = np.concatenate((np.zeros((1)), end[0 : numLabels - 1]))
-
-        for i in range(numLabels):
-            # sum over sparseDH
-            # input: [MWh/ha] for each ha --> summation returns MWh for the
-            # coherent area
-            pot = np.sum(sortedSparseData[int(st[i]) : int(end[i]), 3])
-            if pot >= DH_threshold:
-                # here should be i+1 because labeling starts from one and not
-                # from zero
-                PotDH[i + 1] = True
+        # sum over DH for each coherent area
+        # input: [MWh/ha] for each ha --> summation returns MWh for the
+        # coherent area
+        pot = label_sums(labels, DH, numLabels)
+        # labels start from 1: the pixels which are not part of any coherent
+        # area are labelled 0
+        PotDH = pot >= DH_threshold
+        PotDH[0] = False
         DH_regions = PotDH[labels]
         return DH_regions
 
@@ -85,23 +54,9 @@ def DHPotential(DH_Regions, heat_density_map):
         hdm_arr, gt = RA(heat_density_map, return_gt=True)
     struct = np.ones((3, 3)).astype(int)
     labels, numLabels = measurements.label(DH_Regions, structure=struct)
-    DHPot = np.zeros((numLabels + 1)).astype(float)
-    sparseRow, sparseCol = np.nonzero(labels)
-    # This helps to implement "np.unique" much faster
-    sparse_labels = labels[sparseRow, sparseCol]
-    sparse_hdm = hdm_arr[sparseRow, sparseCol]
-    # sort sparse values based on sparse_labels. This helps to implement
-    # summation process much faster.
-    sortedSparseData = np.asarray(
-        sorted(zip(sparseRow, sparseCol, sparse_labels, sparse_hdm), key=lambda x: x[2])
-    )
-    unique, counts = np.unique(sparse_labels, return_counts=True)
-    end = np.cumsum(counts)
-    st = np.concatenate((np.zeros((1)), end[0 : numLabels - 1]))
-    for i in range(numLabels):
-        # input: [MWh/ha] for each ha --> to get potential in GWh it
-        # should be multiplied by 0.001
-        DHPot[i + 1] = 0.001 * np.sum(sortedSparseData[int(st[i]) : int(end[i]), 3])
+    # input: [MWh/ha] for each ha --> to get potential in GWh it
+    # should be multiplied by 0.001
+    DHPot = 0.001 * label_sums(labels, hdm_arr, numLabels)
     # DH_Potential = DHPot[labels]
     DHPot = DHPot[1::]
     # potential of each coherent area in GWh is assigned to its pixels
@@ -5,8 +5,6 @@ import numpy as np
 from osgeo import gdal, ogr, osr
 from scipy.ndimage import measurements
 
-from CM.CM_TUW1.read_raster import raster_array as RA
-
 path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if path not in sys.path:
     sys.path.append(path)
@@ -23,7 +21,7 @@ def rgba(minimum, maximum, value, a=0.5):
 
 
 def add_label_field(
-    dh_bool_raster, label_raster, output_shp1, output_shp2, heat_dem_coh, epsg=3035
+    dh_bool_arr, label_arr, gt, output_shp1, output_shp2, heat_dem_coh, epsg=3035
 ):
     label_list = []
     color_map = ["#feedde", "#fdd0a2", "#fdae6b", "#fd8d3c", "#e6550d", "#a63603"]
@@ -61,8 +59,8 @@ def add_label_field(
     # Remove output shapefile if it already exists
     if os.path.exists(output_shp2):
         outDriver.DeleteDataSource(output_shp2)
-    bool_arr, gt = RA(dh_bool_raster, return_gt=True)
-    label_arr = RA(label_raster)
+    bool_arr = dh_bool_arr.astype(float)
+    label_arr = label_arr.astype(float)
     numLabels = np.max(label_arr)
     coords = measurements.center_of_mass(
         bool_arr, label_arr, index=np.arange(1, numLabels + 1)
@@ -148,13 +146,19 @@ def add_label_field(
 
 
 def polygonize(
-    dh_bool_raster, label_arr, output_shp1, output_shp2, heat_dem_coh, epsg=3035
+    dh_bool_arr, label_arr, gt, output_shp1, output_shp2, heat_dem_coh, epsg=3035
 ):
     # save the coherent areas in shapefile format
-    raster = gdal.Open(dh_bool_raster)
-    band = raster.GetRasterBand(1)
     srs = osr.SpatialReference()
     srs.ImportFromEPSG(epsg)
+    # in-memory raster of the coherent areas
+    raster = gdal.GetDriverByName("MEM").Create(
+        "", dh_bool_arr.shape[1], dh_bool_arr.shape[0], 1, gdal.GDT_Byte
+    )
+    raster.SetGeoTransform(gt)
+    raster.SetProjection(srs.ExportToWkt())
+    band = raster.GetRasterBand(1)
+    band.WriteArray(dh_bool_arr)
     shpDriver = ogr.GetDriverByName("ESRI Shapefile")
     if os.path.exists(output_shp1):
         shpDriver.DeleteDataSource(output_shp1)
@@ -165,8 +169,8 @@ def polygonize(
     # polygonize
     gdal.Polygonize(band, band, outLayer, 0, options=["8CONNECTED=8"])
     # save layer
-    outDataSource = outLayer = band = None
+    outDataSource = outLayer = band = raster = None
     symbol_vals_str = add_label_field(
-        dh_bool_raster, label_arr, output_shp1, output_shp2, heat_dem_coh
+        dh_bool_arr, label_arr, gt, output_shp1, output_shp2, heat_dem_coh
     )
     return symbol_vals_str
@@ -5,7 +5,6 @@ import numpy as np
 
 import CM.CM_TUW4.district_heating_potential as DHP
 import CM.CM_TUW19.run_cm as CM19
-from CM.CM_TUW0.rem_mk_dir import rm_file
 from CM.CM_TUW4.polygonize import polygonize
 
 path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -42,12 +41,14 @@ def main(
     symbol_vals_str = []
     if dh_area_flag:
         CM19.main(output_raster1, geo_transform, "int8", DH_Regions)
-        temp_raster = os.path.dirname(output_raster2) + "/temp.tif"
-        CM19.main(temp_raster, geo_transform, "int32", labels)
         symbol_vals_str = polygonize(
-            output_raster1, temp_raster, output_shp1, output_shp2, DHPot
+            DH_Regions.astype("int8"),
+            labels,
+            geo_transform,
+            output_shp1,
+            output_shp2,
+            DHPot,
         )
-        rm_file(temp_raster, temp_raster[:-4] + ".tfw")
         CM19.main(output_raster2, geo_transform, "float32", hdm_dh_region_cut)
 
     return total_potential, total_heat_demand, symbol_vals_str
@@ -1,17 +1,48 @@
 import os
 import sys
+from dataclasses import replace
 
-from CM.CM_TUW40.f2_investment import dh_demand
+from CM.CM_TUW40.f2_investment import dh_demand, dh_demand_scenarios
 from CM.CM_TUW40.f3_coherent_areas import distribuition_costs
+from CM.CM_TUW40.results import Results
 
 path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if path not in sys.path:
     sys.path.append(path)
 
 
-def main(P, OFP):
+def main(P, OFP, save_rasters=False):
+    """
+    Run the stages of the calculation, and return their results (see
+    results.Results). The rasters computed by the stages are passed in memory
+    from one stage to the next: they are only saved in the output folder if
+    save_rasters is True (for debugging).
+    """
+    results = Results.from_files(OFP)
     # f2: calculate pixel based values
-    dh_demand(P, OFP)
+    dh_demand(P, results)
     # f3: Determination of coherent areas based on the distribution grid cost
     # ceiling and available capital for investment.
-    distribuition_costs(P, OFP)
+    distribuition_costs(P, OFP, results)
+    if save_rasters:
+        results.save_all(OFP)
+    return results
+
+
+def main_scenarios(Ps, OFPs, save_rasters=False):
+    """
+    Same as main(), for several scenarios on the same input rasters: the input
+    rasters are read once, and the pixel based values of all the scenarios are
+    calculated at once. Return the results of each scenario.
+    """
+    inputs = Results.from_files(OFPs[0])
+    scenario_results = [replace(inputs) for _ in Ps]
+    # f2: calculate pixel based values
+    dh_demand_scenarios(Ps, scenario_results)
+    for P, OFP, results in zip(Ps, OFPs, scenario_results):
+        # f3: Determination of coherent areas based on the distribution grid
+        # cost ceiling and available capital for investment.
+        distribuition_costs(P, OFP, results)
+        if save_rasters:
+            results.save_all(OFP)
+    return scenario_results
@@ -4,71 +4,158 @@ import sys
 
 import numpy as np
 
-from CM.CM_TUW1.read_raster import raster_array as RA
-from CM.CM_TUW19 import run_cm as CM19
-
 path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if path not in sys.path:
     sys.path.append(path)
 
 
+# Below this value of |log(x) * horizon|, the discounted sums are computed from
+# their Taylor expansion, as their closed form loses its precision
+SERIES_THRESHOLD = 1e-3
+
+
 def annuity(r, period):
-    period = int(period)
-    r = float(r)
-    if r == 0:
-        return 1
-    return ((1 + r) ** period - 1) / (r * (1 + r) ** period)
+    r = np.asarray(r, dtype=float)
+    period = np.asarray(period).astype(int)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = ((1 + r) ** period - 1) / (r * (1 + r) ** period)
+    return np.where(r == 0, 1, alpha)
 
 
 def calc_adjustment_factor(market_share):
     # term inside log should be in percent: obtained for 10 buildings in sparse areas
-    market_share_in_percent = market_share * 100
-    if market_share_in_percent < 20:
-        market_share_in_percent = 20
+    market_share_in_percent = np.maximum(np.asarray(market_share) * 100, 20)
     """
     # old: adjustment factor for 20 buildings
     adjustment_factor = 0.4258 * np.log(market_share_in_percent) - 0.96089
     """
     adjustment_factor = 0.604 * np.log(market_share_in_percent) - 1.7815
-    if adjustment_factor > 1:
-        adjustment_factor = 1
-    return adjustment_factor
+    return np.minimum(adjustment_factor, 1)
 
 
-def dh_demand(P, OFP, d_a_slope=0.0486, d_a_intercept=0.0007, data_type="float32"):
+def investment_horizon(P):
     """
-    Important Note:
-    1) Here, for the calculation of plot ratio, I used gross floor area raster
-    in one hectar resolution (unit: m2). It should be divided by 1e4 to get the
-    plot ratio.
-    2) if you have plot ratio raster, remove the 1e4 factor.
-    3) Distribution cost is calculated for those pixels that their corresponding
-    pipe diameter is equal or greater than 0.
-    the input heat density map should be in GWh/km2.
+    Return the number of years of the study horizon, the number of years of
+    the depreciation period after it, and the reinvestment factor.
     """
     horizon = int(P.last_year) - int(P.start_year) + 1
-    horizon = int(horizon)
     if horizon > int(P.depreciation_period):
-        horizon = P.depreciation_period
+        horizon = int(P.depreciation_period)
         remaining_years = 0
         reinvestment_factor = 1
     else:
-        remaining_years = int(P.depreciation_period) - int(horizon)
+        remaining_years = int(P.depreciation_period) - horizon
         reinvestment_factor = 1 + remaining_years / P.depreciation_period
-    hdm_st, geo_transform = RA(OFP.inRasterHDM_st, dType="float32", return_gt=True)
-    hdm_end = RA(OFP.inRasterHDM_end, dType="float32")
-    # gfa in hectare should be divided by 10000 to get right values for plot ratio (m2/m2).
-    plot_ratio = RA(OFP.inRasterGFA_st, dType="float32") / 10000
-    row, col = np.nonzero(
-        (hdm_st > 0).astype(int)
-        * (hdm_end > 0).astype(int)
-        * (plot_ratio > 0.0).astype(int)
+    if horizon < 2:
+        raise ValueError(
+            f"The study horizon must be at least two years long, not {horizon}."
+        )
+    return horizon, remaining_years, reinvestment_factor
+
+
+def discounted_sums(log_x, horizon):
+    """
+    Compute in closed form the sums of x**i and of i * x**i, for i from 0 to
+    horizon - 1.
+
+    Inputs :
+        * log_x : logarithm of x.
+        * horizon : number of terms of the sums.
+
+    Outputs :
+        * s0 : sum of x**i.
+        * s1 : sum of i * x**i.
+    """
+    log_x = np.asarray(log_x, dtype=float)
+    h = np.asarray(horizon, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        x_minus_one = np.expm1(log_x)
+        s0 = np.expm1(h * log_x) / x_minus_one
+        s1 = (h * np.exp(h * log_x) - np.exp(log_x) * s0) / x_minus_one
+    # sums of i, i**2 and i**3
+    t1 = h * (h - 1) / 2
+    t2 = (h - 1) * h * (2 * h - 1) / 6
+    t3 = t1 ** 2
+    near_one = np.abs(log_x * h) < SERIES_THRESHOLD
+    s0 = np.where(near_one, h + log_x * t1 + log_x ** 2 / 2 * t2, s0)
+    s1 = np.where(near_one, t1 + log_x * t2 + log_x ** 2 / 2 * t3, s1)
+    return s0, s1
+
+
+def max_connection_share(log_e, a, b, horizon):
+    """
+    Compute the maximum of e**i * (a + b * i) (and 0), for i from 0 to
+    horizon - 1: the highest DH demand over the horizon, as a share of the
+    demand of the first year.
+
+    With a + b * i >= 0 over the horizon, the function is log-concave, so its
+    maximum is reached at either end of the horizon or around its stationary
+    point.
+
+    Inputs :
+        * log_e : logarithm of the yearly energy reduction factor e.
+        * a : connection rate of the first year.
+        * b : yearly increase of the connection rate.
+        * horizon : number of years.
+
+    Output :
+        * share : maximum share.
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    last = np.asarray(horizon) - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stationary = -1 / log_e - a / b
+    stationary = np.clip(np.nan_to_num(stationary, nan=0.0), 0, last)
+    years = (0, last, np.floor(stationary), np.ceil(stationary))
+    shares = [np.exp(log_e * year) * (a + b * year) for year in years]
+    return np.maximum(np.max(np.broadcast_arrays(*shares), axis=0), 0)
+
+
+def sparse_investment(
+    Ps,
+    sparse_demand,
+    plot_ratio_sparse,
+    hdm_change_ratio_sparse,
+    d_a_slope=0.0486,
+    d_a_intercept=0.0007,
+):
+    """
+    Evaluate the investment model of several scenarios at once on the pixels
+    with a heat demand. The parameters of the scenarios are broadcast as
+    columns against the pixels: all the outputs have one row per scenario.
+
+    Inputs :
+        * Ps : parameters of each scenario.
+        * sparse_demand : heat demand of the first year (GJ/m2).
+        * plot_ratio_sparse : plot ratio (m2/m2).
+        * hdm_change_ratio_sparse : ratio between the heat demands of the last
+          and the first years.
+
+    Outputs :
+        * q_max : highest DH demand over the horizon (GJ/m2).
+        * q : discounted DH demand over the depreciation period (GJ/m2).
+        * abs_investment_total : investment (EUR).
+        * ll : length of the distribution pipes (m/m2).
+        * ll_service_pipes : length of the service pipes (m/m2).
+        * investment_dist : specific cost of the distribution pipes (EUR/GJ).
+        * investment_service_pipes : specific cost of the service pipes
+          (EUR/GJ).
+    """
+
+    def column(values):
+        return np.array(values, dtype=float)[:, np.newaxis]
+
+    horizon, remaining_years, reinvestment_factor = (
+        column(values) for values in zip(*(investment_horizon(P) for P in Ps))
     )
-    # unit conversion from MWh/ha to GJ/m2
-    sparse_demand = 0.00036 * hdm_st[row, col]
-    plot_ratio_sparse = plot_ratio[row, col]
-    hdm_change_ratio_sparse = hdm_end[row, col] / hdm_st[row, col]
-    energy_reduction_factor_sparse = hdm_change_ratio_sparse ** (1 / (horizon - 1))
+    depreciation_period = column([P.depreciation_period for P in Ps])
+    interest = column([P.interest for P in Ps])
+    st_rate = column([P.st_dh_connection_rate for P in Ps])
+    end_rate = column([P.end_dh_connection_rate for P in Ps])
+    c1 = column([P.c1 for P in Ps])
+    c2 = column([P.c2 for P in Ps])
+
     # the unit for L is m however in each m2
     # L is in m: to get the value for each pixel (ha) you should multiply it
     # by 10000 because 1 pixel has 10000 m2
@@ -77,7 +164,7 @@ def dh_demand(P, OFP, d_a_slope=0.0486, d_a_intercept=0.0007, data_type="float32
     # the title "Heat Roadmap Europe: Heat distribution costs"
     L = 1 / ((plot_ratio_sparse <= 0.4).astype(int) * (137.5 * plot_ratio_sparse + 5) + (plot_ratio_sparse > 0.4).astype(int) * 60)
     """
-    adjustment_factor = calc_adjustment_factor(P.end_dh_connection_rate)
+    adjustment_factor = calc_adjustment_factor(end_rate)
     # the following formula originates from D4.5 of the H2020 project sEEnergies
     pr_upper = (plot_ratio_sparse > np.exp(-2)).astype(int)
     pr_lower = (plot_ratio_sparse <= np.exp(-2)).astype(int)
@@ -94,68 +181,50 @@ def dh_demand(P, OFP, d_a_slope=0.0486, d_a_intercept=0.0007, data_type="float32
             / (0.7737 + 0.18559 * np.log(plot_ratio_sparse))
         )
     )
-    # initialize the variables
-    q = 0
-    # q_new = P.st_dh_connection_rate * sparse_demand
-    q_tot = np.copy(sparse_demand)
-    q_max = np.zeros_like(q_tot)
-    q_new = 0
-    for i in range(horizon):
-        erfs = energy_reduction_factor_sparse ** i
-        q_tot = sparse_demand * erfs
-        tmp1 = float(P.st_dh_connection_rate)
-        tmp2 = i * (float(P.end_dh_connection_rate) - float(P.st_dh_connection_rate))
-        q_new = q_tot * (tmp1 + tmp2 / (horizon - 1))
-        # q_new = q_tot * (float(P.st_dh_connection_rate) + i * (
-        # float(P.end_dh_connection_rate) -
-        # float(P.st_dh_connection_rate)) / (horizon - 1))
-        # q_new is a non-zero sparse matrix. The development of demand can be
-        # checked by comparing just one element of q_new with q_max.
-        q_max = np.max((q_max, q_new), axis=0)
-        q += q_new / (1 + float(P.interest)) ** i
-    if remaining_years > 0:
-        if P.interest > 0:
-            # in the first year, connection rate st exists. so use horizon-1 for annuity.
-            alpha_horizon = annuity(P.interest, horizon - 1)
-            alpha_depreciation = annuity(P.interest, P.depreciation_period)
-            rest_annuity_factor = alpha_depreciation - alpha_horizon
-            q = q + q_new * rest_annuity_factor
-        else:
-            q = q + q_new * remaining_years
-    linear_heat_density = q_max / ll
-    linear_heat_density_service_pipes = q_max / ll_service_pipes
+    # In year i of the horizon, the DH demand is
+    #     q_new(i) = sparse_demand * e**i * (st_rate + i * rate_increase)
+    # with e the yearly energy reduction factor. Its maximum and its sum
+    # discounted by (1 + interest)**i are computed in closed form.
+    log_e = np.log(hdm_change_ratio_sparse) / (horizon - 1)
+    rate_increase = (end_rate - st_rate) / (horizon - 1)
+    q_max = sparse_demand * max_connection_share(log_e, st_rate, rate_increase, horizon)
+    s0, s1 = discounted_sums(log_e - np.log1p(interest), horizon)
+    q = sparse_demand * (st_rate * s0 + rate_increase * s1)
+    # in the first year, connection rate st exists. so use horizon-1 for annuity.
+    rest_annuity_factor = np.where(
+        remaining_years > 0,
+        np.where(
+            interest > 0,
+            annuity(interest, depreciation_period) - annuity(interest, horizon - 1),
+            remaining_years,
+        ),
+        0,
+    )
+    q_new = sparse_demand * np.exp(log_e * (horizon - 1)) * end_rate
+    q = q + q_new * rest_annuity_factor
+
+    with np.errstate(divide="ignore"):
+        linear_heat_density = q_max / ll
+        linear_heat_density_service_pipes = q_max / ll_service_pipes
+        log_linear_heat_density = np.log(linear_heat_density)
     # this step is performed to avoid negative average pipe diameter
     lhd_threshold = -d_a_intercept / d_a_slope
-    filtered_ldh = (np.log(linear_heat_density) < lhd_threshold).astype(int)
-    elements = np.nonzero(filtered_ldh)[0]
-    d_a = d_a_slope * (np.log(linear_heat_density)) + d_a_intercept
-    d_a[elements] = 0
+    elements = log_linear_heat_density < lhd_threshold
+    d_a = np.where(elements, 0, d_a_slope * log_linear_heat_density + d_a_intercept)
     d_a_service_pipes = np.zeros_like(d_a)
     # lower limit of linear heat densities at 1.5 GJ/m was set. Below this
     # threshold, pipe diameters of 0.02m were applied uniformly for all hectare
     # grid cells with present heat density values above zero.
     # Note: linear_heat_density is calculated for cells with heat demand above zero
-    d_a[
-        ((linear_heat_density < 1.5).astype(int) * (d_a > 0).astype(int)).astype(bool)
-    ] = 0.02
-    d_a_service_pipes[
-        (
-            (linear_heat_density_service_pipes < 1.5).astype(int)
-            * (d_a > 0.02).astype(int)
-        ).astype(bool)
-    ] = 0.02
-    d_a_service_pipes[
-        (
-            (linear_heat_density_service_pipes >= 1.5).astype(int)
-            * (d_a > 0.03).astype(int)
-        ).astype(bool)
-    ] = 0.03
+    d_a[(linear_heat_density < 1.5) & (d_a > 0)] = 0.02
+    d_a_service_pipes[(linear_heat_density_service_pipes < 1.5) & (d_a > 0.02)] = 0.02
+    d_a_service_pipes[(linear_heat_density_service_pipes >= 1.5) & (d_a > 0.03)] = 0.03
     d_a_service_pipes[elements] = 0
     q_max[elements] = 0
     # absolute investment in EURO
-    abs_investment_dist = 1e4 * ll * (P.c1 + P.c2 * d_a)
+    abs_investment_dist = 1e4 * ll * (c1 + c2 * d_a)
     abs_investment_service_pipes = (
-        1e4 * ll_service_pipes * (P.c1 + P.c2 * d_a_service_pipes)
+        1e4 * ll_service_pipes * (c1 + c2 * d_a_service_pipes)
     )
     abs_investment_total = abs_investment_dist + abs_investment_service_pipes
     abs_investment_dist[elements] = 0
@@ -166,57 +235,84 @@ def dh_demand(P, OFP, d_a_slope=0.0486, d_a_intercept=0.0007, data_type="float32
     investment_service_pipes = (
         1e-4 * reinvestment_factor * abs_investment_service_pipes / q
     )
-    investment = investment_dist + investment_service_pipes
     q[elements] = 0
-    final_investment_dist = np.zeros_like(hdm_st, dtype=data_type)
-    final_investment_service_pipes = np.zeros_like(hdm_st, dtype=data_type)
-    # from Euro/GJ to Euro/MWh
-    final_investment_dist[row, col] = investment_dist * 3.6
-    final_investment_service_pipes[row, col] = investment_service_pipes * 3.6
-    final_investment = np.zeros_like(hdm_st, dtype=data_type)
-    # from Euro/GJ to Euro/MWh
-    final_investment[row, col] = investment * 3.6
-    supplied_heat_during_investment_period = np.zeros_like(
-        final_investment, dtype=data_type
-    )
-    max_dh_dem_arr = np.zeros_like(final_investment, dtype=data_type)
-    # DH demand density in MWh within the study horizon
-    max_dh_dem_arr[row, col] = q_max * 10000 / 3.6
-    supplied_heat_during_investment_period[row, col] = q * 10000 / 3.6
-    invest_euro_arr = np.zeros_like(final_investment, dtype=data_type)
-    invest_euro_arr[row, col] = abs_investment_total
-    """
-    hdm_last_year = np.zeros_like(final_investment, dtype=data_type)
-    # total demand in the last year of study horizon in MWh/ha
-    hdm_last_year[row, col] = q_tot*10000/3.6
-    """
-    # Length of distribution pipes (L)
-    length_distribution_pipes = np.zeros_like(final_investment, dtype=data_type)
-    length_distribution_pipes[row, col] = ll
-    length_distribution_pipes[row, col][elements] = 0
-
-    length_service_pipes = np.zeros_like(final_investment, dtype=data_type)
-    length_service_pipes[row, col] = ll_service_pipes
-    length_service_pipes[row, col][elements] = 0
-
-    # Save raster files
-    CM19.main(OFP.maxDHdem, geo_transform, data_type, max_dh_dem_arr)
-    CM19.main(
-        OFP.supplied_heat_during_investment_period,
-        geo_transform,
-        data_type,
-        supplied_heat_during_investment_period,
-    )
-    CM19.main(OFP.invest_Euro, geo_transform, data_type, invest_euro_arr)
-    # CM19.main(OFP.hdm_cut_last_year, geo_transform, data_type, hdm_last_year)
-    CM19.main(
-        OFP.total_dist_pipe_length, geo_transform, data_type, length_distribution_pipes
+    return (
+        q_max,
+        q,
+        abs_investment_total,
+        ll,
+        ll_service_pipes,
+        investment_dist,
+        investment_service_pipes,
     )
-    CM19.main(
-        OFP.total_serv_pipe_length, geo_transform, data_type, length_service_pipes
-    )
-    CM19.main(OFP.inv_dist, geo_transform, data_type, final_investment_dist)
-    CM19.main(
-        OFP.inv_service_pipe, geo_transform, data_type, final_investment_service_pipes
+
+
+def dh_demand(P, results, d_a_slope=0.0486, d_a_intercept=0.0007, data_type="float32"):
+    """
+    Important Note:
+    1) Here, for the calculation of plot ratio, I used gross floor area raster
+    in one hectar resolution (unit: m2). It should be divided by 1e4 to get the
+    plot ratio.
+    2) if you have plot ratio raster, remove the 1e4 factor.
+    3) Distribution cost is calculated for those pixels that their corresponding
+    pipe diameter is equal or greater than 0.
+    the input heat density map should be in GWh/km2.
+    The computed rasters are stored in results (see results.Results).
+    """
+    dh_demand_scenarios([P], [results], d_a_slope, d_a_intercept, data_type)
+
+
+def dh_demand_scenarios(
+    Ps, scenario_results, d_a_slope=0.0486, d_a_intercept=0.0007, data_type="float32"
+):
+    """
+    Same as dh_demand(), for several scenarios evaluated at once. The results of
+    the scenarios must have the same input rasters: the rasters computed for
+    each scenario are stored in its results.
+    """
+    inputs = scenario_results[0]
+    hdm_st = inputs.hdm_st.astype("float32")
+    hdm_end = inputs.hdm_end.astype("float32")
+    # gfa in hectare should be divided by 10000 to get right values for plot ratio (m2/m2).
+    plot_ratio = inputs.gfa_st.astype("float32") / 10000
+    row, col = np.nonzero((hdm_st > 0) & (hdm_end > 0) & (plot_ratio > 0.0))
+    # unit conversion from MWh/ha to GJ/m2
+    sparse_demand = 0.00036 * hdm_st[row, col]
+    plot_ratio_sparse = plot_ratio[row, col]
+    hdm_change_ratio_sparse = hdm_end[row, col] / hdm_st[row, col]
+    (
+        q_max,
+        q,
+        abs_investment_total,
+        ll,
+        ll_service_pipes,
+        investment_dist,
+        investment_service_pipes,
+    ) = sparse_investment(
+        Ps,
+        sparse_demand,
+        plot_ratio_sparse,
+        hdm_change_ratio_sparse,
+        d_a_slope,
+        d_a_intercept,
     )
-    CM19.main(OFP.inv_sum, geo_transform, data_type, final_investment)
+
+    def to_raster(values):
+        raster = np.zeros_like(hdm_st, dtype=data_type)
+        raster[row, col] = values
+        return raster
+
+    for i, results in enumerate(scenario_results):
+        # DH demand density in MWh within the study horizon
+        results.maxDHdem = to_raster(q_max[i] * 10000 / 3.6)
+        results.supplied_heat_during_investment_period = to_raster(q[i] * 10000 / 3.6)
+        results.invest_Euro = to_raster(abs_investment_total[i])
+        # Length of distribution pipes (L)
+        results.total_dist_pipe_length = to_raster(ll[i])
+        results.total_serv_pipe_length = to_raster(ll_service_pipes[i])
+        # from Euro/GJ to Euro/MWh
+        results.inv_dist = to_raster(investment_dist[i] * 3.6)
+        results.inv_service_pipe = to_raster(investment_service_pipes[i] * 3.6)
+        results.inv_sum = to_raster(
+            (investment_dist[i] + investment_service_pipes[i]) * 3.6
+        )
@@ -5,16 +5,44 @@ import numpy as np
 from scipy.ndimage import measurements
 
 import CM.CM_TUW4.district_heating_potential as DHP
-from CM.CM_TUW1.read_raster import raster_array
 from CM.CM_TUW4.polygonize import polygonize
-from CM.CM_TUW19 import run_cm as CM19
 
 path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if path not in sys.path:
     sys.path.append(path)
 
 
-def distribuition_costs(P, OFP, struct=np.ones((3, 3))):
+# Distance (in pixels) up to which the dilation followed by the erosion of
+# DHP.DHRegions() depends on the neighbouring pixels
+CLOSING_MARGIN = 2
+
+
+def _make_candidate(shape, obj=None, pixels=None):
+    """Return the window and the mask of a region of the map, with a margin
+    large enough for DHP.DHRegions() to find the same coherent areas within the
+    region as on the whole map
+    """
+    if obj is None:
+        return tuple(slice(0, size) for size in shape), np.ones(shape, dtype=bool)
+    window = tuple(
+        slice(max(o.start - CLOSING_MARGIN, 0), min(o.stop + CLOSING_MARGIN, size))
+        for o, size in zip(obj, shape)
+    )
+    mask = np.zeros(tuple(w.stop - w.start for w in window), dtype=bool)
+    mask[
+        tuple(slice(o.start - w.start, o.stop - w.start) for o, w in zip(obj, window))
+    ] = pixels
+    return window, mask
+
+
+def _lowest_value_above(array, threshold):
+    values = array[array > threshold]
+    if values.size == 0:
+        return np.inf
+    return np.min(values)
+
+
+def distribuition_costs(P, OFP, results, struct=np.ones((3, 3))):
     """
     For the explanation of input parameters, refer to the calculation_module.py!
 
@@ -27,72 +55,115 @@ def distribuition_costs(P, OFP, struct=np.ones((3, 3))):
 
     In this code, the highest priority is given to the coherent areas with highest demand.
     """
+    pix_threshold_st = P.pix_threshold
+    coh_areas, pix_threshold = coherent_areas(P, results, struct)
+    print(
+        "%s pixel thresholds - st: %s , end: %s"
+        % (P.country, pix_threshold_st, pix_threshold)
+    )
+    # labels, numLabels = measurements.label(coh_areas, structure=struct)
 
+    results.coh_area_bool = coh_areas
+    hdm_copy = results.hdm_end.astype(float)
+    DHPot, labels = DHP.DHPotential(coh_areas, hdm_copy)
+    results.labels = labels
+    print("number of labels: ", np.max(labels))
+    if np.max(labels) > 0:
+        polygonize(
+            coh_areas,
+            labels,
+            results.geo_transform,
+            OFP.output_shp1,
+            OFP.output_shp2,
+            DHPot,
+        )
+
+
+def coherent_areas(P, results, struct=np.ones((3, 3))):
+    """
+    Find the coherent areas (see distribuition_costs()), by raising the pixel
+    threshold until no more region is found. Return the boolean array of the
+    coherent areas, and the final pixel threshold.
+    """
     # increased_total_investment = (
     #     P.investment_increasing_factor * P.total_investment_annuity
     # )
-    invest_Euro_arr = raster_array(OFP.invest_Euro)
-    supplied_heat_horizon = raster_array(OFP.supplied_heat_during_investment_period)
-    maxDHdem = raster_array(OFP.maxDHdem)
+    invest_Euro_arr = results.invest_Euro.astype(float)
+    supplied_heat_horizon = results.supplied_heat_during_investment_period.astype(float)
+    maxDHdem = results.maxDHdem.astype(float)
     reg_filter = supplied_heat_horizon.astype(bool).astype("int8")
-    # hdm_cut_last_year_arr, geo_transform = raster_array(OFP.hdm_cut_last_year, return_gt=True)
-    hdm_cut_last_year_arr, geo_transform = raster_array(
-        OFP.inRasterHDM_end, return_gt=True
-    )
-    hdm_copy = hdm_cut_last_year_arr.copy()
+    # hdm_cut_last_year_arr = results.hdm_cut_last_year.astype(float)
+    hdm_cut_last_year_arr = results.hdm_end.astype(float)
     hdm_cut_last_year_arr *= reg_filter
-    rast_origin = geo_transform[0], geo_transform[3]
     coh_areas = np.zeros_like(supplied_heat_horizon, "int8")
     flag = True
     DH_threshold_MWh = P.DH_threshold * 1000
     pix_threshold = P.pix_threshold
-    pix_threshold_st = P.pix_threshold
+    # Parts of the map which may still contain coherent areas, as (window, mask
+    # of the pixels within the window). At a given pixel threshold, the coherent
+    # areas are always contained in the ones found at the previous threshold
+    # which were neither accepted nor rejected: only those are examined again.
+    candidates = [_make_candidate(hdm_cut_last_year_arr.shape)]
     while flag:
         # calculate coherent regions with given thresholds
-        # DH_Regions: boolean array showing DH regions
+        # (same as DHP.DHReg, but only within the candidates)
+        next_candidates = []
+        zeroed_areas = []
+        nr_coherent = 0
+        for window, mask in candidates:
+            hdm_window = hdm_cut_last_year_arr[window]
+            hdm_filtered = hdm_window * (hdm_window > pix_threshold)
+            # DH_Regions: boolean array showing DH regions
+            DH_Regions = DHP.DHRegions(hdm_filtered, DH_threshold_MWh) & mask
+            # multiplication with reg_filter required to follow out_raster_maxDHdem
+            # pattern and separate connection of regions with pixels that have
+            # value of zero in out_raster_maxDHdem
+            result = DH_Regions.astype(int)
+            labels, nr_window_coherent = measurements.label(result, structure=struct)
+            objects = measurements.find_objects(labels)
+            nr_coherent += nr_window_coherent
+            for i, obj in enumerate(objects):
+                tmp_lbl_pixels = labels[obj] == i + 1
+                obj = tuple(
+                    slice(w.start + o.start, w.start + o.stop)
+                    for w, o in zip(window, obj)
+                )
+                q = np.sum(supplied_heat_horizon[obj][tmp_lbl_pixels])
+                q_max = np.sum(maxDHdem[obj][tmp_lbl_pixels])
+                q_inv = np.sum(invest_Euro_arr[obj][tmp_lbl_pixels])
+                q_spec_cost = q_inv / q
 
-        DH_Regions, hdm_dh_region_cut, gt, total_heat_demand = DHP.DHReg(
-            hdm_cut_last_year_arr, pix_threshold, P.DH_threshold, rast_origin
-        )
-        # multiplication with reg_filter required to follow out_raster_maxDHdem
-        # pattern and separate connection of regions with pixels that have
-        # value of zero in out_raster_maxDHdem
-        result = DH_Regions.astype(int)
-        labels, nr_coherent = measurements.label(result, structure=struct)
-        objects = measurements.find_objects(labels)
+                # DH Threshold to MW
+                if q_max < DH_threshold_MWh:
+                    zeroed_areas.append((obj, tmp_lbl_pixels))
+                    continue
+                if q_spec_cost <= P.distribution_grid_cost_ceiling:
+                    coh_areas[obj][tmp_lbl_pixels] = 1
+                    zeroed_areas.append((obj, tmp_lbl_pixels))
+                    continue
+                next_candidates.append(
+                    _make_candidate(hdm_cut_last_year_arr.shape, obj, tmp_lbl_pixels)
+                )
         if nr_coherent == 0:
             flag = False
             continue
-        for i, obj in enumerate(objects):
-            lbl_slice = labels[obj]
-            tmp_lbl_pixels = lbl_slice == i + 1
-            q = np.sum(supplied_heat_horizon[obj][tmp_lbl_pixels])
-            q_max = np.sum(maxDHdem[obj][tmp_lbl_pixels])
-            q_inv = np.sum(invest_Euro_arr[obj][tmp_lbl_pixels])
-            q_spec_cost = q_inv / q
-
-            # DH Threshold to MW
-            if q_max < DH_threshold_MWh:
-                hdm_cut_last_year_arr[obj][tmp_lbl_pixels] = 0
-                continue
-            if q_spec_cost <= P.distribution_grid_cost_ceiling:
-                coh_areas[obj][tmp_lbl_pixels] = 1
-                hdm_cut_last_year_arr[obj][tmp_lbl_pixels] = 0
+        # the heat demand map is only modified once all the regions are found,
+        # like when they are computed on the whole map
+        for obj, tmp_lbl_pixels in zeroed_areas:
+            hdm_cut_last_year_arr[obj][tmp_lbl_pixels] = 0
+        candidates = next_candidates
+        previous_pix_threshold = pix_threshold
         pix_threshold += 10
+        if (len(zeroed_areas) == 0) and (len(candidates) > 0):
+            # nothing changed: the same regions are found again until the
+            # threshold reaches the value of one of the pixels of the candidates
+            lowest = min(
+                _lowest_value_above(
+                    hdm_cut_last_year_arr[window], previous_pix_threshold
+                )
+                for window, _ in candidates
+            )
+            while np.isfinite(lowest) and (pix_threshold < lowest):
+                pix_threshold += 10
         labels = None
-    labels = None
-    nr_coherent = None
-    print(
-        "%s pixel thresholds - st: %s , end: %s"
-        % (P.country, pix_threshold_st, pix_threshold)
-    )
-    # labels, numLabels = measurements.label(coh_areas, structure=struct)
-
-    CM19.main(OFP.coh_area_bool, geo_transform, "int8", coh_areas)
-    DHPot, labels = DHP.DHPotential(coh_areas, hdm_copy)
-    CM19.main(OFP.labels, geo_transform, "int16", labels)
-    print("number of labels: ", np.max(labels))
-    if np.max(labels) > 0:
-        polygonize(
-            OFP.coh_area_bool, OFP.labels, OFP.output_shp1, OFP.output_shp2, DHPot
-        )
+    return coh_areas, pix_threshold
@@ -7,8 +7,6 @@ import pandas as pd
 from osgeo import ogr
 from scipy.ndimage import measurements
 
-from CM.CM_TUW1.read_raster import raster_array as RA
-
 path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if path not in sys.path:
     sys.path.append(path)
@@ -21,19 +19,20 @@ def measure_sum(arr, labels, index, factor=1):
         return np.round_(factor * measurements.sum(arr, labels, index), 2)
 
 
-def summary(P, OFP, struct=np.ones((3, 3))):
-    labels_org = RA(OFP.labels)
+def summary(P, OFP, results, struct=np.ones((3, 3))):
+    # copies of the arrays, as they are modified below
+    labels_org = results.labels.astype(float)
     labels_arr = labels_org.astype(bool).astype(int)
     zero_elements = np.where(labels_arr == 0)
-    maxDHdem_arr = RA(OFP.maxDHdem)
-    supplied_heat_horizon = RA(OFP.supplied_heat_during_investment_period)
-    invest_Euro_arr = RA(OFP.invest_Euro)
-    hdm_cut_st_arr = RA(OFP.inRasterHDM_st)
-    hdm_cut_end_arr = RA(OFP.inRasterHDM_end)
-    gfa_cut_st_arr = RA(OFP.inRasterGFA_st)
-    gfa_cut_end_arr = RA(OFP.inRasterGFA_end)
-    total_dist_pipe_length = RA(OFP.total_dist_pipe_length)
-    total_serv_pipe_length = RA(OFP.total_serv_pipe_length)
+    maxDHdem_arr = results.maxDHdem.astype(float)
+    supplied_heat_horizon = results.supplied_heat_during_investment_period.astype(float)
+    invest_Euro_arr = results.invest_Euro.astype(float)
+    hdm_cut_st_arr = results.hdm_st.astype(float)
+    hdm_cut_end_arr = results.hdm_end.astype(float)
+    gfa_cut_st_arr = results.gfa_st.astype(float)
+    gfa_cut_end_arr = results.gfa_end.astype(float)
+    total_dist_pipe_length = results.total_dist_pipe_length.astype(float)
+    total_serv_pipe_length = results.total_serv_pipe_length.astype(float)
 
     supplied_heat_horizon[zero_elements] = 0
     maxDHdem_arr[zero_elements] = 0
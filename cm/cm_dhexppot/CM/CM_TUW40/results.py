@@ -0,0 +1,95 @@
+import os
+import sys
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from CM.CM_TUW1.read_raster import raster_array as RA
+from CM.CM_TUW19 import run_cm as CM19
+
+path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if path not in sys.path:
+    sys.path.append(path)
+
+# Names of the rasters produced by the stages, as in Out_File_Path
+OUTPUT_RASTERS = (
+    "maxDHdem",
+    "supplied_heat_during_investment_period",
+    "invest_Euro",
+    "total_dist_pipe_length",
+    "total_serv_pipe_length",
+    "inv_dist",
+    "inv_service_pipe",
+    "inv_sum",
+    "coh_area_bool",
+    "labels",
+)
+
+# Data type of the rasters when saved, if different from the one of the array
+RASTER_DATA_TYPES = {
+    "coh_area_bool": "int8",
+    "labels": "int16",
+}
+
+
+@dataclass
+class Results:
+    """
+    Rasters shared by the stages of the calculation (see f1_main_call.main()),
+    kept in memory as arrays with the same geo transform. The rasters are only
+    saved as files (at the paths of Out_File_Path) when needed.
+    """
+
+    geo_transform: Tuple[float, ...]
+    # inputs
+    hdm_st: np.ndarray
+    hdm_end: np.ndarray
+    gfa_st: np.ndarray
+    gfa_end: np.ndarray
+    # f2_investment.dh_demand()
+    maxDHdem: Optional[np.ndarray] = None
+    supplied_heat_during_investment_period: Optional[np.ndarray] = None
+    invest_Euro: Optional[np.ndarray] = None
+    total_dist_pipe_length: Optional[np.ndarray] = None
+    total_serv_pipe_length: Optional[np.ndarray] = None
+    inv_dist: Optional[np.ndarray] = None
+    inv_service_pipe: Optional[np.ndarray] = None
+    inv_sum: Optional[np.ndarray] = None
+    # f3_coherent_areas.distribuition_costs()
+    coh_area_bool: Optional[np.ndarray] = None
+    labels: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_files(cls, OFP):
+        """
+        Read the input rasters. A raster used for several inputs is only read
+        once: the stages never modify the input arrays.
+        """
+        hdm_st, geo_transform = RA(OFP.inRasterHDM_st, return_gt=True)
+        gfa_st = RA(OFP.inRasterGFA_st)
+        if OFP.inRasterHDM_end == OFP.inRasterHDM_st:
+            hdm_end = hdm_st
+        else:
+            hdm_end = RA(OFP.inRasterHDM_end)
+        if OFP.inRasterGFA_end == OFP.inRasterGFA_st:
+            gfa_end = gfa_st
+        else:
+            gfa_end = RA(OFP.inRasterGFA_end)
+        return cls(geo_transform, hdm_st, hdm_end, gfa_st, gfa_end)
+
+    def save(self, OFP, name):
+        """Save one of the output rasters, and return its path"""
+        array = getattr(self, name)
+        if array is None:
+            raise ValueError(f"The raster has not been computed: {name}")
+        out_raster_path = getattr(OFP, name)
+        data_type = RASTER_DATA_TYPES.get(name, str(array.dtype))
+        CM19.main(out_raster_path, self.geo_transform, data_type, array)
+        return out_raster_path
+
+    def save_all(self, OFP):
+        """Save all the output rasters computed so far (for debugging)"""
+        for name in OUTPUT_RASTERS:
+            if getattr(self, name) is not None:
+                self.save(OFP, name)
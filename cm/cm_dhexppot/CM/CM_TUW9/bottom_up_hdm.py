@@ -4,6 +4,7 @@ import sys
 
 import numpy as np
 import pandas as pd
+from BaseCM.cm_aggregation import label_sums
 
 import CM.CM_TUW19.run_cm as CM19
 
@@ -46,31 +47,12 @@ def zonStat_selectedArea(
     xWidth = np.max(xIndex) - np.min(xIndex) + 1
     yWidth = np.max(yIndex) - np.min(yIndex) + 1
     index = xIndex + xWidth * yIndex
-    # The number of rows of "index" and "demand" must be equal.
-    sortedData = np.asarray(sorted(zip(index, demand), key=lambda x: x[0]))
-    sortedData_GFA = np.asarray(sorted(zip(index, GFA), key=lambda x: x[0]))
-    unique, counts = np.unique(index, return_counts=True)
-    end = np.cumsum(counts)
-    st = np.concatenate((np.zeros((1)), end[0 : end.size - 1]))
+    # sum of demand for each index
     # xIndex and yIndex start from 0. So they should be added by 1
-    sumDem = np.zeros((np.max(xIndex) + 1) * (np.max(yIndex) + 1))
-    item_location = 0
+    n_index = (np.max(xIndex) + 1) * (np.max(yIndex) + 1)
+    sumDem = label_sums(index, demand, n_index - 1)
     if GFA_valid:
-        sumGFA = np.zeros_like(sumDem)
-        for item in unique:
-            # sum of demand for each index
-            startIndex = int(st[item_location])
-            endIndex = int(end[item_location])
-            sumDem[item] = np.sum(sortedData[startIndex:endIndex, 1])
-            sumGFA[item] = np.sum(sortedData_GFA[startIndex:endIndex, 1])
-            item_location += 1
-    else:
-        for item in unique:
-            # sum of demand for each index
-            startIndex = int(st[item_location])
-            endIndex = int(end[item_location])
-            sumDem[item] = np.sum(sortedData[startIndex:endIndex, 1])
-            item_location += 1
+        sumGFA = label_sums(index, GFA, n_index - 1)
     """
     xWidth and yWidth in the following refer to columns and rows,
     respectively and should not wrongly be considered as coordination!
@@ -6,11 +6,11 @@ import pandas as pd
 from BaseCM.cm_output import validate
 
 from CM.CM_TUW0.rem_mk_dir import rm_mk_dir
-from CM.CM_TUW40.f1_main_call import main
+from CM.CM_TUW40.f1_main_call import main, main_scenarios
 from CM.CM_TUW40.f4_results_summary import summary
 from initialize import Out_File_Path, Param
 from tools.geofile import clip_raster
-from tools.response import get_response
+from tools.response import get_response, get_sweep_response
 
 
 def logfile(P, OFP):
@@ -63,13 +63,16 @@ def res_calculation(
         OFP = Out_File_Path(directory, in_raster_hdm, in_raster_gfa, params)
         rm_mk_dir(OFP.dstDir)
         logfile(P, OFP)
-        main(P, OFP)
-        result_dict = summary(P, OFP)
+        results = main(P, OFP)
+        result_dict = summary(P, OFP, results)
         output_layer_selection_dict = {
-            "Specific network costs": OFP.inv_sum,
-            "Potential district heating areas": OFP.coh_area_bool,
+            "Specific network costs": "inv_sum",
+            "Potential district heating areas": "coh_area_bool",
         }
-        output_layer = output_layer_selection_dict[P.output_layer_selection]
+        # only the selected output layer is saved as a file
+        output_layer = results.save(
+            OFP, output_layer_selection_dict[P.output_layer_selection]
+        )
         if not_test_mode:
             if os.path.isfile(output_layer):
                 with open(output_layer, mode="rb") as raster_fd:
@@ -83,3 +86,47 @@ def res_calculation(
         )
     validate(response)
     return response
+
+
+def res_sweep_calculation(
+    region: dict,
+    in_raster_hdm_large,
+    in_raster_gfa_large,
+    params_list: list,
+):
+    """
+    Run the calculation for several sets of parameters (scenarios) on the same
+    region: the rasters are clipped and read once, and the indicators of all the
+    scenarios are returned in a single response. No raster is posted.
+    """
+    Ps = [Param(params) for params in params_list]
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    with TemporaryDirectory(dir=current_dir) as directory:
+        if not os.path.isdir(directory) or not os.path.exists(directory):
+            raise NotADirectoryError(f"Directory not created : {directory}")
+        else:
+            logging.info(msg=f"Dir created : {directory}")
+        in_raster_hdm = os.path.join(directory, "hdm.tif")
+        in_raster_gfa = os.path.join(directory, "gfa.tif")
+        clip_raster(in_raster_hdm_large, region, in_raster_hdm)
+        clip_raster(in_raster_gfa_large, region, in_raster_gfa)
+        OFPs = []
+        for index, (P, params) in enumerate(zip(Ps, params_list)):
+            # the outputs of each scenario are in a distinct directory, as
+            # several scenarios may have the same case
+            scenario_directory = os.path.join(directory, str(index))
+            os.mkdir(scenario_directory)
+            OFP = Out_File_Path(
+                scenario_directory, in_raster_hdm, in_raster_gfa, params
+            )
+            rm_mk_dir(OFP.dstDir)
+            logfile(P, OFP)
+            OFPs.append(OFP)
+        scenario_results = main_scenarios(Ps, OFPs)
+        result_dicts = [
+            summary(P, OFP, results)
+            for P, OFP, results in zip(Ps, OFPs, scenario_results)
+        ]
+        response = get_sweep_response(Ps, result_dicts)
+    validate(response)
+    return response
@@ -1,8 +1,19 @@
 import json
 import os
+from types import SimpleNamespace
 
 # import unittest
-from calculation_module import res_calculation
+import jsonschema
+import numpy as np
+from scipy.ndimage import measurements
+
+import CM.CM_TUW4.district_heating_potential as DHP
+from calculation_module import res_calculation, res_sweep_calculation
+from CM.CM_TUW40.f2_investment import (dh_demand, discounted_sums, max_connection_share,
+                                       sparse_investment)
+from CM.CM_TUW40.f3_coherent_areas import coherent_areas
+from CM.CM_TUW40.results import Results
+from initialize import Param
 
 CURRENT_FILE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -70,6 +81,391 @@ def test_dhexppot():
     """
 
 
+def test_discounted_sums():
+    horizon = np.array([[2], [14], [40]])
+    log_x = np.log(np.array([0.95, 1 / 1.02, 1.0, 1 + 1e-7, 1.03]))
+    s0, s1 = discounted_sums(log_x, horizon)
+    for row, h in enumerate(horizon[:, 0]):
+        years = np.arange(h)[:, np.newaxis]
+        x_years = np.exp(log_x) ** years
+        assert np.allclose(s0[row], np.sum(x_years, axis=0), rtol=1e-9)
+        assert np.allclose(s1[row], np.sum(years * x_years, axis=0), rtol=1e-9)
+
+
+def test_max_connection_share():
+    horizon = 14
+    log_e = np.log(np.array([0.9, 0.99, 1.0, 1.05]))
+    for a, b in [(0.3, 0.02), (0.5, -0.02), (0.2, 0.0), (0.0, 0.05)]:
+        share = max_connection_share(log_e, a, b, horizon)
+        years = np.arange(horizon)[:, np.newaxis]
+        expected = np.max(np.exp(log_e * years) * (a + b * years), axis=0)
+        assert np.allclose(share, np.maximum(expected, 0))
+
+
+class ScenarioParams:
+    def __init__(self, **kwargs):
+        self.start_year = 2022
+        self.last_year = 2035
+        self.depreciation_period = 40
+        self.interest = 0.03
+        self.st_dh_connection_rate = 0.3
+        self.end_dh_connection_rate = 0.5
+        self.c1 = 349
+        self.c2 = 4213
+        self.__dict__.update(kwargs)
+
+
+def legacy_sparse_investment(
+    P,
+    sparse_demand,
+    plot_ratio_sparse,
+    hdm_change_ratio_sparse,
+    d_a_slope=0.0486,
+    d_a_intercept=0.0007,
+):
+    """Previous implementation of the investment model (one scenario, with a loop
+    over the years), used as reference
+    """
+
+    def annuity(r, period):
+        period = int(period)
+        r = float(r)
+        if r == 0:
+            return 1
+        return ((1 + r) ** period - 1) / (r * (1 + r) ** period)
+
+    def calc_adjustment_factor(market_share):
+        market_share_in_percent = market_share * 100
+        if market_share_in_percent < 20:
+            market_share_in_percent = 20
+        adjustment_factor = 0.604 * np.log(market_share_in_percent) - 1.7815
+        if adjustment_factor > 1:
+            adjustment_factor = 1
+        return adjustment_factor
+
+    horizon = int(P.last_year) - int(P.start_year) + 1
+    if horizon > int(P.depreciation_period):
+        horizon = P.depreciation_period
+        remaining_years = 0
+        reinvestment_factor = 1
+    else:
+        remaining_years = int(P.depreciation_period) - int(horizon)
+        reinvestment_factor = 1 + remaining_years / P.depreciation_period
+    energy_reduction_factor_sparse = hdm_change_ratio_sparse ** (1 / (horizon - 1))
+    adjustment_factor = calc_adjustment_factor(P.end_dh_connection_rate)
+    pr_upper = (plot_ratio_sparse > np.exp(-2)).astype(int)
+    pr_lower = (plot_ratio_sparse <= np.exp(-2)).astype(int)
+    ll = 1 / (
+        pr_lower * np.exp(2) * adjustment_factor / plot_ratio_sparse
+        + pr_upper * np.exp(4)
+    )
+    ll_service_pipes = 1 / (
+        pr_lower * np.exp(2) * adjustment_factor / plot_ratio_sparse
+        + pr_upper
+        * np.exp(
+            pr_upper
+            * (np.log(plot_ratio_sparse) + 3.5)
+            / (0.7737 + 0.18559 * np.log(plot_ratio_sparse))
+        )
+    )
+    q = 0
+    q_max = np.zeros_like(sparse_demand)
+    q_new = 0
+    for i in range(horizon):
+        erfs = energy_reduction_factor_sparse ** i
+        q_tot = sparse_demand * erfs
+        tmp1 = float(P.st_dh_connection_rate)
+        tmp2 = i * (float(P.end_dh_connection_rate) - float(P.st_dh_connection_rate))
+        q_new = q_tot * (tmp1 + tmp2 / (horizon - 1))
+        q_max = np.max((q_max, q_new), axis=0)
+        q += q_new / (1 + float(P.interest)) ** i
+    if remaining_years > 0:
+        if P.interest > 0:
+            alpha_horizon = annuity(P.interest, horizon - 1)
+            alpha_depreciation = annuity(P.interest, P.depreciation_period)
+            rest_annuity_factor = alpha_depreciation - alpha_horizon
+            q = q + q_new * rest_annuity_factor
+        else:
+            q = q + q_new * remaining_years
+    linear_heat_density = q_max / ll
+    linear_heat_density_service_pipes = q_max / ll_service_pipes
+    lhd_threshold = -d_a_intercept / d_a_slope
+    filtered_ldh = (np.log(linear_heat_density) < lhd_threshold).astype(int)
+    elements = np.nonzero(filtered_ldh)[0]
+    d_a = d_a_slope * (np.log(linear_heat_density)) + d_a_intercept
+    d_a[elements] = 0
+    d_a_service_pipes = np.zeros_like(d_a)
+    d_a[
+        ((linear_heat_density < 1.5).astype(int) * (d_a > 0).astype(int)).astype(bool)
+    ] = 0.02
+    d_a_service_pipes[
+        (
+            (linear_heat_density_service_pipes < 1.5).astype(int)
+            * (d_a > 0.02).astype(int)
+        ).astype(bool)
+    ] = 0.02
+    d_a_service_pipes[
+        (
+            (linear_heat_density_service_pipes >= 1.5).astype(int)
+            * (d_a > 0.03).astype(int)
+        ).astype(bool)
+    ] = 0.03
+    d_a_service_pipes[elements] = 0
+    q_max[elements] = 0
+    abs_investment_dist = 1e4 * ll * (P.c1 + P.c2 * d_a)
+    abs_investment_service_pipes = (
+        1e4 * ll_service_pipes * (P.c1 + P.c2 * d_a_service_pipes)
+    )
+    abs_investment_total = abs_investment_dist + abs_investment_service_pipes
+    abs_investment_dist[elements] = 0
+    abs_investment_service_pipes[elements] = 0
+    abs_investment_total[elements] = 0
+    investment_dist = 1e-4 * reinvestment_factor * abs_investment_dist / q
+    investment_service_pipes = (
+        1e-4 * reinvestment_factor * abs_investment_service_pipes / q
+    )
+    q[elements] = 0
+    return q_max, q, abs_investment_total, investment_dist + investment_service_pipes
+
+
+def test_sparse_investment():
+    rng = np.random.default_rng(0)
+    size = 1000
+    # heat demands (MWh/ha) converted to GJ/m2, including low ones for which no
+    # grid is built
+    sparse_demand = 0.00036 * rng.uniform(1, 1000, size)
+    plot_ratio_sparse = rng.uniform(0.01, 2, size)
+    hdm_change_ratio_sparse = rng.uniform(0.6, 1.2, size)
+    hdm_change_ratio_sparse[:100] = 1
+
+    Ps = [
+        # remaining_years > 0
+        ScenarioParams(),
+        # interest == 0
+        ScenarioParams(interest=0),
+        # horizon > depreciation_period
+        ScenarioParams(last_year=2060, depreciation_period=20),
+        # decreasing connection rate
+        ScenarioParams(st_dh_connection_rate=0.6, end_dh_connection_rate=0.2),
+    ]
+    (
+        q_max,
+        q,
+        abs_investment_total,
+        _,
+        _,
+        investment_dist,
+        investment_service_pipes,
+    ) = sparse_investment(Ps, sparse_demand, plot_ratio_sparse, hdm_change_ratio_sparse)
+
+    for i, P in enumerate(Ps):
+        (
+            legacy_q_max,
+            legacy_q,
+            legacy_abs_investment_total,
+            legacy_investment,
+        ) = legacy_sparse_investment(
+            P, sparse_demand, plot_ratio_sparse, hdm_change_ratio_sparse
+        )
+        assert np.allclose(q_max[i], legacy_q_max, rtol=1e-7, atol=0)
+        assert np.allclose(q[i], legacy_q, rtol=1e-7, atol=0)
+        assert np.allclose(
+            abs_investment_total[i], legacy_abs_investment_total, rtol=1e-7, atol=0
+        )
+        assert np.allclose(
+            investment_dist[i] + investment_service_pipes[i],
+            legacy_investment,
+            rtol=1e-7,
+            atol=0,
+            equal_nan=True,
+        )
+
+
+def legacy_coherent_areas(P, results, struct=np.ones((3, 3))):
+    """Previous implementation of the search of the coherent areas (a sweep of the
+    pixel thresholds over the whole map), used as reference
+    """
+    invest_Euro_arr = results.invest_Euro.astype(float)
+    supplied_heat_horizon = results.supplied_heat_during_investment_period.astype(float)
+    maxDHdem = results.maxDHdem.astype(float)
+    reg_filter = supplied_heat_horizon.astype(bool).astype("int8")
+    hdm_cut_last_year_arr = results.hdm_end.astype(float)
+    hdm_cut_last_year_arr *= reg_filter
+    rast_origin = results.geo_transform[0], results.geo_transform[3]
+    coh_areas = np.zeros_like(supplied_heat_horizon, "int8")
+    flag = True
+    DH_threshold_MWh = P.DH_threshold * 1000
+    pix_threshold = P.pix_threshold
+    while flag:
+        DH_Regions, hdm_dh_region_cut, gt, total_heat_demand = DHP.DHReg(
+            hdm_cut_last_year_arr, pix_threshold, P.DH_threshold, rast_origin
+        )
+        result = DH_Regions.astype(int)
+        labels, nr_coherent = measurements.label(result, structure=struct)
+        objects = measurements.find_objects(labels)
+        if nr_coherent == 0:
+            flag = False
+            continue
+        for i, obj in enumerate(objects):
+            lbl_slice = labels[obj]
+            tmp_lbl_pixels = lbl_slice == i + 1
+            q = np.sum(supplied_heat_horizon[obj][tmp_lbl_pixels])
+            q_max = np.sum(maxDHdem[obj][tmp_lbl_pixels])
+            q_inv = np.sum(invest_Euro_arr[obj][tmp_lbl_pixels])
+            q_spec_cost = q_inv / q
+            if q_max < DH_threshold_MWh:
+                hdm_cut_last_year_arr[obj][tmp_lbl_pixels] = 0
+                continue
+            if q_spec_cost <= P.distribution_grid_cost_ceiling:
+                coh_areas[obj][tmp_lbl_pixels] = 1
+                hdm_cut_last_year_arr[obj][tmp_lbl_pixels] = 0
+        pix_threshold += 10
+    return coh_areas, pix_threshold
+
+
+def assert_same_coherent_areas(P, results):
+    coh_areas, pix_threshold = coherent_areas(P, results)
+    legacy_coh_areas, legacy_pix_threshold = legacy_coherent_areas(P, results)
+    assert np.array_equal(coh_areas, legacy_coh_areas)
+    assert pix_threshold == legacy_pix_threshold
+    _, labels = DHP.DHPotential(coh_areas, results.hdm_end.astype(float))
+    _, legacy_labels = DHP.DHPotential(legacy_coh_areas, results.hdm_end.astype(float))
+    assert np.array_equal(labels, legacy_labels)
+    return coh_areas
+
+
+def test_coherent_areas():
+    hdm_raster_path = get_testdata_path("test_hdm_vienna.tif")
+    gfa_raster_path = get_testdata_path("test_gfa_vienna.tif")
+    inputs = Results.from_files(
+        SimpleNamespace(
+            inRasterHDM_st=hdm_raster_path,
+            inRasterHDM_end=hdm_raster_path,
+            inRasterGFA_st=gfa_raster_path,
+            inRasterGFA_end=gfa_raster_path,
+        )
+    )
+    for ceiling in (15, 20, 35):
+        params = createParams(True)
+        params["st_dh_connection_rate"] = 0.3
+        params["end_dh_connection_rate"] = 0.5
+        params["distribution_grid_cost_ceiling"] = ceiling
+        P = Param(params)
+        results = Results(
+            inputs.geo_transform,
+            inputs.hdm_st,
+            inputs.hdm_end,
+            inputs.gfa_st,
+            inputs.gfa_end,
+        )
+        dh_demand(P, results)
+        assert_same_coherent_areas(P, results)
+
+
+def test_coherent_areas_nearby_clusters():
+    rng = np.random.default_rng(0)
+    shape = (80, 80)
+    # scattered pixels, most of them close enough to be connected by the dilation
+    # and erosion of DHRegions()
+    hdm = rng.uniform(20, 400, shape) * (rng.random(shape) < 0.4)
+    # clusters separated by one empty column: only connected by the dilation and
+    # erosion, the cheap one being only accepted once the threshold removes the
+    # expensive one
+    hdm[5:10, :] = 0
+    hdm[5:9, 10:14] = 150
+    hdm[5:10, 15:20] = 50
+    hdm[5:8, 30:33] = 300
+    hdm[5:10, 34:40] = 60
+    supplied_heat = 10 * hdm
+    # the specific costs (EUR/MWh) decrease with the heat demand
+    invest_Euro = supplied_heat * 6000 / (hdm + 100)
+    results = Results(
+        (0.0, 100.0, 0.0, 0.0, 0.0, -100.0),
+        hdm,
+        hdm,
+        np.zeros(shape),
+        np.zeros(shape),
+        maxDHdem=0.5 * hdm,
+        supplied_heat_during_investment_period=supplied_heat,
+        invest_Euro=invest_Euro,
+    )
+    for ceiling in (15, 20, 30):
+        P = SimpleNamespace(
+            country="AT",
+            pix_threshold=35,
+            DH_threshold=0.2,
+            distribution_grid_cost_ceiling=ceiling,
+        )
+        coh_areas = assert_same_coherent_areas(P, results)
+        assert coh_areas.any()
+
+
+def test_dhexppot_sweep():
+    selection = load_geojson("wien_sued.geojson")
+    hdm_raster_paths = get_testdata_path("test_hdm_vienna.tif")
+    gfa_raster_paths = get_testdata_path("test_gfa_vienna.tif")
+    scenarios = [
+        {"distribution_grid_cost_ceiling": 20},
+        {"distribution_grid_cost_ceiling": 40, "interest": 0.05},
+        {"st_dh_connection_rate": 0.2, "end_dh_connection_rate": 0.6},
+    ]
+    params_list = [{**createParams(True), **scenario} for scenario in scenarios]
+    response = res_sweep_calculation(
+        selection,
+        hdm_raster_paths,
+        gfa_raster_paths,
+        [dict(params) for params in params_list],
+    )
+    # same indicators as when the scenarios are calculated one by one
+    for index, params in enumerate(params_list):
+        single_response = res_calculation(
+            selection,
+            hdm_raster_paths,
+            gfa_raster_paths,
+            params,
+            task=None,
+            not_test_mode=False,
+        )
+        for indicator, value in single_response["values"].items():
+            sweep_value = response["values"][f"Scenario {index + 1} - {indicator}"]
+            assert np.isclose(sweep_value, value), indicator
+
+
+def test_sweep_schema():
+    with open(os.path.join(CURRENT_FILE_DIR, "schema_sweep.json")) as fd:
+        schema = json.load(fd)
+
+    params = createParams(True)
+    # the connection rates of createParams() are in percent
+    params["st_dh_connection_rate"] = 0.3
+    params["end_dh_connection_rate"] = 0.5
+    params["Required map"] = "Heat density map"
+    params["scenarios"] = [
+        {"distribution_grid_cost_ceiling": 20},
+        {"interest": 0.05, "st_dh_connection_rate": 0.2},
+    ]
+    jsonschema.validate(params, schema=schema)
+
+    for scenarios in (
+        [],
+        [{"distribution_grid_cost_ceiling": 20}] * 51,
+        ["not a dict"],
+        [{"country": "DE"}],
+    ):
+        try:
+            jsonschema.validate({**params, "scenarios": scenarios}, schema=schema)
+        except jsonschema.ValidationError:
+            continue
+        raise AssertionError(f"Invalid scenarios accepted: {scenarios}")
+
+
 if __name__ == "__main__":
     # unittest.main()
     test_dhexppot()
+    test_discounted_sums()
+    test_max_connection_share()
+    test_sparse_investment()
+    test_coherent_areas()
+    test_coherent_areas_nearby_clusters()
+    test_dhexppot_sweep()
+    test_sweep_schema()
@@ -1,69 +1,10 @@
 import numpy as np
+from BaseCM.cm_aggregation import label_sums
 from scipy.ndimage import binary_dilation, binary_erosion, measurements
 
 from .geofile import read_raster
 
 
-class MapSizeError(Exception):
-    """
-    Exception thrown when two maps is compared but
-    but do not have the same size error.
-    """
-
-    pass
-
-
-def get_browsing_indexes(
-    labels_array: np.ndarray, pixel_filtered_map: np.ndarray, n_label: int
-):
-    """
-    This function :
-        * find the row, the column, the label, the value of each non-null pixel in list,
-        * sort this list based on the label and save it as numpy array,
-        * and then calculate the indexes of the first and the last element
-          of the sorted list that belongs to the same label.
-
-    Afterwards, the sorted list will be browsed piece by piece
-    (i.e. label by label) thanks to the indexes.
-
-    Inputs :
-        * labels_array : label map.
-        * pixel_filtered_map : pixel filtered map.
-        * labels_number : number of labels.
-
-    Outputs :
-        * end : list of index of the first element of given label.
-        * start : list of index of the first element of given label.
-        * sorted_array : array (1xn) sorted by labels of rows, columns,
-                         labels, value of each non-null pixel.
-    """
-    if labels_array.shape != pixel_filtered_map.shape:
-        raise MapSizeError("The maps used have not the same size.")
-
-    rows, columns = np.nonzero(labels_array)
-    labels = labels_array[rows, columns]
-    district_heating = pixel_filtered_map[rows, columns]
-    sorted_array = np.asarray(
-        sorted(
-            zip(rows, columns, labels, district_heating),
-            key=lambda items: items[2],
-        )
-    )
-
-    unique_items, counts = np.unique(labels, return_counts=True)
-    end = np.cumsum(counts)
-    a = 0
-    b = n_label - 1
-    start = np.concatenate(
-        (
-            np.zeros((1)),
-            end[a:b],
-        )
-    )
-
-    return end.astype(int), start.astype(int), sorted_array
-
-
 def define_areas(
     pixel_filtered_map: np.ndarray, district_heating_zone_threshold: float
 ):
@@ -102,21 +43,17 @@ def define_areas(
     )
 
     # labels start from 1, therefore the array size is 'num_labels_array + 1'
-    areas_potential = np.zeros((n_label + 1)).astype(float)
-    if n_label > 0:
-        end, start, sorted_array = get_browsing_indexes(
-            labels_array=labels_array,
-            pixel_filtered_map=pixel_filtered_map,
-            n_label=n_label,
-        )
-
-        for i, (start_index, end_index) in enumerate(zip(start, end)):
-            area = sorted_array[start_index:end_index, 3]
-            area_potential = np.sum(area)
-            if area_potential >= district_heating_zone_threshold:
-                # i+1 because labeling starts from 1 and not from 0
-                # factor 0.001 for conversion from MWh/ha to GWh/ha
-                areas_potential[i + 1] = np.around(np.sum(area_potential) / 1000, 2)
+    areas_potential = label_sums(
+        labels=labels_array, values=pixel_filtered_map, n_labels=n_label
+    )
+    areas_potential[0] = 0
+
+    # factor 0.001 for conversion from MWh/ha to GWh/ha
+    areas_potential = np.where(
+        areas_potential >= district_heating_zone_threshold,
+        np.around(areas_potential / 1000, 2),
+        0,
+    )
 
     areas = areas_potential[labels_array]
     filtered_map = pixel_filtered_map * (areas > 0).astype(int)
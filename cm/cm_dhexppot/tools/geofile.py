@@ -1,11 +1,12 @@
-import json
-import tempfile
-from os import remove, system
 from os.path import exists, isfile, splitext
 
 import numpy as np
 import rasterio
 from osgeo import gdal, osr
+from rasterio.crs import CRS
+from rasterio.mask import mask
+from rasterio.transform import Affine
+from rasterio.warp import transform_geom
 
 
 def get_projection(geofile: str):
@@ -24,41 +25,105 @@ class RasterNotOverlappedError(Exception):
     pass
 
 
+def clip_raster_array(src: str, shapes: dict):
+    """
+    Take a raster and clip it according to polygon defined as a dictionary,
+    without writing anything on disk.
+
+    Only the window of the raster covering the polygon is read, and the pixels
+    outside of the polygon (or without data) are set to 0.
+
+    Inputs :
+        * src : path to the to be clipped raster.
+        * shapes : GeoJSON geometry, feature or feature collection (in EPSG:4326,
+                   unless a 'crs' member is present).
+
+    Outputs :
+        * array : clipped map array.
+        * geotransform : geo transform of the clipped map array.
+        * projection : projection of the clipped map array.
+    """
+    if not isfile(src):
+        raise FileNotFoundError(f"The src file does not existed: {src}")
+
+    geometries, crs = get_geometries(shapes)
+
+    with rasterio.open(src) as dataset:
+        if crs != dataset.crs:
+            geometries = [
+                transform_geom(crs, dataset.crs, geometry) for geometry in geometries
+            ]
+
+        try:
+            array, transform = mask(dataset, geometries, crop=True, nodata=0, indexes=1)
+        except ValueError:
+            raise RasterNotOverlappedError("Map return is empty.")
+
+        projection = dataset.crs
+
+    if np.max(array) == 0:
+        raise RasterNotOverlappedError("Map return is empty.")
+
+    return array, transform.to_gdal(), projection
+
+
+def get_geometries(shapes: dict):
+    """
+    Return the list of geometries of a GeoJSON object, and their projection.
+    """
+    crs = CRS.from_epsg(4326)
+    if "crs" in shapes:
+        srs = osr.SpatialReference()
+        srs.SetFromUserInput(shapes["crs"]["properties"]["name"])
+        crs = CRS.from_wkt(srs.ExportToWkt())
+
+    if shapes["type"] == "FeatureCollection":
+        geometries = [feature["geometry"] for feature in shapes["features"]]
+    elif shapes["type"] == "Feature":
+        geometries = [shapes["geometry"]]
+    else:
+        geometries = [shapes]
+
+    return [x for x in geometries if x is not None], crs
+
+
 def clip_raster(src: str, shapes: dict, dst: str, quiet: bool = True):
     """
     Take a raster and clip it according to polygon defined as a dictionary,
     then save the result.
 
+    Use clip_raster_array() instead when the clipped raster isn't needed as a
+    file.
+
     Inputs :
         * src : path to the to be clipped raster.
         * shapes : list of dictionaries representing polygons.
         * dst : path where the clipped raster is saved.
+        * quiet : unused, kept for compatibility.
 
     Output :
         * projection : projection of the clipped raster.
     """
-    if not isfile(src):
-        raise FileNotFoundError(f"The src file does not existed: {src}")
-
-    (fd, cutline) = tempfile.mkstemp()
-    with open(fd, "w") as file:
-        json.dump(shapes, file)
-
-    command = (
-        f'gdalwarp -of GTIFF -cutline {cutline} -crop_to_cutline -dstnodata 0 "{src}"'
-        f' "{dst}"'
-    )
-    if quiet:
-        command += " -q"
-
-    system(command=command)
-    remove(cutline)
+    array, geotransform, projection = clip_raster_array(src=src, shapes=shapes)
+
+    with rasterio.open(
+        dst,
+        "w",
+        driver="GTiff",
+        height=array.shape[0],
+        width=array.shape[1],
+        count=1,
+        dtype=array.dtype,
+        crs=projection,
+        transform=Affine.from_gdal(*geotransform),
+        nodata=0,
+    ) as dst_file:
+        dst_file.write(array, 1)
 
     if not isfile(dst):
         raise FileNotFoundError(f"The result file has not been created: {dst}")
-    clipped_raster = read_raster(dst, return_geo_transform=False)
-    if np.max(clipped_raster) == 0:
-        raise RasterNotOverlappedError("Map return is empty.")
+
+    return projection
 
 
 def read_raster(raster: str, return_geo_transform: bool = True):
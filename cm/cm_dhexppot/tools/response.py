@@ -5,6 +5,59 @@ import numpy as np
 from matplotlib import cm as colormap
 
 
+def get_values(P, result_dict) -> dict:
+    """
+    Compute the indicators of the CM.
+
+    Inputs :
+        * P : parameters of the CM.
+        * result_dict : summary of the DH areas (see f4_results_summary.summary).
+
+    Output :
+        * values : value of each indicator.
+    """
+    if np.sum(result_dict["supplied_heat_over_investment_period [TWh]"]) > 0:
+
+        ave_dh_grid_costs = np.round_(
+            (
+                np.sum(result_dict["gridCost [MEUR]"])
+                / np.sum(result_dict["supplied_heat_over_investment_period [TWh]"])
+            ),
+            2,
+        )
+    else:
+        ave_dh_grid_costs = 0
+
+    return {
+        "Starting connection rate (%)": 100 * P.st_dh_connection_rate,
+        "End connection rate (%)": 100 * P.end_dh_connection_rate,
+        "Grid cost ceiling (EUR/MWh)": P.distribution_grid_cost_ceiling,
+        "Start year - Heat demand in DH areas (GWh)": round(
+            float(np.sum(result_dict["demand_st [GWh]"])), 1
+        ),
+        "End year - Heat demand in areas (GWh)": round(
+            float(np.sum(result_dict["demand_end [GWh]"])), 1
+        ),
+        "Start year - Heat coverage by DH areas (GWh)": round(
+            float(np.sum(result_dict["dhPot_%s [GWh]" % P.start_year])), 1
+        ),
+        "End year - Heat coverage by DH areas (GWh)": round(
+            float(np.sum(result_dict["dhPot_%s [GWh]" % P.last_year])), 1
+        ),
+        "Total supplied heat by DH over the investment period (TWh)": round(
+            float(np.sum(result_dict["supplied_heat_over_investment_period [TWh]"])),
+            1,
+        ),
+        "Average DH grid cost in DH areas (EUR/MWh)": float(ave_dh_grid_costs),
+        "Total DH distribution grid length (km)": round(
+            float(np.sum(result_dict["trench_len_dist [km]"])), 1
+        ),
+        "Total DH service pipe length (km)": round(
+            float(np.sum(result_dict["trench_len_serv [km]"])), 1
+        ),
+    }
+
+
 def get_response(
     P,
     result_dict,
@@ -65,48 +118,7 @@ def get_response(
             * base_dictionary : updated dictionary.
         """
 
-        if np.sum(result_dict["supplied_heat_over_investment_period [TWh]"]) > 0:
-
-            ave_dh_grid_costs = np.round_(
-                (
-                    np.sum(result_dict["gridCost [MEUR]"])
-                    / np.sum(result_dict["supplied_heat_over_investment_period [TWh]"])
-                ),
-                2,
-            )
-        else:
-            ave_dh_grid_costs = 0
-
-        base_dictionary["values"] = {
-            "Starting connection rate (%)": 100 * P.st_dh_connection_rate,
-            "End connection rate (%)": 100 * P.end_dh_connection_rate,
-            "Grid cost ceiling (EUR/MWh)": P.distribution_grid_cost_ceiling,
-            "Start year - Heat demand in DH areas (GWh)": round(
-                float(np.sum(result_dict["demand_st [GWh]"])), 1
-            ),
-            "End year - Heat demand in areas (GWh)": round(
-                float(np.sum(result_dict["demand_end [GWh]"])), 1
-            ),
-            "Start year - Heat coverage by DH areas (GWh)": round(
-                float(np.sum(result_dict["dhPot_%s [GWh]" % P.start_year])), 1
-            ),
-            "End year - Heat coverage by DH areas (GWh)": round(
-                float(np.sum(result_dict["dhPot_%s [GWh]" % P.last_year])), 1
-            ),
-            "Total supplied heat by DH over the investment period (TWh)": round(
-                float(
-                    np.sum(result_dict["supplied_heat_over_investment_period [TWh]"])
-                ),
-                1,
-            ),
-            "Average DH grid cost in DH areas (EUR/MWh)": float(ave_dh_grid_costs),
-            "Total DH distribution grid length (km)": round(
-                float(np.sum(result_dict["trench_len_dist [km]"])), 1
-            ),
-            "Total DH service pipe length (km)": round(
-                float(np.sum(result_dict["trench_len_serv [km]"])), 1
-            ),
-        }
+        base_dictionary["values"] = get_values(P, result_dict)
 
         return base_dictionary
 
@@ -219,3 +231,38 @@ def get_response(
         # response["legend"] = dict()
 
     return response
+
+
+def get_sweep_response(Ps, result_dicts) -> dict:
+    """
+    Generate the dictionary returned by the CM for several scenarios: the
+    indicators of each scenario, and a graph comparing the scenarios for each
+    indicator.
+
+    Inputs :
+        * Ps : parameters of each scenario.
+        * result_dicts : summary of the DH areas of each scenario.
+
+    Output :
+        * response : dictionary that will be sent by the CM.
+    """
+    response = {"graphs": [], "geofiles": {}, "values": {}}
+    scenario_values = [
+        get_values(P, result_dict) for P, result_dict in zip(Ps, result_dicts)
+    ]
+    for index, values in enumerate(scenario_values):
+        for indicator, value in values.items():
+            response["values"][f"Scenario {index + 1} - {indicator}"] = value
+    for indicator in scenario_values[0]:
+        response["graphs"].append(
+            {
+                indicator: {
+                    "type": "bar",
+                    "values": [
+                        (f"Scenario {index + 1}", values[indicator])
+                        for index, values in enumerate(scenario_values)
+                    ],
+                }
+            }
+        )
+    return response
@@ -1,28 +1,22 @@
 #!/usr/bin/env python3
-from os.path import isfile, splitext
+from os.path import dirname, isfile, join, splitext
 
 import BaseCM.cm_base as cm_base
 import BaseCM.cm_input as cm_input
 
-from calculation_module import res_calculation
+from calculation_module import res_calculation, res_sweep_calculation
 
 app = cm_base.get_default_app("DH_Economic_Assessment")
 schema_path = cm_base.get_default_schema_path()
+# Same parameters as schema.json, plus the list of scenarios
+sweep_schema_path = join(dirname(schema_path), "schema_sweep.json")
 input_layers_path = cm_base.get_default_input_layers_path()
 wiki = "https://enermaps-wiki.herokuapp.com/en/sample.md"
 
 
-@app.task(
-    base=cm_base.CMBase,
-    bind=True,
-    schema_path=schema_path,
-    input_layers_path=input_layers_path,
-    wiki=wiki,
-)
-def DH_Economic_Assessment(self, selection: dict, rasters: list, params: dict):
-    """This calculation module calculates the DH potentials.
-    If there is no raster, we raise a value error.
-    If there are many rasters, we select the first one.
+def get_input_rasters(selection: dict, rasters: list, params: dict):
+    """Check the selection and the rasters, and return the paths of the input
+    rasters (heat density map and gross floor area).
     """
     if params["Required map"] == "Heat density map":
         hdm_layer = (
@@ -39,24 +33,75 @@ def DH_Economic_Assessment(self, selection: dict, rasters: list, params: dict):
         raise ValueError("The selection must be a feature set.")
     if not selection["features"]:
         raise ValueError("The selection must be non-empty.")
-    self.validate_params(params)
-
     for raster_file in rasters:
         raster = cm_input.get_raster_path(raster_file)
         name, extension = splitext(raster)
         if not isfile(raster) or extension.lower() not in [".tif", ".tiff"]:
             raise TypeError(f"The file path is not correct: {raster}")
+    return [cm_input.get_raster_path(raster_file) for raster_file in rasters[:2]]
+
+
+@app.task(
+    base=cm_base.CMBase,
+    bind=True,
+    schema_path=schema_path,
+    input_layers_path=input_layers_path,
+    wiki=wiki,
+)
+def DH_Economic_Assessment(self, selection: dict, rasters: list, params: dict):
+    """This calculation module calculates the DH potentials.
+    If there is no raster, we raise a value error.
+    If there are many rasters, we select the first one.
+    """
+    rasters = get_input_rasters(selection, rasters, params)
+    self.validate_params(params)
 
     region = cm_input.merged_polygons(selection=selection)
     result = res_calculation(
         region=region,
-        in_raster_hdm_large=cm_input.get_raster_path(rasters[0]),
-        in_raster_gfa_large=cm_input.get_raster_path(rasters[1]),
+        in_raster_hdm_large=rasters[0],
+        in_raster_gfa_large=rasters[1],
         params=params,
         task=self,
     )
     return result
 
 
+@app.task(
+    base=cm_base.CMBase,
+    bind=True,
+    schema_path=sweep_schema_path,
+    input_layers_path=input_layers_path,
+    wiki=wiki,
+)
+def DH_Economic_Assessment_Sweep(self, selection: dict, rasters: list, params: dict):
+    """This calculation module calculates the DH potentials of several
+    scenarios on the same selection.
+    The parameters of each scenario are the ones of params["scenarios"] (e.g.
+    the cost ceiling, the interest rate or the connection rates), the other
+    parameters being the same for all the scenarios (see schema_sweep.json).
+    """
+    scenarios = params.get("scenarios")
+    if not isinstance(scenarios, list) or not scenarios:
+        raise ValueError("The parameters must contain a non-empty list of scenarios.")
+    for scenario in scenarios:
+        if not isinstance(scenario, dict):
+            raise ValueError(f"The parameters of a scenario must be a dict: {scenario}")
+    rasters = get_input_rasters(selection, rasters, params)
+    self.validate_params(params)
+
+    common_params = {key: value for key, value in params.items() if key != "scenarios"}
+    params_list = [{**common_params, **scenario} for scenario in scenarios]
+
+    region = cm_input.merged_polygons(selection=selection)
+    result = res_sweep_calculation(
+        region=region,
+        in_raster_hdm_large=rasters[0],
+        in_raster_gfa_large=rasters[1],
+        params_list=params_list,
+    )
+    return result
+
+
 if __name__ == "__main__":
     cm_base.start_app(app)
@@ -2,7 +2,7 @@ from os.path import join
 from tempfile import TemporaryDirectory
 
 from BaseCM.cm_output import validate
-from BaseCM.cm_raster import clip_raster, get_projection, write_raster
+from BaseCM.cm_raster import clip_raster_array, write_raster
 
 from tools import settings
 from tools.areas import get_areas
@@ -27,11 +27,11 @@ def processing(task, region: dict, raster: str, parameters: dict):
         * Layer : Areas that pass the filters.
     """
 
-    with TemporaryDirectory(dir=settings.TESTDATA_DIR) as temp_dir:
-
-        clipped_raster = join(temp_dir, "raster_tmp.tif")
-        clip_raster(src=raster, shapes=region, dst=clipped_raster)
+    clipped_map, clipped_geo_transform, projection = clip_raster_array(
+        src=raster, shapes=region
+    )
 
+    with TemporaryDirectory(dir=settings.TESTDATA_DIR) as temp_dir:
         (
             geo_transform,
             total_heat_demand,
@@ -40,7 +40,8 @@ def processing(task, region: dict, raster: str, parameters: dict):
             total_potential,
             areas_potential,
         ) = get_areas(
-            heat_density_map=clipped_raster,
+            heat_density_map=clipped_map,
+            geo_transform=clipped_geo_transform,
             pixel_threshold=parameters["Heat demand in hectare (MWh/ha)"],
             district_heating_zone_threshold=parameters[
                 "Heat demand in a DH zone (GWh/year)"
@@ -50,7 +51,7 @@ def processing(task, region: dict, raster: str, parameters: dict):
         dst_raster = join(temp_dir, "dst.tif")
         write_raster(
             map_array=filtered_map,
-            projection=get_projection(geofile=clipped_raster),
+            projection=projection,
             geotransform=geo_transform,
             dst=dst_raster,
         )
@@ -1,68 +1,8 @@
 import numpy as np
-from BaseCM.cm_raster import read_raster
+from BaseCM.cm_aggregation import label_sums
 from scipy.ndimage import binary_dilation, binary_erosion, measurements
 
 
-class MapSizeError(Exception):
-    """
-    Exception thrown when two maps is compared but
-    but do not have the same size error.
-    """
-
-    pass
-
-
-def get_browsing_indexes(
-    labels_array: np.ndarray, pixel_filtered_map: np.ndarray, n_label: int
-):
-    """
-    This function :
-        * find the row, the column, the label, the value of each non-null pixel in list,
-        * sort this list based on the label and save it as numpy array,
-        * and then calculate the indexes of the first and the last element
-          of the sorted list that belongs to the same label.
-
-    Afterwards, the sorted list will be browsed piece by piece
-    (i.e. label by label) thanks to the indexes.
-
-    Inputs :
-        * labels_array : label map.
-        * pixel_filtered_map : pixel filtered map.
-        * labels_number : number of labels.
-
-    Outputs :
-        * end : list of index of the first element of given label.
-        * start : list of index of the first element of given label.
-        * sorted_array : array (1xn) sorted by labels of rows, columns,
-                         labels, value of each non-null pixel.
-    """
-    if labels_array.shape != pixel_filtered_map.shape:
-        raise MapSizeError("The maps used have not the same size.")
-
-    rows, columns = np.nonzero(labels_array)
-    labels = labels_array[rows, columns]
-    district_heating = pixel_filtered_map[rows, columns]
-    sorted_array = np.asarray(
-        sorted(
-            zip(rows, columns, labels, district_heating),
-            key=lambda items: items[2],
-        )
-    )
-
-    unique_items, counts = np.unique(labels, return_counts=True)
-    end = np.cumsum(counts)
-    a = 0
-    b = n_label - 1
-    start = np.concatenate(
-        (
-            np.zeros((1)),
-            end[a:b],
-        )
-    )
-
-    return end.astype(int), start.astype(int), sorted_array
-
-
 def define_areas(
     pixel_filtered_map: np.ndarray, district_heating_zone_threshold: float
 ):
@@ -101,21 +41,17 @@ def define_areas(
     )
 
     # labels start from 1, therefore the array size is 'num_labels_array + 1'
-    areas_potential = np.zeros((n_label + 1)).astype(float)
-    if n_label > 0:
-        end, start, sorted_array = get_browsing_indexes(
-            labels_array=labels_array,
-            pixel_filtered_map=pixel_filtered_map,
-            n_label=n_label,
-        )
-
-        for i, (start_index, end_index) in enumerate(zip(start, end)):
-            area = sorted_array[start_index:end_index, 3]
-            area_potential = np.sum(area)
-            if area_potential >= district_heating_zone_threshold:
-                # i+1 because labeling starts from 1 and not from 0
-                # factor 0.001 for conversion from MWh/ha to GWh/ha
-                areas_potential[i + 1] = np.around(np.sum(area_potential) / 1000, 2)
+    areas_potential = label_sums(
+        labels=labels_array, values=pixel_filtered_map, n_labels=n_label
+    )
+    areas_potential[0] = 0
+
+    # factor 0.001 for conversion from MWh/ha to GWh/ha
+    areas_potential = np.where(
+        areas_potential >= district_heating_zone_threshold,
+        np.around(areas_potential / 1000, 2),
+        0,
+    )
 
     areas = areas_potential[labels_array]
     filtered_map = pixel_filtered_map * (areas > 0).astype(int)
@@ -124,7 +60,8 @@ def define_areas(
 
 
 def get_areas(
-    heat_density_map: str,
+    heat_density_map: np.ndarray,
+    geo_transform: tuple,
     pixel_threshold: float,
     district_heating_zone_threshold: float,
 ):
@@ -137,7 +74,9 @@ def get_areas(
 
     Inputs :
         * heat_density_map :
-            path to the clipped raster (MWh) - a value between 0 and 1.000.
+            clipped map array (MWh) - a value between 0 and 1.000.
+        * geo_transform :
+            geo transform of the clipped map array.
         * pixel_threshold :
             threshold that each pixel must reach (MWh) - a value between 0 and 500.
         * district_heating_zone_threshold :
@@ -164,7 +103,7 @@ def get_areas(
                 the other zones is returned in practice
     """
     # array_map units : MWh
-    array_map, geo_transform = read_raster(raster=heat_density_map)
+    array_map = heat_density_map.astype(float)
 
     # total_heat_demand units : GWh
     total_heat_demand = np.around(np.sum(array_map) / 1000, 2)
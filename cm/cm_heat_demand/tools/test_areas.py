@@ -2,25 +2,28 @@ import unittest
 
 import numpy as np
 
-from .areas import MapSizeError, get_browsing_indexes
+from .areas import define_areas
 
 
 class TestAreasTools(unittest.TestCase):
-    def test_wrong_map_size(self):
+    def test_define_areas(self):
         """
-        Test if a MapSizeError is raised when where the map size
-        and the labels map size is not the same.
+        Test that only the areas whose potential reaches the threshold
+        are kept, with their potential in GWh.
         """
+        pixel_filtered_map = np.zeros((10, 12))
+        pixel_filtered_map[2:4, 2:4] = 1000
+        pixel_filtered_map[6:8, 7:10] = 100
 
-        labels_map_size = (2, 3)
-        map_size = (2, 2)
-        self.assertNotEqual(labels_map_size, map_size)
-        with self.assertRaises(MapSizeError):
-            get_browsing_indexes(
-                labels_array=np.zeros(labels_map_size),
-                pixel_filtered_map=np.zeros(map_size),
-                n_label=0,
-            )
+        areas, filtered_map, total_potential, areas_potential = define_areas(
+            pixel_filtered_map=pixel_filtered_map,
+            district_heating_zone_threshold=1000,
+        )
+
+        self.assertEqual(list(areas_potential), [4.0, 0.0])
+        self.assertEqual(total_potential, 4.0)
+        self.assertTrue(np.all(areas[2:4, 2:4] == 4.0))
+        self.assertEqual(np.sum(filtered_map), 4000)
 
 
 if __name__ == "__main__":
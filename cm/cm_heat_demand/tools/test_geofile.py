@@ -140,6 +140,32 @@ class TestGeofileTools(unittest.TestCase):
         dst_map = geofile.read_raster(self.dst, return_geo_transform=False)
         self.assertGreaterEqual(np.mean(raster_map), np.mean(dst_map))
 
+    def test_clipping_raster_in_memory(self):
+        """
+        Try to clip a raster without saving the result, and compare it
+        with the saved one.
+        """
+        shapes = self.get_shapes(self.intercepted_region)
+        map_array, geotransform, projection = geofile.clip_raster_array(
+            src=self.raster, shapes=shapes
+        )
+        self.assertFalse(exists(self.dst))
+        self.assertEqual(projection.to_epsg(), 4326)
+
+        geofile.clip_raster(src=self.raster, shapes=shapes, dst=self.dst)
+        dst_map, dst_geotransform = geofile.read_raster(self.dst)
+        self.assertTrue(np.array_equal(map_array, dst_map))
+        self.assertEqual(geotransform, dst_geotransform)
+
+    def test_clipping_disjointed_raster_in_memory(self):
+        """
+        Try to clip raster with region disjointed form the raster, without
+        saving the result.
+        """
+        shapes = self.get_shapes(self.disjointed_region)
+        with self.assertRaises(geofile.RasterNotOverlappedError):
+            geofile.clip_raster_array(src=self.raster, shapes=shapes)
+
     def test_read_raster(self):
         """
         Try to read a raster as a map array and return the geotransform.